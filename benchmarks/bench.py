@@ -0,0 +1,505 @@
+"""Benchmarks the public methods of MongoDict and MongoList at several shelf sizes.
+
+Every method is timed, and the round trips and bytes it exchanges with the database are counted. Against the in-process mock (mongomock), every collection call counts as one round trip and the bytes are the BSON size of its arguments and results. Against a real mongod, commands are counted with pymongo command monitoring. Round trips and bytes do not depend on the machine, so they can be compared to a baseline to catch regressions:
+
+    python benchmarks/bench.py --output results.json
+    python benchmarks/bench.py --save-baseline benchmarks/baseline.json
+    python benchmarks/bench.py --sizes 10,1000 --compare benchmarks/baseline.json
+    python benchmarks/bench.py --backend mongodb --uri mongodb://localhost:27017
+
+It runs from a checkout without installing mongoshelve. The default mock backend needs mongomock (`pip install -e .[dev]`), which lacks a few operators used by mongoshelve. `_complete_mongomock` patches them into mongomock's modules in the benchmark's own process, so timings against the mock are only indicative and the mock results do not validate mongoshelve's semantics, which the test suite and the mongodb backend do.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from typing import Any, Callable, List, NamedTuple, Optional, Tuple
+import bson
+import pymongo
+from bson.errors import InvalidDocument
+from pymongo import monitoring
+
+# benchmark the checkout this script is in, whether or not mongoshelve is installed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mongoshelve import MongoDict, MongoList
+
+DEFAULT_SIZES = (10, 100, 1000, 10000, 100000)
+# methods of pymongo's Collection that send a command
+COMMANDS = {
+    "aggregate",
+    "bulk_write",
+    "count_documents",
+    "delete_many",
+    "delete_one",
+    "find",
+    "find_one",
+    "find_one_and_delete",
+    "find_one_and_update",
+    "insert_one",
+    "update_many",
+    "update_one",
+}
+# relative increase of the bytes exchanged by a call that is reported as a regression, as they vary slightly with the number of calls made
+BYTES_TOLERANCE = 0.1
+
+
+class Counts:
+    """Round trips and bytes exchanged with the database since the last `reset`."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.round_trips = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+
+def _size(value: Any) -> int:
+    """Approximate BSON size of the arguments or result of a collection method."""
+    if value is None:
+        return 0
+    if isinstance(value, (list, tuple)) and any(
+        hasattr(request, "_doc") for request in value
+    ):
+        # bulk_write requests
+        return sum(
+            _size({"q": request._filter, "u": request._doc}) for request in value
+        )
+    try:
+        return len(bson.encode(value if isinstance(value, dict) else {"v": value}))
+    except (InvalidDocument, TypeError):
+        return 0
+
+
+class _CountingCursor:
+    def __init__(self, cursor, counts: Counts):
+        self._cursor = iter(cursor)
+        self._counts = counts
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        document = next(self._cursor)
+        self._counts.bytes_received += _size(document)
+        return document
+
+
+class CountingCollection:
+    """Proxy of a collection that counts every command sent through it as one round trip. Used with mongomock, which does not publish command monitoring events."""
+
+    def __init__(self, collection, counts: Counts):
+        self._collection = collection
+        self._counts = counts
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self._collection, name)
+        if name not in COMMANDS:
+            return attribute
+
+        def command(*args, **kwargs):
+            self._counts.round_trips += 1
+            self._counts.bytes_sent += _size(list(args)) + _size(kwargs)
+            result = attribute(*args, **kwargs)
+            if name in ("find", "aggregate"):
+                return _CountingCursor(result, self._counts)
+            if isinstance(result, dict):
+                self._counts.bytes_received += _size(result)
+            return result
+
+        return command
+
+
+class CountingListener(monitoring.CommandListener):
+    """Counts the commands sent to a real mongod."""
+
+    def __init__(self, counts: Counts):
+        self._counts = counts
+
+    def started(self, event):
+        self._counts.round_trips += 1
+        self._counts.bytes_sent += _size(event.command)
+
+    def succeeded(self, event):
+        self._counts.bytes_received += _size(event.reply)
+
+    def failed(self, event):
+        pass
+
+
+class Operation(NamedTuple):
+    """A benchmarked call. `setup(shelf, i)` prepares the `i`-th call without being measured, and returns the arguments passed to `run`."""
+
+    name: str
+    run: Callable
+    setup: Optional[Callable] = None
+
+
+def _key(i: int, size: int) -> str:
+    return f"key{i % size}"
+
+
+def _set_temporary(shelf, i: int, size: int) -> Tuple[str]:
+    shelf[f"tmp{i}"] = i
+    return (f"tmp{i}",)
+
+
+def _append_temporary(shelf, i: int, size: int) -> Tuple[str]:
+    shelf.append(f"tmp{i}")
+    return (f"tmp{i}",)
+
+
+def _refill(shelf, i: int, size: int) -> tuple:
+    shelf.apply_default_value(overwrite=True)
+    return ()
+
+
+DICT_OPERATIONS = [
+    Operation("__getitem__", lambda d, i, n: d[_key(i, n)]),
+    Operation("__setitem__", lambda d, i, n: d.__setitem__(_key(i, n), i)),
+    Operation("__setitem__ (new key)", lambda d, i, n: d.__setitem__(f"new{i}", i)),
+    Operation("__delitem__", lambda d, key: d.__delitem__(key), _set_temporary),
+    Operation("__contains__", lambda d, i, n: _key(i, n) in d),
+    Operation("__len__", lambda d, i, n: len(d)),
+    Operation("__iter__", lambda d, i, n: list(d)),
+    Operation("__reversed__", lambda d, i, n: list(reversed(d))),
+    Operation("__eq__", lambda d, i, n: d == {}),
+    Operation("__repr__", lambda d, i, n: repr(d)),
+    Operation("get", lambda d, i, n: d.get(_key(i, n))),
+    Operation("keys", lambda d, i, n: list(d.keys())),
+    Operation("values", lambda d, i, n: list(d.values())),
+    Operation("items", lambda d, i, n: list(d.items())),
+    Operation("select", lambda d, i, n: d.select([_key(i, n), _key(i + 1, n)])),
+    Operation("find", lambda d, i, n: d.find({"$lt": 5})),
+    Operation("update", lambda d, i, n: d.update({_key(i, n): i, _key(i + 1, n): i})),
+    Operation("pop", lambda d, key: d.pop(key), _set_temporary),
+    Operation("popitem", lambda d, key: d.popitem(), _set_temporary),
+    Operation("incr", lambda d, i, n: d.incr("counter")),
+    Operation("mul", lambda d, i, n: d.mul("counter", 1)),
+    Operation("set_max", lambda d, i, n: d.set_max("counter", i)),
+    Operation("set_min", lambda d, i, n: d.set_min("counter", i)),
+    Operation("clear", lambda d: d.clear(), _refill),
+    Operation("copy", lambda d, i, n: d.copy()),
+    Operation("snapshot", lambda d, i, n: d.snapshot()),
+]
+
+LIST_OPERATIONS = [
+    Operation("__getitem__", lambda l, i, n: l[i % n]),
+    Operation("__getitem__ (slice)", lambda l, i, n: l[i % n : i % n + 10]),
+    Operation("__setitem__", lambda l, i, n: l.__setitem__(i % n, i)),
+    Operation("__contains__", lambda l, i, n: -1 in l),
+    Operation("__len__", lambda l, i, n: len(l)),
+    Operation("__iter__", lambda l, i, n: list(l)),
+    Operation("__reversed__", lambda l, i, n: list(reversed(l))),
+    Operation("__eq__", lambda l, i, n: l == []),
+    Operation("__repr__", lambda l, i, n: repr(l)),
+    Operation("__add__", lambda l, i, n: l + [i]),
+    Operation("__iadd__", lambda l, i, n: l.__iadd__([i])),
+    Operation("__mul__", lambda l, i, n: l * 2),
+    Operation("__imul__", lambda l, i, n: l.__imul__(1)),
+    Operation("index", lambda l, i, n: l.index(i % n)),
+    Operation("count", lambda l, i, n: l.count(i % n)),
+    Operation("append", lambda l, i, n: l.append(i)),
+    Operation("extend", lambda l, i, n: l.extend([i, i])),
+    Operation("insert", lambda l, i, n: l.insert(0, i)),
+    Operation("pop", lambda l, value: l.pop(), _append_temporary),
+    Operation("pop (first)", lambda l, value: l.pop(0), _append_temporary),
+    Operation("remove", lambda l, value: l.remove(value), _append_temporary),
+    Operation("reverse", lambda l, i, n: l.reverse()),
+    Operation("sort", lambda l, i, n: l.sort()),
+    Operation("clear", lambda l: l.clear(), _refill),
+    Operation("copy", lambda l, i, n: l.copy()),
+    Operation("snapshot", lambda l, i, n: l.snapshot()),
+]
+
+SUITES = {
+    "MongoDict": (
+        MongoDict,
+        lambda n: {**{f"key{j}": j for j in range(n)}, "counter": 1},
+        DICT_OPERATIONS,
+    ),
+    "MongoList": (MongoList, lambda n: list(range(n)), LIST_OPERATIONS),
+}
+
+
+def _percentile(latencies: List[float], fraction: float) -> float:
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def measure(
+    shelf,
+    operation: Operation,
+    size: int,
+    counts: Counts,
+    iterations: int,
+    max_time: float,
+) -> dict:
+    """Calls `operation` on `shelf` up to `iterations` times (but stops after `max_time` seconds), and returns its throughput, latency and the round trips and bytes of its most expensive call."""
+    latencies = []
+    round_trips = bytes_sent = bytes_received = 0
+    deadline = time.perf_counter() + max_time
+    for i in range(iterations):
+        if operation.setup is not None:
+            args = operation.setup(shelf, i, size)
+        else:
+            args = (i, size)
+        counts.reset()
+        start = time.perf_counter()
+        operation.run(shelf, *args)
+        latencies.append(time.perf_counter() - start)
+        round_trips = max(round_trips, counts.round_trips)
+        bytes_sent = max(bytes_sent, counts.bytes_sent)
+        bytes_received = max(bytes_received, counts.bytes_received)
+        if time.perf_counter() > deadline:
+            break
+    return {
+        "iterations": len(latencies),
+        "ops_per_sec": len(latencies) / sum(latencies),
+        "latency": {
+            "mean": statistics.mean(latencies),
+            "p50": _percentile(latencies, 0.5),
+            "p95": _percentile(latencies, 0.95),
+        },
+        "round_trips": round_trips,
+        "bytes_sent": bytes_sent,
+        "bytes_received": bytes_received,
+    }
+
+
+def run(
+    collection_factory: Callable[[], Any],
+    counts: Counts,
+    sizes=DEFAULT_SIZES,
+    suites=tuple(SUITES),
+    iterations: int = 50,
+    max_time: float = 1.0,
+    log=None,
+) -> List[dict]:
+    """Benchmarks every operation of `suites` at every size in `sizes`, each on a freshly filled shelf.
+
+    Args:
+        collection_factory (Callable[[], Any]): Returns an empty collection, whose commands are counted in `counts`.
+        counts (Counts): Counts of the round trips and bytes exchanged through the collections.
+        sizes (optional): Numbers of entries in the shelves. An operation that takes longer than `max_time` for one call is skipped at the larger sizes. Defaults to DEFAULT_SIZES.
+        suites (optional): Names of the classes to benchmark. Defaults to all of them.
+        iterations (int, optional): Maximum number of calls per operation. Defaults to 50.
+        max_time (float, optional): Seconds after which an operation is no longer called. Defaults to 1.0.
+        log (optional): File to report progress to. Defaults to None.
+
+    Returns:
+        List[dict]: One result per class, operation and size. Operations that failed have an `error` instead of measurements, and those that were too slow at a smaller size are `skipped`.
+    """
+    results = []
+    for suite in suites:
+        cls, default_value, operations = SUITES[suite]
+        too_slow = {}
+        for size in sorted(sizes):
+            for operation in operations:
+                result = {"class": suite, "method": operation.name, "size": size}
+                if operation.name in too_slow:
+                    # a single call would take even longer with more entries
+                    result["skipped"] = (
+                        f"skipped: slower than {max_time}s"
+                        f" at size {too_slow[operation.name]}"
+                    )
+                else:
+                    shelf = cls(
+                        collection_factory(),
+                        name="bench",
+                        default_value=default_value(size),
+                    )
+                    try:
+                        result.update(
+                            measure(
+                                shelf, operation, size, counts, iterations, max_time
+                            )
+                        )
+                    except Exception as e:
+                        result["error"] = f"{type(e).__name__}: {e}"
+                    else:
+                        if result["latency"]["mean"] > max_time:
+                            too_slow[operation.name] = size
+                results.append(result)
+                if log is not None:
+                    print(_format(result), file=log)
+    return results
+
+
+def _format(result: dict) -> str:
+    name = f"{result['class']}.{result['method']} [{result['size']}]"
+    if "error" in result or "skipped" in result:
+        return f"{name:<45} {result.get('error') or result['skipped']}"
+    return (
+        f"{name:<45} {result['ops_per_sec']:>10.1f} ops/s"
+        f" {result['latency']['p50'] * 1000:>9.3f} ms p50"
+        f" {result['round_trips']:>3} round trips"
+        f" {result['bytes_sent']:>9} B sent {result['bytes_received']:>9} B received"
+    )
+
+
+def baseline(results: List[dict]) -> List[dict]:
+    """Strips the timings from `results`, which depend on the machine, keeping what `compare` checks."""
+    fields = ("class", "method", "size", "round_trips", "bytes_sent")
+    fields += ("bytes_received", "error", "skipped")
+    return [
+        {field: result[field] for field in fields if field in result}
+        for result in results
+    ]
+
+
+def compare(results: List[dict], baseline: List[dict]) -> List[str]:
+    """Returns a description of every operation that failed, is missing from `baseline`, needs more round trips than in `baseline`, or exchanges more bytes (by more than `BYTES_TOLERANCE`). Operations that were skipped in either as too slow are not compared."""
+    expected = {
+        (result["class"], result["method"], result["size"]): result
+        for result in baseline
+    }
+    regressions = []
+    for result in results:
+        key = (result["class"], result["method"], result["size"])
+        name = f"{key[0]}.{key[1]} [{key[2]}]"
+        if "error" in result:
+            regressions.append(f"{name}: {result['error']}")
+            continue
+        if "skipped" in result:
+            continue
+        if key not in expected:
+            regressions.append(f"{name}: missing from the baseline")
+            continue
+        if "error" in expected[key] or "skipped" in expected[key]:
+            continue
+        if result["round_trips"] > expected[key]["round_trips"]:
+            regressions.append(
+                f"{name}: {result['round_trips']} round trips"
+                f" (baseline {expected[key]['round_trips']})"
+            )
+        for field in ("bytes_sent", "bytes_received"):
+            if result[field] > expected[key][field] * (1 + BYTES_TOLERANCE):
+                regressions.append(
+                    f"{name}: {result[field]} {field.replace('_', ' ')}"
+                    f" (baseline {expected[key][field]})"
+                )
+    return regressions
+
+
+def _complete_mongomock():
+    """Implements the operators used by mongoshelve that mongomock lacks (`$mul` updates, and the `$indexOfArray` and `$reverseArray` expressions) or gets wrong (`$slice` with computed bounds), so that every method can be measured against the mock. Only used by the benchmark, whose results against the mock are about round trips rather than exact semantics."""
+    from mongomock import aggregate, collection
+
+    def multiply(document, field, factor):
+        document[field] = document.get(field, 0) * factor
+
+    collection._updaters.setdefault("$mul", multiply)
+    handle_array_operator = aggregate._Parser._handle_array_operator
+    if getattr(handle_array_operator, "completed", False):
+        return
+
+    def complete_array_operator(parser, operator, value):
+        if operator == "$indexOfArray":
+            array, x, *bounds = [parser.parse(arg) for arg in value]
+            start, stop = (bounds + [0, len(array)][len(bounds) :])[:2]
+            for i in range(start, min(stop, len(array))):
+                if array[i] == x:
+                    return i
+            return -1
+        if operator == "$reverseArray":
+            return list(reversed(parser.parse(value)))
+        if operator == "$slice":
+            value = value[:1] + [parser.parse(arg) for arg in value[1:]]
+        return handle_array_operator(parser, operator, value)
+
+    complete_array_operator.completed = True
+    aggregate._Parser._handle_array_operator = complete_array_operator
+
+
+def _backend(name: str, uri: str, database: str) -> Tuple[Callable[[], Any], Counts]:
+    counts = Counts()
+    if name == "mock":
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit("The mock backend requires mongomock: pip install -e .[dev]")
+        _complete_mongomock()
+        client = mongomock.MongoClient()
+        wrap = lambda collection: CountingCollection(collection, counts)
+    else:
+        client = pymongo.MongoClient(uri, event_listeners=[CountingListener(counts)])
+        wrap = lambda collection: collection
+
+    def collection_factory():
+        collection = client[database]["bench"]
+        collection.drop()
+        counts.reset()
+        return wrap(collection)
+
+    return collection_factory, counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", choices=("mock", "mongodb"), default="mock")
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--database", default="mongoshelve_bench")
+    parser.add_argument(
+        "--sizes",
+        default=",".join(map(str, DEFAULT_SIZES)),
+        help="comma separated numbers of entries",
+    )
+    parser.add_argument(
+        "--suites", default=",".join(SUITES), help="comma separated class names"
+    )
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--max-time", type=float, default=1.0)
+    parser.add_argument("--output", help="file to save the results to, as JSON")
+    parser.add_argument(
+        "--save-baseline",
+        help="file to save the results to without their timings, for --compare",
+    )
+    parser.add_argument(
+        "--compare",
+        help="results file to compare round trips and bytes to, exits with 1 on errors or regressions",
+    )
+    args = parser.parse_args(argv)
+
+    collection_factory, counts = _backend(args.backend, args.uri, args.database)
+    results = run(
+        collection_factory,
+        counts,
+        sizes=[int(size) for size in args.sizes.split(",")],
+        suites=args.suites.split(","),
+        iterations=args.iterations,
+        max_time=args.max_time,
+        log=sys.stdout,
+    )
+    for path, saved in (
+        (args.output, results),
+        (args.save_baseline, baseline(results)),
+    ):
+        if path:
+            with open(path, "w") as f:
+                json.dump(
+                    {
+                        "backend": args.backend,
+                        "python": platform.python_version(),
+                        "pymongo": pymongo.version,
+                        "results": saved,
+                    },
+                    f,
+                    indent=1,
+                )
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f)["results"])
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
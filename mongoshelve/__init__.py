@@ -1,2 +1,13 @@
+from .base import ensure_indexes
+from .batch import ShelfBatch, shelf_batch
+from .chunked import ChunkedMongoList
+from .codecs import Codec, MsgpackCodec, PickleCodec
+from .deque import MongoDeque
 from .dict import MongoDict
 from .list import MongoList
+from .mirror import ShelfMirror, open_mirror
+from .perkey import PerKeyMongoDict
+from .snapshot import FrozenDict, FrozenList
+from .stats import STATS_LISTENER, disable_stats, enable_stats, reset_stats, stats
+from .utils import VersionConflictError
+from .aio import AsyncMongoDict, AsyncMongoList
@@ -0,0 +1,683 @@
+import asyncio
+import inspect
+from typing import Any, List, Optional, Tuple, Union
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from .base import MongoShelf
+from .codecs import Codec
+from .dict import MongoDict, UUID4_PLACEHOLDER
+from .list import MongoList
+from .snapshot import freeze
+from .stats import recorded
+from .utils import (
+    VERSION_FIELD,
+    VersionConflictError,
+    conflict_backoff,
+    escape_key,
+    get_path,
+    unescape_key,
+    version_condition,
+)
+
+
+@recorded
+class AsyncMongoShelf:
+    """Base class of the asyncio counterparts of MongoDict/MongoList. Every method that talks to the database is a coroutine, so many operations can be in flight concurrently without blocking the event loop.
+
+    `collection` can be a collection of any asyncio driver with the pymongo API, ie `pymongo.AsyncMongoClient` (pymongo >= 4.9), motor, or mongomock_motor for tests. The stored documents are the same as those of MongoDict/MongoList, so both can be used on the same data. Caching, watching, batching, write-behind and read preferences are only available on the synchronous classes.
+
+    Constructing an instance does not touch the database. Await it (`d = await AsyncMongoDict(...)`) to write its default value, like the synchronous constructor does.
+    """
+
+    _versioned = staticmethod(MongoShelf._versioned)
+    max_retries = MongoShelf.max_retries
+    _check_value = MongoShelf._check_value
+
+    def __init__(
+        self,
+        collection,
+        name: str,
+        codec: Optional[Codec] = None,
+        page_size: int = 1000,
+        _projection: str = "contents",
+    ):
+        self._collection = collection
+        self._projection = _projection
+        self.name = name
+        self.codec = codec
+        # elements or entries fetched per round trip while iterating
+        self.page_size = page_size
+
+    @property
+    def db_projection(self):
+        return self._projection
+
+    @property
+    def db_filter(self):
+        return {"name": self.name}
+
+    def __await__(self):
+        return self._open().__await__()
+
+    async def _open(self):
+        await self.apply_default_value(overwrite=False)
+        return self
+
+    async def apply_default_value(self, overwrite: bool = False):
+        """Writes `default_value` to the database. If the document does not exist yet it is created, otherwise the stored value is only replaced if `overwrite` is True.
+
+        Args:
+            overwrite (bool, optional): Replace the stored value if the document already exists. Defaults to False.
+        """
+        value = self._encode_all(self.default_value)
+        if overwrite:
+            update = {"$set": {self.db_projection: value}, "$inc": {VERSION_FIELD: 1}}
+        else:
+            update = {"$setOnInsert": {self.db_projection: value}}
+        try:
+            await self._collection.update_one(self.db_filter, update, upsert=True)
+        except DuplicateKeyError:
+            # see MongoShelf.apply_default_value
+            await self._collection.update_one(self.db_filter, update, upsert=True)
+
+    async def _fetch(self) -> Any:
+        """Reads the whole container from the database.
+
+        Raises:
+            ValueError: The document does not exist or has no value at `db_projection`.
+        """
+        return (await self._fetch_versioned())[0]
+
+    async def snapshot(self) -> Any:
+        """Returns a read-only, in-memory copy of the whole container, read with a single round trip, see `MongoShelf.snapshot`."""
+        return freeze(await self._fetch())
+
+    async def _fetch_versioned(self) -> Tuple[Any, int]:
+        """Like `_fetch`, but also returns the version of the document that the value was read at."""
+        document = await self._collection.find_one(
+            self.db_filter,
+            projection={"_id": 0, self.db_projection: 1, VERSION_FIELD: 1},
+        )
+        try:
+            value = self._decode_all(get_path(document or {}, self.db_projection))
+        except KeyError:
+            raise ValueError(
+                f"Entry {self.name} does not contain data at {self.db_projection}!"
+            ) from None
+        return value, document.get(VERSION_FIELD, 0)
+
+    async def _retry_on_conflict(self, attempt) -> Any:
+        """See `MongoShelf._retry_on_conflict`, `attempt` is a coroutine function."""
+        for i in range(self.max_retries + 1):
+            accepted, result = await attempt()
+            if accepted:
+                return result
+            await asyncio.sleep(conflict_backoff(i + 1))
+        raise VersionConflictError(
+            f"Entry {self.name} was modified concurrently {self.max_retries + 1} times in a row!"
+        )
+
+    async def _compare_and_swap(self, modify) -> Any:
+        """See `MongoShelf._compare_and_swap`, `modify(value)` returns the update to send and the result to return."""
+
+        async def attempt():
+            value, version = await self._fetch_versioned()
+            update, result = modify(value)
+            before = await self._write(
+                update, condition=version_condition(version), fetch={}
+            )
+            return before is not None, result
+
+        return await self._retry_on_conflict(attempt)
+
+    async def _cursor(self, pipeline: list, **kwargs):
+        """Opens an aggregation cursor on the document of this container. `aggregate` is a coroutine in pymongo's async API, but returns the cursor directly in motor."""
+        cursor = self._collection.aggregate(
+            [{"$match": self.db_filter}, *pipeline], **kwargs
+        )
+        if inspect.isawaitable(cursor):
+            cursor = await cursor
+        return cursor
+
+    async def _aggregate(self, pipeline: list) -> List[dict]:
+        """Runs an aggregation on the document of this container and returns all results."""
+        return await (await self._cursor(pipeline)).to_list(None)
+
+    async def _evaluate(self, expression: Any) -> Any:
+        """See `MongoShelf._evaluate`."""
+        result = await self._aggregate([{"$project": {"_id": 0, "result": expression}}])
+        if len(result) == 0:
+            raise ValueError(
+                f"Entry {self.name} does not contain data at {self.db_projection}!"
+            )
+        return result[0].get("result")
+
+    async def _write(
+        self,
+        update: Union[dict, list],
+        condition: Optional[dict] = None,
+        fetch: Optional[dict] = None,
+    ) -> Any:
+        """Sends a single update to the document of this container, incrementing its version. See `MongoShelf._write`."""
+        db_filter = {**self.db_filter, **(condition or {})}
+        update = self._versioned(update)
+        if fetch is None:
+            result = await self._collection.update_one(db_filter, update)
+            return result.matched_count > 0
+        return await self._collection.find_one_and_update(
+            db_filter,
+            update,
+            projection={**fetch, "_id": 0, "name": 1, VERSION_FIELD: 1},
+            return_document=ReturnDocument.BEFORE,
+        )
+
+
+@recorded
+class AsyncMongoDict(AsyncMongoShelf):
+    """Asyncio counterpart of MongoDict. Operations that are statements in python (item assignment, `del`, `in`, `len`) are available as the coroutines `set`, `delete`, `contains` and `length`, and `await d[key]` reads a single key. Nested dicts and lists are returned as AsyncMongoDict/AsyncMongoList objects."""
+
+    _raise_if_invalid_value = MongoDict._raise_if_invalid_value
+    _key_path = MongoDict._key_path
+    _encode = MongoDict._encode
+    _decode = MongoDict._decode
+    _encode_all = MongoDict._encode_all
+    _decode_all = MongoDict._decode_all
+    _find_stages = MongoDict._find_stages
+    _value_query = MongoDict._value_query
+
+    def __init__(
+        self,
+        collection,
+        name: str,
+        default_value: Union[dict, None] = None,
+        codec: Optional[Codec] = None,
+        page_size: int = 1000,
+        _projection: str = "contents",
+    ):
+        super().__init__(
+            collection=collection,
+            name=name,
+            codec=codec,
+            page_size=page_size,
+            _projection=_projection,
+        )
+        if default_value is None:
+            self.default_value = {}
+        else:
+            if not isinstance(default_value, dict):
+                raise ValueError(
+                    "Default value for DictInDatabase must be a dictionary!"
+                )
+            self.default_value = default_value
+
+    def _wrap(self, key, val):
+        """See `MongoDict._wrap`."""
+        if self.codec is not None:
+            return val
+        if isinstance(val, dict):
+            return AsyncMongoDict(
+                self._collection,
+                name=self.name,
+                default_value=val,
+                page_size=self.page_size,
+                _projection=self._key_path(key),
+            )
+        if isinstance(val, list):
+            return AsyncMongoList(
+                self._collection,
+                name=self.name,
+                default_value=val,
+                page_size=self.page_size,
+                _projection=self._key_path(key),
+            )
+        return val
+
+    async def as_normal_dict(self) -> dict:
+        return await self._fetch()
+
+    async def copy(self) -> dict:
+        return await self._fetch()
+
+    async def clear(self):
+        await self._write({"$set": {self.db_projection: {}}})
+
+    async def get(self, key, default=None):
+        if not isinstance(key, str):
+            return default  # only string keys can be stored
+        try:
+            return await self[key]
+        except KeyError:
+            return default
+
+    async def keys(self):
+        return (await self._fetch()).keys()
+
+    async def values(self):
+        return (await self._fetch()).values()
+
+    async def find(self, predicate: Any) -> dict:
+        """See `MongoDict.find`."""
+        results = {}
+        for result in await self._aggregate(self._find_stages(predicate)):
+            key = unescape_key(result["entry"]["k"])
+            results[key] = self._wrap(key, self._decode(result["entry"]["v"]))
+        return results
+
+    async def select(self, keys) -> dict:
+        """See `MongoDict.select`."""
+        keys = list(keys)
+        if len(keys) == 0:
+            return {}
+        document = await self._collection.find_one(
+            self.db_filter,
+            projection={
+                "_id": 0,
+                "name": 1,
+                **{self._key_path(key): 1 for key in keys},
+            },
+        )
+        if document is None:
+            raise ValueError(
+                f"Dict by name {self.name} does not contain data at {self.db_projection}!"
+            )
+        try:
+            values = get_path(document, self.db_projection)
+        except KeyError:
+            return {}
+        return {
+            key: self._wrap(key, self._decode(values[escape_key(key)]))
+            for key in keys
+            if escape_key(key) in values
+        }
+
+    async def items(self):
+        return {
+            key: self._wrap(key, val) for key, val in (await self._fetch()).items()
+        }.items()
+
+    async def pop(self, key, default=UUID4_PLACEHOLDER):
+        if not isinstance(key, str):
+            # only string keys can be stored
+            if default == UUID4_PLACEHOLDER:
+                raise KeyError(f"{key} was not found in the dictionary!")
+            return default
+        path = self._key_path(key)
+        before = await self._write(
+            {"$unset": {path: ""}},
+            condition={path: {"$exists": True}},
+            fetch={path: 1},
+        )
+        if before is None:
+            if default == UUID4_PLACEHOLDER:
+                raise KeyError(f"{key} was not found in the dictionary!")
+            return default
+        return self._decode(get_path(before, path))
+
+    async def popitem(self):
+        """See `MongoDict.popitem`."""
+
+        async def attempt():
+            last = await self._aggregate(
+                [
+                    {
+                        "$project": {
+                            "_id": 0,
+                            "field": {
+                                "$arrayElemAt": [
+                                    {"$objectToArray": f"${self.db_projection}"},
+                                    -1,
+                                ]
+                            },
+                            VERSION_FIELD: 1,
+                        }
+                    }
+                ]
+            )
+            if len(last) == 0 or "field" not in last[0]:
+                raise KeyError("popitem(): dictionary is empty")
+            field = last[0]["field"]["k"]
+            path = f"{self.db_projection}.{field}"
+            before = await self._write(
+                {"$unset": {path: ""}},
+                condition=version_condition(last[0].get(VERSION_FIELD, 0)),
+                fetch={path: 1},
+            )
+            if before is None:
+                return False, None
+            return True, (unescape_key(field), self._decode(get_path(before, path)))
+
+        return await self._retry_on_conflict(attempt)
+
+    async def update(self, *args, **kwargs):
+        new = dict(*args, **kwargs)
+        for val in new.values():
+            self._check_value(val)
+        if len(new) == 0:
+            return
+        await self._write(
+            {
+                "$set": {
+                    self._key_path(key): self._encode(val) for key, val in new.items()
+                }
+            }
+        )
+
+    async def _get(self, key):
+        if not isinstance(key, str):
+            raise KeyError(key)  # only string keys can be stored
+        path = self._key_path(key)
+        value = await self._collection.find_one(
+            self.db_filter, projection={"_id": 0, path: 1}
+        )
+        if value is None:
+            raise ValueError(
+                f"Dict by name {self.name} does not contain data at {self.db_projection}!"
+            )
+        try:
+            value = get_path(value, path)
+        except KeyError:
+            raise KeyError(key) from None
+        return self._wrap(key, self._decode(value))
+
+    async def __aiter__(self):
+        """Streams the keys `page_size` at a time, see `MongoDict._entries`."""
+        cursor = await self._cursor(
+            [
+                {
+                    "$project": {
+                        "_id": 0,
+                        "entry": {"$objectToArray": f"${self.db_projection}"},
+                    }
+                },
+                {"$unwind": "$entry"},
+                {"$project": {"_id": 0, "k": "$entry.k"}},
+            ],
+            batchSize=self.page_size,
+        )
+        async for entry in cursor:
+            yield unescape_key(entry["k"])
+
+    def __getitem__(self, key):
+        return self._get(key)
+
+    async def set(self, key, val):
+        self._check_value(val)
+        await self._write({"$set": {self._key_path(key): self._encode(val)}})
+
+    async def delete(self, key):
+        if not isinstance(key, str):
+            raise KeyError(key)  # only string keys can be stored
+        path = self._key_path(key)
+        if not await self._write(
+            {"$unset": {path: ""}}, condition={path: {"$exists": True}}
+        ):
+            raise KeyError(key)
+
+    async def contains(self, key) -> bool:
+        if not isinstance(key, str):
+            return False
+        value = await self._collection.find_one(
+            {**self.db_filter, self._key_path(key): {"$exists": True}},
+            projection={"_id": 1},
+        )
+        return value is not None
+
+    async def length(self) -> int:
+        result = await self._aggregate(
+            [
+                {
+                    "$project": {
+                        "_id": 0,
+                        "length": {
+                            "$size": {"$objectToArray": f"${self.db_projection}"}
+                        },
+                    }
+                }
+            ]
+        )
+        if len(result) == 0:
+            raise ValueError(
+                f"Dict by name {self.name} does not contain data at {self.db_projection}!"
+            )
+        return result[0]["length"]
+
+
+@recorded
+class AsyncMongoList(AsyncMongoShelf):
+    """Asyncio counterpart of MongoList. Operations that are statements in python (item assignment, `in`, `len`) are available as the coroutines `set`, `contains` and `length`, and `await l[i]` reads a single element or slice."""
+
+    _raise_if_invalid_value = MongoList._raise_if_invalid_value
+    _encode = MongoShelf._encode
+    _decode = MongoShelf._decode
+    _encode_all = MongoList._encode_all
+    _decode_all = MongoList._decode_all
+    _array = MongoList._array
+    _index_exists = MongoList._index_exists
+    _splice = MongoList._splice
+    _resolve_index = MongoList._resolve_index
+    _slice_projection = staticmethod(MongoList._slice_projection)
+    _index_expression = MongoList._index_expression
+    _count_expression = MongoList._count_expression
+    _contains_filter = MongoList._contains_filter
+    _position = MongoList._position
+
+    def __init__(
+        self,
+        collection,
+        name: str,
+        default_value: Union[list, None] = None,
+        codec: Optional[Codec] = None,
+        page_size: int = 1000,
+        _projection: str = "contents",
+    ):
+        super().__init__(
+            collection=collection,
+            name=name,
+            codec=codec,
+            page_size=page_size,
+            _projection=_projection,
+        )
+        self.default_value = default_value or []
+        if not any([isinstance(self.default_value, x) for x in [list, tuple]]):
+            raise ValueError("ListInDatabase must be initialized with a list or tuple!")
+        for val in self.default_value:
+            self._check_value(val)
+
+    async def copy(self) -> list:
+        return await self._fetch()
+
+    async def append(self, x):
+        self._check_value(x)
+        await self._write({"$push": {self.db_projection: self._encode(x)}})
+
+    async def extend(self, x):
+        values = list(x)
+        for val in values:
+            self._check_value(val)
+        if len(values) == 0:
+            return
+        await self._write(
+            {"$push": {self.db_projection: {"$each": self._encode_all(values)}}}
+        )
+
+    async def insert(self, i, x):
+        self._check_value(x)
+        await self._write(
+            {
+                "$push": {
+                    self.db_projection: {"$each": [self._encode(x)], "$position": i}
+                }
+            }
+        )
+
+    async def clear(self):
+        await self._write({"$set": {self.db_projection: []}})
+
+    async def index(self, x, start=0, stop=None):
+        """See `MongoList.index`."""
+        i = await self._evaluate(self._index_expression(x, start, stop))
+        if i is None or i < 0:
+            raise ValueError(f"{x} is not in list")
+        return i
+
+    async def count(self, x):
+        return await self._evaluate(self._count_expression(x))
+
+    async def pop(self, i=-1):
+        if i == -1:
+            update = {"$pop": {self.db_projection: 1}}
+        elif i == 0:
+            update = {"$pop": {self.db_projection: -1}}
+        else:
+            update = [
+                {
+                    "$set": {
+                        self.db_projection: self._splice(self._resolve_index(i), 1, [])
+                    }
+                }
+            ]
+        before = await self._write(
+            update,
+            condition=self._index_exists(i),
+            fetch={self.db_projection: {"$slice": [i, 1]}},
+        )
+        if before is None:
+            raise IndexError("pop index out of range")
+        return self._decode(get_path(before, self.db_projection)[0])
+
+    async def remove(self, x):
+        """See `MongoList.remove`."""
+        encoded = self._encode(x)
+        matched = await self._write(
+            [
+                {
+                    "$set": {
+                        self.db_projection: {
+                            "$let": {
+                                "vars": {
+                                    "i": {
+                                        "$indexOfArray": [
+                                            self._array,
+                                            {"$literal": encoded},
+                                        ]
+                                    }
+                                },
+                                "in": {
+                                    "$cond": [
+                                        {"$eq": ["$$i", -1]},
+                                        self._array,
+                                        self._splice("$$i", 1, []),
+                                    ]
+                                },
+                            }
+                        }
+                    }
+                }
+            ],
+            condition={self.db_projection: encoded},
+        )
+        if not matched:
+            raise ValueError("list.remove(x): x not in list")
+
+    async def reverse(self):
+        await self._write(
+            [{"$set": {self.db_projection: {"$reverseArray": self._array}}}]
+        )
+
+    async def sort(self, key=None, reverse=False):
+        if key is None and self.codec is None:
+            await self._write(
+                {
+                    "$push": {
+                        self.db_projection: {"$each": [], "$sort": -1 if reverse else 1}
+                    }
+                }
+            )
+            return
+
+        def modify(current):
+            current.sort(key=key, reverse=reverse)
+            return {"$set": {self.db_projection: self._encode_all(current)}}, None
+
+        await self._compare_and_swap(modify)
+
+    async def _get(self, x):
+        if isinstance(x, slice):
+            projection = self._slice_projection(x)
+            if projection is None:
+                return (await self._fetch())[x]
+            if projection == 0:
+                return []
+            value = await self._collection.find_one(
+                self.db_filter,
+                projection={
+                    "_id": 0,
+                    "name": 1,
+                    self.db_projection: {"$slice": projection},
+                },
+            )
+            if value is None:
+                raise ValueError(
+                    f"Entry {self.name} does not contain data at {self.db_projection}!"
+                )
+            return self._decode_all(get_path(value, self.db_projection))
+
+        value = await self._collection.find_one(
+            {**self.db_filter, **self._index_exists(x)},
+            projection={"_id": 0, "name": 1, self.db_projection: {"$slice": [x, 1]}},
+        )
+        if value is None:
+            raise IndexError("list index out of range")
+        return self._decode(get_path(value, self.db_projection)[0])
+
+    def __getitem__(self, x):
+        return self._get(x)
+
+    async def __aiter__(self):
+        """Streams the elements `page_size` at a time, see `MongoList.__iter__`."""
+        offset = 0
+        while True:
+            page = await self._get(slice(offset, offset + self.page_size))
+            for value in page:
+                yield value
+            if len(page) < self.page_size:
+                return
+            offset += self.page_size
+
+    async def set(self, x, val):
+        if isinstance(x, slice):
+            val = list(val)
+            for _val in val:
+                self._check_value(_val)
+
+            def modify(current):
+                current[x] = val
+                return {"$set": {self.db_projection: self._encode_all(current)}}, None
+
+            await self._compare_and_swap(modify)
+            return
+
+        self._check_value(val)
+        if x >= 0:
+            update = {"$set": {f"{self.db_projection}.{x}": self._encode(val)}}
+        else:
+            update = [
+                {
+                    "$set": {
+                        self.db_projection: self._splice(
+                            self._resolve_index(x), 1, [self._encode(val)]
+                        )
+                    }
+                }
+            ]
+        if not await self._write(update, condition=self._index_exists(x)):
+            raise IndexError("list assignment index out of range")
+
+    async def contains(self, x) -> bool:
+        document = await self._collection.find_one(
+            {**self.db_filter, **self._contains_filter(x)}, projection={"_id": 1}
+        )
+        return document is not None
+
+    async def length(self) -> int:
+        return await self._evaluate({"$size": self._array})
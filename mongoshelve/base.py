@@ -0,0 +1,867 @@
+import copy
+import datetime
+import functools
+import logging
+import os
+import re
+import threading
+import time
+import weakref
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple, Union
+from bson import Binary, Decimal128, ObjectId, Regex, Timestamp
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.collection import Collection
+from pymongo.errors import (
+    BulkWriteError,
+    ConnectionFailure,
+    DuplicateKeyError,
+    OperationFailure,
+)
+from pymongo.read_preferences import _ServerMode
+from .batch import ShelfBatch, current_batch
+from .codecs import Codec
+from .diff import diff_update
+from .mirror import ShelfMirror, open_mirror
+from .snapshot import freeze
+from .stats import recorded
+from .utils import (
+    VERSION_FIELD,
+    VersionConflictError,
+    conflict_backoff,
+    get_path,
+    set_path,
+    unescape_key,
+    version_condition,
+)
+from .watch import ShelfWatcher
+from .writebehind import WriteBehindQueue
+
+logger = logging.getLogger(__name__)
+
+# clients by (client id, collection, index) of the indexes that have been created by this process
+_created_indexes = weakref.WeakValueDictionary()
+_created_indexes_lock = threading.Lock()
+
+
+def ensure_indexes(collection: Collection):
+    """Creates a unique index on `name` so that opening a MongoDict/MongoList is an indexed lookup rather than a collection scan, and so that concurrent processes cannot create two documents for the same name. This is optional and only needs to be called once per collection.
+
+    Args:
+        collection (Collection): Collection that MongoDict/MongoList documents are stored in.
+    """
+    # sparse so that documents without a `name` do not collide with each other
+    collection.create_index("name", unique=True, sparse=True)
+    _ensure_key_index(collection)
+    _ensure_chunk_index(collection)
+
+
+def _ensure_key_index(collection: Collection):
+    """Creates the index that the documents of per-key dicts (see `PerKeyMongoDict`) are looked up by. Partial so that it does not cover any other documents."""
+    collection.create_index(
+        [("shelf", 1), ("key", 1)],
+        unique=True,
+        partialFilterExpression={"shelf": {"$exists": True}},
+    )
+
+
+def _ensure_chunk_index(collection: Collection):
+    """Creates the index that the chunks of chunked lists (see `ChunkedMongoList`) are looked up by. Partial so that it does not cover any other documents."""
+    collection.create_index(
+        [("list", 1), ("n", 1)],
+        unique=True,
+        partialFilterExpression={"list": {"$exists": True}},
+    )
+
+
+def _ensure_index_once(collection: Collection, create: Callable[[Collection], Any]):
+    """Runs `create` (ie `_ensure_key_index`) the first time a container that needs the index is opened on `collection` by this process, rather than sending a `createIndexes` command on every open. If the user is not allowed to create indexes, a warning is logged and the container is opened anyway, so the index should then be created with `ensure_indexes` by someone who is."""
+    client = collection.database.client
+    key = (id(client), collection.full_name, create.__name__)
+    with _created_indexes_lock:
+        if _created_indexes.get(key) is client:
+            return
+        _created_indexes[key] = client
+    try:
+        create(collection)
+    except OperationFailure as e:
+        logger.warning(
+            f"Could not create the indexes of {collection.full_name}, call ensure_indexes with a user that can: {e}"
+        )
+
+
+def _close_queue(queue: WriteBehindQueue):
+    """Closes the write-behind queue of a container that was garbage collected without being closed. There is no caller to raise a failed flush to, so it is only logged."""
+    try:
+        queue.close()
+    except Exception:
+        logger.exception("Failed to flush the writes of a collected container.")
+
+
+_BSON_TYPE_ORDER = [
+    (3, str),
+    (4, dict),
+    (5, (list, tuple)),
+    (6, (bytes, Binary)),
+    (7, ObjectId),
+    (9, datetime.datetime),
+    (10, Timestamp),
+    (11, (Regex, re.Pattern)),
+]
+
+
+def _read_collection(
+    collection: Collection, read_preference: Optional[_ServerMode]
+) -> Collection:
+    """Returns the collection that plain reads of a container are sent to. Writes are always sent to the primary, regardless of the read preference."""
+    if read_preference is None:
+        return collection
+    return collection.with_options(read_preference=read_preference)
+
+
+def bson_equal(a: Any, b: Any) -> bool:
+    """Equality as evaluated by MongoDB, which (unlike python) does not consider booleans equal to the numbers 0 and 1."""
+    return a == b and isinstance(a, bool) == isinstance(b, bool)
+
+
+def _bson_type_order(value: Any) -> int:
+    """Rank of the type of `value` in the order MongoDB compares values of different types by."""
+    if value is None:
+        return 1
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float, Decimal128)):
+        return 2
+    for rank, types in _BSON_TYPE_ORDER:
+        if isinstance(value, types):
+            return rank
+    return 12
+
+
+def bson_less(a: Any, b: Any) -> bool:
+    """Comparison as evaluated by MongoDB (ie by `$min`/`$max`), which orders values of different types by type, so that ie `True` is greater than any number."""
+    if _bson_type_order(a) != _bson_type_order(b):
+        return _bson_type_order(a) < _bson_type_order(b)
+    return a < b
+
+
+@recorded
+class MongoShelf:
+    """Base class for containers that are stored within a MongoDB document. The document is identified by its `name` field, and the container lives at the (dotted) path `db_projection` within it.
+
+    Every write increments the `version` field of the document. If `cache` is enabled, the container keeps a local copy of its value that reads are served from for as long as that version is current. Whether it is current is checked with a query that only returns the version, or skipped entirely for `cache_ttl` seconds after the last check. Local writes are applied to the copy in place. Nested containers (ie `d["x"]`) are served from the copy of the container they were read from, and their writes are applied to it.
+
+    Iterating over a container streams it from the database `page_size` elements at a time, so memory use does not grow with its size.
+
+    Plain reads are sent according to `read_preference` (ie `ReadPreference.SECONDARY_PREFERRED` to serve them from secondaries), so they may not reflect the latest writes, including this process's own. Writes, and the reads that read-modify-write operations condition their writes on, always go to the primary.
+
+    With a `mirror` (the path of a local SQLite file, see `ShelfMirror`), the cache survives restarts: it is loaded from the file when the container is opened, so a restarted process only downloads the contents if their version changed in the meantime. If `mirror_fallback` is also enabled, reads are served from the local copy while the server is unreachable, rather than raising. Writes still raise.
+
+    Values (dict values and list elements) are stored as plain BSON, unless a `codec` is given that converts them, ie into compressed binary.
+
+    In `write_behind` mode, the local copy is authoritative: writes are applied to it and queued, and a background thread sends them to the database every `flush_interval` seconds (or once `max_pending` writes are waiting). Changes made by other processes are not picked up while in this mode.
+
+    Most writes are single atomic updates. The few that have to be computed from the current value (ie sorting with a key function) are only applied if the document version has not changed since the value was read, and are retried up to `max_retries` times otherwise, so concurrent writers never overwrite each other.
+    """
+
+    max_retries = 10  # of read-modify-write operations that lost to a concurrent writer
+
+    def __init__(
+        self,
+        collection: Collection,
+        name: str,
+        cache: bool = False,
+        cache_ttl: Optional[float] = None,
+        write_behind: bool = False,
+        flush_interval: float = 0.2,
+        max_pending: int = 1000,
+        codec: Optional[Codec] = None,
+        page_size: int = 1000,
+        read_preference: Optional[_ServerMode] = None,
+        mirror: Union[str, os.PathLike, ShelfMirror, None] = None,
+        mirror_fallback: bool = False,
+        _projection: str = "contents",
+        _parent: Optional[Tuple["MongoShelf", str]] = None,
+        _filter: Optional[dict] = None,
+    ):
+        self._collection = collection
+        self.read_preference = read_preference
+        self._reader = _read_collection(collection, read_preference)
+        # overrides `db_filter`, ie for values of a PerKeyMongoDict
+        self._filter = _filter
+        self._projection = _projection
+        self.name = name
+        self.cache = cache or write_behind or mirror is not None
+        self.cache_ttl = cache_ttl
+        self.codec = codec
+        # elements or entries fetched per round trip while iterating
+        self.page_size = page_size
+        self.write_behind = write_behind
+        self._parent = _parent  # (parent container, key) of nested containers, which share their parent's cache and write-behind queue
+        # nested containers share the lock of the container they are nested in, which guards the shared cache
+        self._lock = threading.RLock() if _parent is None else _parent[0]._lock
+        self._watcher = None
+        self._queue = None
+        if mirror is not None and write_behind:
+            raise ValueError("Containers in write-behind mode cannot be mirrored!")
+        if write_behind and _parent is None:
+            self._queue = WriteBehindQueue(
+                collection, flush_interval=flush_interval, max_pending=max_pending
+            )
+            # a container that is dropped without being closed still flushes its writes and stops the thread
+            self._finalizer = weakref.finalize(self, _close_queue, self._queue)
+        self._cache = None
+        self._cache_version = None
+        self._cache_checked = float("-inf")
+        self.mirror = None if mirror is None else open_mirror(mirror)
+        self.mirror_fallback = mirror_fallback
+        if self.mirror is not None:
+            self._load_mirror()
+            self.mirror.track(self)
+
+    @property
+    def db_projection(self):
+        return self._projection
+
+    @property
+    def db_filter(self):
+        if self._filter is not None:
+            return self._filter
+        return {"name": self.name}
+
+    def _encode(self, value: Any) -> Any:
+        """Converts a single element (a dict value or list item) into the form it is stored in MongoDB."""
+        if self.codec is None:
+            return value
+        return self.codec.encode(value)
+
+    def _decode(self, value: Any) -> Any:
+        """Inverse of `_encode`."""
+        if self.codec is None:
+            return value
+        return self.codec.decode(value)
+
+    @classmethod
+    def _raise_if_invalid_value(cls, val: Any):
+        """Raises if `val` cannot be stored as an element of this container."""
+
+    def _check_value(self, val: Any):
+        """Values are opaque to MongoDB once encoded by a codec, so they are only checked without one."""
+        if self.codec is None:
+            self._raise_if_invalid_value(val)
+
+    def _encode_all(self, value: Any) -> Any:
+        """Converts the whole container into the form it is stored in MongoDB."""
+        raise NotImplementedError
+
+    def _decode_all(self, value: Any) -> Any:
+        """Inverse of `_encode_all`."""
+        raise NotImplementedError
+
+    def _normalize(self, value: Any) -> Any:
+        """Returns a copy of `value` as it would be read back from the database (ie tuples become lists). Used to apply local writes to the cache."""
+        return self._decode(self._encode(value))
+
+    def apply_default_value(self, overwrite: bool = False):
+        """Writes `default_value` to the database. If the document does not exist yet it is created, otherwise the stored value is only replaced if `overwrite` is True. This takes a single upsert round trip.
+
+        Args:
+            overwrite (bool, optional): Replace the stored value if the document already exists. Defaults to False.
+        """
+        if self.write_behind:
+            self.flush()
+        value = self._encode_all(self.default_value)
+        if overwrite:
+            try:
+                # only the parts that differ from the stored value are written
+                self._compare_and_swap(
+                    lambda current: (
+                        diff_update(
+                            self._encode_all(current), value, self.db_projection
+                        ),
+                        lambda local: self._replace_local(local, value),
+                        None,
+                    )
+                )
+                return
+            except (KeyError, ValueError):
+                pass  # nothing is stored yet, so the whole value is written
+            update = {"$set": {self.db_projection: value}, "$inc": {VERSION_FIELD: 1}}
+            self._invalidate_cache()
+        else:
+            update = {"$setOnInsert": {self.db_projection: value}}
+        try:
+            self._collection.update_one(self.db_filter, update, upsert=True)
+        except DuplicateKeyError:
+            # another process inserted the document between our match and insert (only possible with the unique index from `ensure_indexes`). The document now exists, so retrying is a plain update.
+            self._collection.update_one(self.db_filter, update, upsert=True)
+        except ConnectionFailure:
+            # a mirrored document exists already, so the default would not be written anyway
+            if overwrite or not self.mirror_fallback or self._cache is None:
+                raise
+            logger.warning(
+                f"Database unreachable, opening {self.name} from its local copy."
+            )
+
+    def _replace_local(self, local: Any, value: Any):
+        """Replaces the contents of the local copy `local` in place with the stored form `value`."""
+        if isinstance(local, dict):
+            local.clear()
+            local.update(self._decode_all(value))
+        else:
+            local[:] = self._decode_all(value)
+
+    @classmethod
+    def open_many(
+        cls,
+        collection: Collection,
+        names: Iterable[str],
+        defaults: Optional[Dict[str, Any]] = None,
+        **kwargs,
+    ) -> Dict[str, "MongoShelf"]:
+        """Opens several containers at once, with a constant number of round trips rather than one or more per container. The existing documents are read with a single `$in` query, and the missing ones are created from their default values with a single unordered `bulk_write` of upserts. If `cache` is enabled, the contents that were read (or written) are loaded into the caches, so the first reads do not touch the database either. Containers with a `mirror` only download their contents if their version changed since they were mirrored.
+
+        Args:
+            collection (Collection): Collection that the containers are stored in.
+            names (Iterable[str]): Names of the containers.
+            defaults (Optional[Dict[str, Any]], optional): Default values by name, for the containers that do not exist yet. Containers without a default start out empty. Defaults to None.
+            **kwargs: Passed on to the constructor of each container, ie `cache=True`.
+
+        Raises:
+            ValueError: A layout other than the default is requested.
+
+        Returns:
+            Dict[str, MongoShelf]: The containers by name.
+        """
+        if kwargs.get("layout", "document") != "document":
+            raise ValueError("open_many only supports the document layout!")
+        defaults = defaults or {}
+        shelves = {
+            name: cls(
+                collection,
+                name=name,
+                default_value=defaults.get(name),
+                _apply_default=False,
+                **kwargs,
+            )
+            for name in names
+        }
+        if len(shelves) == 0:
+            return shelves
+        projection = next(iter(shelves.values())).db_projection
+        fields = {"_id": 0, "name": 1, VERSION_FIELD: 1}
+        if next(iter(shelves.values())).cache:
+            # the contents are only needed to preload the caches
+            fields[projection] = 1
+
+        # the contents loaded from a mirror are only downloaded again if their version changed
+        current = set()
+        mirrored = [name for name, shelf in shelves.items() if shelf._cache is not None]
+        if len(mirrored) > 0:
+            versions = {
+                document["name"]: document.get(VERSION_FIELD, 0)
+                for document in collection.find(
+                    {"name": {"$in": mirrored}},
+                    projection={"_id": 0, "name": 1, VERSION_FIELD: 1},
+                )
+            }
+            for name in mirrored:
+                if versions.get(name) == shelves[name]._cache_version:
+                    shelves[name]._cache_checked = time.monotonic()
+                    current.add(name)
+
+        documents = {}
+        if len(current) < len(shelves):
+            documents = {
+                document["name"]: document
+                for document in collection.find(
+                    {
+                        "name": {
+                            "$in": [name for name in shelves if name not in current]
+                        }
+                    },
+                    projection=fields,
+                )
+            }
+        missing = [
+            shelf
+            for name, shelf in shelves.items()
+            if name not in documents and name not in current
+        ]
+        operations = [
+            UpdateOne(
+                shelf.db_filter,
+                {"$setOnInsert": {projection: shelf._encode_all(shelf.default_value)}},
+                upsert=True,
+            )
+            for shelf in missing
+        ]
+        if len(operations) > 0:
+            try:
+                result = collection.bulk_write(operations, ordered=False)
+            except BulkWriteError:
+                # see apply_default_value, the documents that collided exist now
+                result = collection.bulk_write(operations, ordered=False)
+            for i in result.upserted_ids:
+                # version 0, like any document that has not been written since its creation
+                documents[missing[i].name] = {
+                    projection: missing[i]._encode_all(missing[i].default_value)
+                }
+
+        for name, shelf in shelves.items():
+            if not shelf.cache or name not in documents:
+                continue
+            try:
+                value = get_path(documents[name], projection)
+            except KeyError:
+                continue
+            version = documents[name].get(VERSION_FIELD, 0)
+            shelf._set_cache(shelf._decode_all(value), version)
+            if shelf.mirror is not None:
+                shelf._save_mirror(value, version)
+        return shelves
+
+    def snapshot(self) -> Any:
+        """Returns a read-only, in-memory copy of the whole container, read with a single round trip (or served from the cache). Nested dicts and lists are FrozenDict/FrozenList objects rather than MongoDict/MongoList, so reading the snapshot never touches the database again, and it stays consistent however the container is modified afterwards. Combined with a secondary `read_preference`, this keeps read-mostly traffic off the primary.
+
+        Raises:
+            ValueError: The document does not exist or has no value at `db_projection`.
+
+        Returns:
+            Any: FrozenDict (for a MongoDict) or FrozenList (for a MongoList).
+        """
+        return freeze(self._read())
+
+    def _fetch(self) -> Any:
+        """Reads the whole container from the database, updating the cache if it is enabled.
+
+        Raises:
+            ValueError: The document does not exist or has no value at `db_projection`.
+        """
+        return self._fetch_versioned()[0]
+
+    def _fetch_versioned(self, primary: bool = False) -> Tuple[Any, int]:
+        """Like `_fetch`, but also returns the version of the document that the value was read at. Read-modify-write operations pass `primary` to read the latest version regardless of the read preference, as their writes are conditioned on it."""
+        collection = self._collection if primary else self._reader
+        document = collection.find_one(
+            self.db_filter,
+            projection={"_id": 0, self.db_projection: 1, VERSION_FIELD: 1},
+        )
+        if document is None:
+            raise ValueError(
+                f"Entry {self.name} does not contain data at {self.db_projection}!"
+            )
+        stored = get_path(document, self.db_projection)
+        value = self._decode_all(stored)
+        version = document.get(VERSION_FIELD, 0)
+        if self.mirror is not None:
+            self._save_mirror(stored, version)
+        if self.cache and self._cache_owner()[0] is self:
+            with self._lock:
+                self._set_cache(value, version)
+                value = copy.deepcopy(value)
+        return value, version
+
+    def _evaluate(self, expression: Any) -> Any:
+        """Evaluates an aggregation expression on the document of this container, so that only the result is transferred.
+
+        Raises:
+            ValueError: The document does not exist.
+        """
+        result = list(
+            self._reader.aggregate(
+                [
+                    {"$match": self.db_filter},
+                    {"$project": {"_id": 0, "result": expression}},
+                ]
+            )
+        )
+        if len(result) == 0:
+            raise ValueError(
+                f"Entry {self.name} does not contain data at {self.db_projection}!"
+            )
+        return result[0].get("result")
+
+    def _read(self) -> Any:
+        """Returns a copy of the whole container, served from the cache if possible."""
+        cached = self._cached_value()
+        if cached is not None:
+            return copy.deepcopy(cached)
+        return self._fetch()
+
+    def _read_versioned(self) -> Tuple[Any, Optional[int]]:
+        """Like `_read`, but also returns the version that the value was read at, for use with `_compare_and_swap`."""
+        with self._lock:
+            cached = self._cached_value()
+            if cached is not None:
+                return copy.deepcopy(cached), self._cached_version()
+        return self._fetch_versioned(primary=True)
+
+    def _retry_on_conflict(self, attempt: Callable[[], Tuple[bool, Any]]) -> Any:
+        """Runs a read-modify-write `attempt` until its write is accepted. `attempt` reads the value along with the document version, and conditions its write on that version (see `version_condition`), so the write is rejected if another writer got in between. It returns whether its write was accepted, and the result to return if so.
+
+        Raises:
+            VersionConflictError: The write was rejected `max_retries + 1` times in a row.
+        """
+        for i in range(self.max_retries + 1):
+            accepted, result = attempt()
+            if accepted:
+                return result
+            self._invalidate_cache()
+            time.sleep(conflict_backoff(i + 1))
+        raise VersionConflictError(
+            f"Entry {self.name} was modified concurrently {self.max_retries + 1} times in a row!"
+        )
+
+    def _compare_and_swap(
+        self,
+        modify: Callable[[Any], Tuple[Union[dict, list], Callable[[Any], Any], Any]],
+        read: Optional[Callable[[], Tuple[Any, Optional[int]]]] = None,
+    ) -> Any:
+        """Applies a change that has to be computed from the current value (ie sorting with a key function) without losing concurrent writes. `modify(value)` returns the update to send (which may be empty if there is nothing to change), the function that makes the same change to the local value, and the result to return. The update is only applied if the document is still at the version `value` was read at, otherwise the value is read again and `modify` is retried, see `_retry_on_conflict`. `read` returns the value and its version, and defaults to reading the whole container."""
+
+        def attempt():
+            value, version = (read or self._read_versioned)()
+            update, apply, result = modify(value)
+            if not update:
+                return True, result
+            before = self._write(
+                update, condition=version_condition(version), fetch={}, apply=apply
+            )
+            return before is not None, result
+
+        return self._retry_on_conflict(attempt)
+
+    def _cached_value(self) -> Any:
+        """Returns the cached value after making sure that it is current, or None if caching is disabled. The returned object is the cache itself, so it must not be modified or handed out to callers."""
+        if not self.cache:
+            return None
+        owner, keys = self._cache_owner()
+        if owner is not self:
+            value = owner._cached_value()
+            try:
+                for key in keys:
+                    value = value[key]
+            except (KeyError, IndexError, TypeError):
+                raise ValueError(
+                    f"Entry {self.name} does not contain data at {self.db_projection}!"
+                )
+            return value
+        with self._lock:
+            try:
+                if self._cache is not None and self._cache_is_current():
+                    return self._cache
+                if self._queue is not None:
+                    self.flush()  # pending writes have to be stored before reloading
+                self._fetch()
+                return self._cache
+            except ConnectionFailure:
+                if not self.mirror_fallback or self._cache is None:
+                    raise
+                logger.warning(
+                    f"Database unreachable, serving {self.name} from its local copy."
+                )
+                return self._cache
+
+    def _cache_is_current(self) -> bool:
+        if self.watching or self.write_behind:
+            return True
+        if (
+            self.cache_ttl is not None
+            and time.monotonic() - self._cache_checked < self.cache_ttl
+        ):
+            return True
+        document = self._reader.find_one(
+            self.db_filter, projection={"_id": 0, VERSION_FIELD: 1}
+        )
+        if document is None or document.get(VERSION_FIELD, 0) != self._cache_version:
+            return False
+        self._cache_checked = time.monotonic()
+        return True
+
+    def _cache_owner(self) -> Tuple["MongoShelf", list]:
+        """Returns the outermost container whose cache holds the value of this one, and the keys that lead from its value to the value of this one. Nested containers do not keep a cache of their own, so that writes made through them are seen by reads made through the containers they are nested in, and vice versa."""
+        shelf, keys = self, []
+        while shelf._parent is not None and shelf._parent[0].cache:
+            shelf, key = shelf._parent
+            keys.insert(0, key)
+        return shelf, keys
+
+    def _cached_version(self) -> Optional[int]:
+        """Version of the document that the cache holding the value of this container was read at."""
+        return self._cache_owner()[0]._cache_version
+
+    def _set_cache(self, value: Any, version: int):
+        self._cache = value
+        self._cache_version = version
+        self._cache_checked = time.monotonic()
+
+    def _invalidate_cache(self):
+        owner = self._cache_owner()[0]
+        owner._cache = None
+        owner._cache_version = None
+        owner._cache_checked = float("-inf")
+
+    def _load_mirror(self):
+        """Loads the cache from the mirror. Its version is checked by the first read, as for any cache that has not been checked recently."""
+        saved = self.mirror.load(
+            self._collection.full_name, self.name, self.db_projection
+        )
+        if saved is None:
+            return
+        value, version = saved
+        with self._lock:
+            self._set_cache(self._decode_all(value), version)
+            self._cache_checked = float("-inf")
+
+    def _save_mirror(self, value: Any = None, version: Optional[int] = None):
+        """Saves the stored form `value` at `version` to the mirror, or the cache if `value` is None."""
+        if value is None:
+            with self._lock:
+                if self._cache is None:
+                    return
+                value, version = self._encode_all(self._cache), self._cache_version
+        self.mirror.save(
+            self._collection.full_name, self.name, self.db_projection, value, version
+        )
+
+    @staticmethod
+    def _versioned(update: Union[dict, list]) -> Union[dict, list]:
+        """Adds an increment of the document version to an update (or pipeline update)."""
+        if isinstance(update, list):
+            increment = {"$add": [{"$ifNull": [f"${VERSION_FIELD}", 0]}, 1]}
+            return update + [{"$set": {VERSION_FIELD: increment}}]
+        return {**update, "$inc": {**update.get("$inc", {}), VERSION_FIELD: 1}}
+
+    def _write(
+        self,
+        update: Union[dict, list],
+        condition: Optional[dict] = None,
+        fetch: Optional[dict] = None,
+        apply: Optional[Callable[[Any], Any]] = None,
+        after: bool = False,
+    ) -> Any:
+        """Sends a single update to the document of this container, incrementing its version.
+
+        Args:
+            update (Union[dict, list]): Update document or aggregation pipeline to apply.
+            condition (Optional[dict], optional): Additional filter the document must match for the update to be applied. Defaults to None.
+            fetch (Optional[dict], optional): Projection of the document as it was before the update, to be returned. Defaults to None.
+            apply (Optional[Callable[[Any], Any]], optional): Function that makes the same change to the (decoded) local value, so the cache can be kept instead of invalidated. Defaults to None.
+            after (bool, optional): Fetch the document as it is after the update instead, and also pass it to `apply` as `document`, so that results computed by MongoDB are cached as they are stored. In write-behind mode, `apply` computes them locally (without `document`). Defaults to False.
+
+        Returns:
+            Any: If `fetch` is given, the projected document before (or after) the update (None if it did not match). Otherwise, whether the document matched and was updated.
+        """
+        update = self._versioned(update)
+        if self.write_behind:
+            return self._write_behind(update, fetch=fetch, apply=apply, after=after)
+
+        db_filter = {**self.db_filter, **(condition or {})}
+        batch = current_batch(self._collection)
+        if batch is not None:
+            if fetch is None:
+                batch.record(db_filter, update)
+                # the write may still be discarded or not match, so the cache is reloaded once needed
+                with self._lock:
+                    self._invalidate_cache()
+                return True
+            # the result depends on the current value, so everything recorded so far is sent first
+            batch.flush()
+
+        owner, keys = self._cache_owner()
+        if fetch is None and (not owner.cache or owner._cache is None):
+            return self._collection.update_one(db_filter, update).matched_count > 0
+
+        document = self._collection.find_one_and_update(
+            db_filter,
+            update,
+            projection={**(fetch or {}), "_id": 0, "name": 1, VERSION_FIELD: 1},
+            return_document=ReturnDocument.AFTER if after else ReturnDocument.BEFORE,
+        )
+        if owner.cache and document is not None:
+            version = document.get(VERSION_FIELD, 0)
+            if after:
+                version -= 1  # the version the update was applied to
+                if apply is not None:
+                    apply = functools.partial(apply, document=document)
+            owner._apply_to_cache(version, self._apply_nested(keys, apply))
+        if fetch is None:
+            return document is not None
+        return document
+
+    def _apply_to_cache(self, version: int, apply: Optional[Callable[[Any], Any]]):
+        """Applies a local write to the cache if the cache held the version that the write was applied to, and invalidates it otherwise."""
+        with self._lock:
+            if self._cache_version is not None and self._cache_version > version:
+                return  # the watcher has already loaded a later version
+            if self._cache is None or apply is None or version != self._cache_version:
+                self._invalidate_cache()
+                return
+            try:
+                apply(self._cache)
+            except Exception:
+                self._invalidate_cache()
+                return
+            self._cache_version = version + 1
+
+    @staticmethod
+    def _apply_nested(
+        keys: list, apply: Optional[Callable[[Any], Any]]
+    ) -> Optional[Callable[[Any], Any]]:
+        """Turns a local write to the value of a nested container into one to the value of the container found by `_cache_owner`."""
+        if apply is None or len(keys) == 0:
+            return apply
+
+        def nested(value):
+            for key in keys:
+                value = value[key]
+            apply(value)
+
+        return nested
+
+    def _write_behind_root(self) -> "MongoShelf":
+        shelf = self
+        while shelf._parent is not None:
+            shelf = shelf._parent[0]
+        return shelf
+
+    def _write_behind(
+        self,
+        update: Union[dict, list],
+        fetch: Optional[dict] = None,
+        apply: Optional[Callable[[Any], Any]] = None,
+        after: bool = False,
+    ) -> Any:
+        """Applies a write to the local copy and queues it to be sent to the database. Conditions are checked against the local copy by `apply`, which raises (like the equivalent python operation) if they are not met. Mirrors the return value of `_write`."""
+        root = self._write_behind_root()
+        self._raise_queue_error(root)
+        with root._lock:
+            value = self._cached_value()
+            before = True if fetch is None else self._local_document(value, fetch)
+            if apply is None:
+                # the change cannot be made locally, so it is stored and the local copy reloaded
+                root._queue.record(self.db_filter, update)
+                root.flush()
+                root._invalidate_cache()
+                return before
+            try:
+                apply(value)
+            except (KeyError, IndexError, ValueError):
+                return None if fetch is not None else False
+            root._queue.record(self.db_filter, update)
+            if after and fetch is not None:
+                return self._local_document(value, fetch)
+        return before
+
+    @staticmethod
+    def _raise_queue_error(root: "MongoShelf"):
+        """Raises the error of a failed background flush. The local copy no longer matches the database in that case, so it is reloaded."""
+        try:
+            root._queue.raise_error()
+        except Exception:
+            root._invalidate_cache()
+            raise
+
+    def _local_document(self, value: Any, fetch: dict) -> dict:
+        """Builds the document that MongoDB would return for the projection `fetch` from the local copy `value` of this container. Supports the inclusion and $slice projections used by `_write`."""
+        document = {}
+        for path, projection in fetch.items():
+            relative = path[len(self.db_projection) + 1 :]
+            field = value
+            try:
+                for key in relative.split(".") if relative else []:
+                    field = field[unescape_key(key)]
+            except (KeyError, IndexError, TypeError):
+                continue
+            if isinstance(projection, dict) and "$slice" in projection:
+                skip, limit = projection["$slice"]
+                start = skip if skip >= 0 else max(len(field) + skip, 0)
+                field = field[start : start + limit]
+            if relative:
+                field = self._encode(copy.deepcopy(field))
+            else:
+                field = self._encode_all(copy.deepcopy(field))
+            set_path(document, path, field)
+        return document
+
+    def flush(self):
+        """Sends any writes that are waiting in the write-behind queue to the database.
+
+        Raises:
+            Exception: Error raised by this or an earlier (background) flush.
+        """
+        root = self._write_behind_root()
+        if root._queue is None:
+            return
+        root._queue._flush()
+        self._raise_queue_error(root)
+
+    def _child_options(self, key: str) -> dict:
+        """Keyword arguments for a container nested at `key` within this one."""
+        return dict(
+            cache=self.cache,
+            cache_ttl=self.cache_ttl,
+            write_behind=self.write_behind,
+            codec=self.codec,
+            page_size=self.page_size,
+            read_preference=self.read_preference,
+            _parent=(self, key),
+            _filter=self._filter,
+        )
+
+    def batch(self, transaction: bool = False) -> ShelfBatch:
+        """Batches the writes made by this thread to any MongoDict/MongoList in the same collection as this one, and sends them in a single round trip once the context exits. See `ShelfBatch` for details.
+
+        Args:
+            transaction (bool, optional): Flush the writes within a transaction. Requires a replica set. Defaults to False.
+        """
+        return ShelfBatch(self._collection, transaction=transaction)
+
+    @property
+    def watching(self) -> bool:
+        """Whether a background watcher is keeping the cache up to date."""
+        return self._watcher is not None and self._watcher.is_alive()
+
+    def watch(
+        self,
+        on_change: Optional[Callable[[Any], Any]] = None,
+        poll_interval: float = 1.0,
+    ):
+        """Starts a background thread that mirrors changes made to this container by other processes into the local cache, so that reads are served without any round trips. Changes are received through a change stream, or by polling the document version every `poll_interval` seconds if the deployment does not support change streams (ie a standalone mongod).
+
+        Args:
+            on_change (Optional[Callable[[Any], Any]], optional): Called from the background thread with the new value whenever a change made by another process is loaded. Defaults to None.
+            poll_interval (float, optional): Seconds between version checks if change streams are not available. Defaults to 1.0.
+
+        Returns:
+            self
+        """
+        if self.write_behind:
+            raise ValueError("Containers in write-behind mode cannot be watched!")
+        self.stop_watching()
+        self.cache = True
+        self._fetch()
+        self._watcher = ShelfWatcher(
+            self, on_change=on_change, poll_interval=poll_interval
+        )
+        self._watcher.start()
+        return self
+
+    def stop_watching(self):
+        """Stops the background watcher started by `watch`. Reads will check the document version again."""
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
+
+    def close(self):
+        """Stops any background activity of this container, and sends any writes that are waiting in the write-behind queue to the database."""
+        self.stop_watching()
+        if self.mirror is not None:
+            self._save_mirror()
+        if self._queue is not None:
+            self._finalizer.detach()
+            try:
+                self._queue.close()
+            except Exception:
+                self._invalidate_cache()
+                raise
@@ -0,0 +1,163 @@
+import threading
+from typing import List, Optional, Union
+import bson
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+
+_local = threading.local()
+_MERGEABLE_OPERATORS = {"$set", "$unset", "$push", "$inc"}
+
+
+def current_batch(collection: Collection) -> Optional["ShelfBatch"]:
+    """Returns the innermost batch opened by this thread on `collection`, or None if writes should be sent immediately."""
+    for batch in reversed(getattr(_local, "batches", [])):
+        if batch.collection == collection:
+            return batch
+    return None
+
+
+def _overlaps(a: str, b: str) -> bool:
+    """Whether two dotted paths refer to the same field or one contains the other."""
+    return a == b or a.startswith(b + ".") or b.startswith(a + ".")
+
+
+def _plain_push(value) -> Optional[list]:
+    """Returns the values appended by a $push argument, or None if it also positions, sorts or slices the array."""
+    if isinstance(value, dict) and any(key.startswith("$") for key in value):
+        if set(value) != {"$each"}:
+            return None
+        return list(value["$each"])
+    return [value]
+
+
+def merge_updates(first: dict, second: dict) -> Optional[dict]:
+    """Combines two update documents for the same document into one that has the same effect as applying `first` and then `second`.
+
+    Returns:
+        Optional[dict]: The combined update, or None if the two cannot be expressed as a single update (ie they touch overlapping paths with different operators).
+    """
+    if not set(first).union(second).issubset(_MERGEABLE_OPERATORS):
+        return None
+    merged = {operator: dict(fields) for operator, fields in first.items()}
+    for operator, fields in second.items():
+        for path, value in fields.items():
+            existing = [
+                (op, other)
+                for op, other_fields in merged.items()
+                for other in other_fields
+                if _overlaps(path, other)
+            ]
+            if len(existing) == 0:
+                merged.setdefault(operator, {})[path] = value
+                continue
+            if len(existing) > 1 or existing[0][1] != path:
+                return None
+            existing_operator = existing[0][0]
+            if operator in ("$set", "$unset"):
+                # a later $set/$unset of the same path replaces whatever happened to it before
+                del merged[existing_operator][path]
+                merged.setdefault(operator, {})[path] = value
+            elif operator == "$inc" and existing_operator == "$inc":
+                merged["$inc"][path] += value
+            elif operator == "$push" and existing_operator in ("$push", "$set"):
+                appended = _plain_push(value)
+                if appended is None:
+                    return None
+                if existing_operator == "$set":
+                    if not isinstance(merged["$set"][path], list):
+                        return None
+                    merged["$set"][path] = merged["$set"][path] + appended
+                else:
+                    previous = _plain_push(merged["$push"][path])
+                    if previous is None:
+                        return None
+                    merged["$push"][path] = {"$each": previous + appended}
+            else:
+                return None
+    return {operator: fields for operator, fields in merged.items() if fields}
+
+
+class ShelfBatch:
+    """Context manager that collects the writes made by this thread to any MongoDict/MongoList stored in `collection`, and sends them with a single `bulk_write` when the context exits. Consecutive writes to the same document are merged into as few update operations as possible, so many small writes cost a single round trip.
+
+    While a batch is open, reads see the database as it was before the batch, including on containers with a cache: a container's cache is dropped when it records a write, and reloaded by the next read. Writes whose result depends on the current value (ie `pop`) send everything recorded so far before being executed. Other conditional writes (ie `del d[key]` or `l[i] = x`) are not checked until the batch is flushed, and are skipped if their condition is not met. If the context exits with an exception, the recorded writes are discarded.
+
+    Args:
+        collection (Collection): Collection whose writes should be batched.
+        transaction (bool, optional): Flush the writes within a transaction, so either all or none of them are applied. Requires a replica set. Defaults to False.
+    """
+
+    def __init__(self, collection: Collection, transaction: bool = False):
+        self.collection = collection
+        self.transaction = transaction
+        self._operations: List[list] = []  # [filter, update, mergeable]
+        self._last = {}  # document name -> index of its last operation
+        self.writes = 0  # recorded writes, before merging
+        self.size = 0  # BSON size of the recorded updates, before merging
+
+    def __enter__(self):
+        if not hasattr(_local, "batches"):
+            _local.batches = []
+        _local.batches.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.batches.remove(self)
+        if exc_type is None:
+            self.flush()
+        else:
+            self.discard()
+
+    def __len__(self):
+        return len(self._operations)
+
+    def record(self, db_filter: dict, update: Union[dict, list]):
+        """Adds an update to the batch, merging it into the previous update of the same document if possible."""
+        self.writes += 1
+        self.size += len(bson.encode({"u": update}))
+        mergeable = isinstance(update, dict) and set(db_filter) == {"name"}
+        name = db_filter.get("name")
+        if mergeable and name in self._last:
+            previous = self._operations[self._last[name]]
+            if previous[2]:
+                merged = merge_updates(previous[1], update)
+                if merged is not None:
+                    previous[1] = merged
+                    return
+        self._operations.append([db_filter, update, mergeable])
+        self._last[name] = len(self._operations) - 1
+
+    def discard(self):
+        self._operations = []
+        self._last = {}
+        self.writes = 0
+        self.size = 0
+
+    def flush(self):
+        """Sends all recorded writes to the database."""
+        operations = [
+            UpdateOne(db_filter, update) for db_filter, update, _ in self._operations
+        ]
+        self.discard()
+        if len(operations) == 0:
+            return
+        if not self.transaction:
+            self.collection.bulk_write(operations, ordered=True)
+            return
+        with self.collection.database.client.start_session() as session:
+            session.with_transaction(
+                lambda s: self.collection.bulk_write(
+                    operations, ordered=True, session=s
+                )
+            )
+
+
+def shelf_batch(collection: Collection, transaction: bool = False) -> ShelfBatch:
+    """Batches the writes made by this thread to any MongoDict/MongoList in `collection`, see `ShelfBatch`.
+
+    Example:
+        with shelf_batch(collection):
+            for key, value in values.items():
+                my_dict[key] = value  # sent together when the block exits
+    """
+    return ShelfBatch(collection, transaction=transaction)
@@ -0,0 +1,387 @@
+import time
+from typing import Any, Iterator, Optional, Tuple, Union
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.collection import Collection
+from pymongo.read_preferences import _ServerMode
+from pymongo.errors import DuplicateKeyError
+from .base import _ensure_chunk_index, _ensure_index_once, _read_collection
+from .codecs import Codec
+from .list import MongoList
+from .stats import recorded
+from .utils import VERSION_FIELD, VersionConflictError, conflict_backoff
+
+LAYOUT = "chunked"
+
+
+@recorded
+class ChunkedMongoList:
+    """List that is split over chunk documents `{list: <name>, n: <chunk number>, items: [{i: <index>, v: <value>, g: <generation>}, ...]}` of `chunk_size` elements each, similar to GridFS, plus a header document `{name: <name>, layout: "chunked", length, reserved, generation, chunk_size}`. This lifts the 16 MB document size limit, and is meant for large, append-only lists such as logs. This should be created using `MongoList(..., layout="chunked")`.
+
+    `append` and `extend` reserve their positions by incrementing the `reserved` counter in the header, write the chunk(s) at the tail, and only then publish the new length, so concurrent appends never conflict and an append is fully readable once it returns. Since concurrent appends may finish out of order, the length is raised to the end of the latest append that finished, so it can cover positions that another append has reserved but not written yet, or never will if its process died in between. Such positions read as None, by indexing, slicing and iteration alike, and cannot be assigned to. Elements past the length are not visible to any read, including `in`, `count` and `index`. `len` only reads the header, and reading an element or slice only fetches the chunks it covers. Elements are stored with their index so that chunks stay in order when concurrent appends are written out of order. Operations that would shift elements between chunks (ie `insert`, `remove` or `sort`) are not supported in this layout.
+
+    `clear` increments the `generation` of the list along with resetting its length. An append only publishes its length if the generation is still the one it reserved its positions in. Otherwise the list was cleared in the meantime, so the append removes the elements it wrote (which are tagged with their generation) and is retried on the cleared list, up to `max_retries` times before raising a `VersionConflictError`.
+    """
+
+    max_retries = 10  # of appends that were interrupted by `clear`
+
+    def __init__(
+        self,
+        collection: Collection,
+        name: str,
+        default_value: Union[list, None] = None,
+        chunk_size: int = 1000,
+        codec: Optional[Codec] = None,
+        page_size: int = 1000,
+        read_preference: Optional[_ServerMode] = None,
+        layout: str = LAYOUT,
+    ):
+        if layout != LAYOUT:
+            raise ValueError(f"ChunkedMongoList cannot use the {layout} layout!")
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be a positive integer!")
+        self._collection = collection
+        self.read_preference = read_preference
+        self._reader = _read_collection(collection, read_preference)
+        self.name = name
+        self.codec = codec
+        self.page_size = page_size  # elements fetched per round trip while iterating
+        self.default_value = default_value or []
+        if not any([isinstance(self.default_value, x) for x in [list, tuple]]):
+            raise ValueError("ListInDatabase must be initialized with a list or tuple!")
+        for val in self.default_value:
+            self._check_value(val)
+        self.chunk_size = chunk_size
+        _ensure_index_once(collection, _ensure_chunk_index)
+        self.apply_default_value(overwrite=False)
+
+    def _encode(self, value: Any) -> Any:
+        return value if self.codec is None else self.codec.encode(value)
+
+    def _decode(self, value: Any) -> Any:
+        return value if self.codec is None else self.codec.decode(value)
+
+    def _check_value(self, val: Any):
+        if self.codec is None:
+            MongoList._raise_if_invalid_value(val)
+
+    @property
+    def db_filter(self) -> dict:
+        """Filter matching the header document."""
+        return {"name": self.name}
+
+    @property
+    def chunk_filter(self) -> dict:
+        """Filter matching all chunk documents."""
+        return {"list": self.name}
+
+    def apply_default_value(self, overwrite: bool = False):
+        """Writes `default_value` to the database. If the list does not exist yet it is created, otherwise the stored list is only replaced if `overwrite` is True. The chunk size of an existing list is kept.
+
+        Args:
+            overwrite (bool, optional): Replace the stored list if it already exists. Defaults to False.
+
+        Raises:
+            ValueError: `name` is already used by a container with a different layout.
+        """
+        update = {
+            "$setOnInsert": {
+                "layout": LAYOUT,
+                "length": 0,
+                "reserved": 0,
+                "generation": 0,
+                "chunk_size": self.chunk_size,
+            }
+        }
+        try:
+            header = self._collection.find_one_and_update(
+                self.db_filter,
+                update,
+                projection={"_id": 0, "layout": 1, "chunk_size": 1},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE,
+            )
+        except DuplicateKeyError:
+            header = self._collection.find_one(
+                self.db_filter, projection={"_id": 0, "layout": 1, "chunk_size": 1}
+            )
+        if header is not None and header.get("layout") != LAYOUT:
+            raise ValueError(f"{self.name} is not stored with the {LAYOUT} layout!")
+        if header is not None:
+            self.chunk_size = header["chunk_size"]
+            if not overwrite:
+                return
+            self.clear()
+        self.extend(self.default_value)
+
+    def _reserve(self, count: int) -> Tuple[int, int]:
+        """Reserves `count` positions at the end of the list, and returns the index of the first one along with the generation of the list. The positions are not counted by `len` until they are published by `_publish`."""
+        header = self._collection.find_one_and_update(
+            self.db_filter,
+            {"$inc": {"reserved": count}},
+            projection={"_id": 0, "reserved": 1, "generation": 1},
+            return_document=ReturnDocument.BEFORE,
+        )
+        if header is None:
+            raise ValueError(f"Entry {self.name} does not exist!")
+        return header["reserved"], header["generation"]
+
+    def _publish(self, end: int, generation: int) -> bool:
+        """Raises the length of the list to `end`, once the positions before it have been written. Returns False (and changes nothing) if the list has been cleared since the positions were reserved in `generation`."""
+        return (
+            self._collection.update_one(
+                {**self.db_filter, "generation": generation},
+                {"$max": {"length": end}, "$inc": {VERSION_FIELD: 1}},
+            ).matched_count
+            > 0
+        )
+
+    def _chunks(self, first: int = 0, last: int = None) -> Iterator[dict]:
+        """Streams the chunk documents `first` to `last` (inclusive) in order."""
+        numbers = {"$gte": first}
+        if last is not None:
+            numbers["$lte"] = last
+        return self._reader.find(
+            {**self.chunk_filter, "n": numbers},
+            projection={"_id": 0, "items": 1},
+            sort=[("n", 1)],
+            batch_size=max(1, self.page_size // self.chunk_size),
+        )
+
+    def _items(self, first: int = 0, last: int = None) -> Iterator[dict]:
+        for chunk in self._chunks(first, last):
+            for item in chunk["items"]:
+                item["v"] = self._decode(item["v"])
+                yield item
+
+    def _values(self) -> Iterator[Any]:
+        """Streams the values of the list up to its current length, with None for the positions that were reserved but not written."""
+        length = len(self)
+        position = 0
+        for item in self._items():
+            if item["i"] >= length:
+                break
+            if item["i"] < position:
+                continue  # written by an append that was interrupted by `clear`, and is being removed
+            while position < item["i"]:
+                yield None
+                position += 1
+            yield item["v"]
+            position += 1
+        while position < length:
+            yield None
+            position += 1
+
+    def _resolve_index(self, i: int) -> int:
+        """Converts a negative index into a position, which requires reading the length."""
+        if i >= 0:
+            return i
+        return len(self) + i
+
+    @staticmethod
+    def _unsupported(method: str):
+        raise NotImplementedError(
+            f"{method} is not implemented for the {LAYOUT} layout of ListInDatabase"
+        )
+
+    def append(self, x):
+        self.extend([x])
+
+    def extend(self, x):
+        values = list(x)
+        for val in values:
+            self._check_value(val)
+        if len(values) == 0:
+            return
+        encoded = [self._encode(val) for val in values]
+        for attempt in range(self.max_retries + 1):
+            start, generation = self._reserve(len(values))
+            chunks = {}
+            for i, val in enumerate(encoded, start):
+                chunks.setdefault(i // self.chunk_size, []).append(
+                    {"i": i, "v": val, "g": generation}
+                )
+            operations = [
+                UpdateOne(
+                    {**self.chunk_filter, "n": n},
+                    {"$push": {"items": {"$each": items, "$sort": {"i": 1}}}},
+                    upsert=True,
+                )
+                for n, items in chunks.items()
+            ]
+            self._collection.bulk_write(operations, ordered=False)
+            if self._publish(start + len(values), generation):
+                return
+            # the list was cleared in the meantime, and its positions may have been reserved again
+            self._collection.update_many(
+                {**self.chunk_filter, "n": {"$in": list(chunks)}},
+                {"$pull": {"items": {"g": generation}}},
+            )
+            time.sleep(conflict_backoff(attempt + 1))
+        raise VersionConflictError(
+            f"List {self.name} was cleared during {self.max_retries + 1} appends in a row!"
+        )
+
+    def clear(self):
+        self._collection.update_one(
+            self.db_filter,
+            {
+                "$set": {"length": 0, "reserved": 0},
+                "$inc": {"generation": 1, VERSION_FIELD: 1},
+            },
+        )
+        self._collection.delete_many(self.chunk_filter)
+
+    def copy(self) -> list:
+        return list(self._values())
+
+    def index(self, x, start=0, stop=None):
+        """Returns the position of the first occurrence of `x` within `[start:stop]`. This is located by MongoDB, which only returns the matching element."""
+        start, stop, _ = slice(start, stop).indices(len(self))
+        match = {
+            "$elemMatch": {"v": self._encode(x), "i": {"$gte": start, "$lt": stop}}
+        }
+        for chunk in self._reader.find(
+            {
+                **self.chunk_filter,
+                "n": {"$gte": start // self.chunk_size},
+                "items": match,
+            },
+            projection={"_id": 0, "items": match},
+            sort=[("n", 1)],
+            limit=1,
+        ):
+            return chunk["items"][0]["i"]
+        raise ValueError(f"{x} is not in list")
+
+    def count(self, x):
+        """Returns the number of occurrences of `x`, counted by MongoDB for each chunk that contains it."""
+        value = self._encode(x)
+        length = len(self)
+        return sum(
+            result["count"]
+            for result in self._reader.aggregate(
+                [
+                    {
+                        "$match": {
+                            **self.chunk_filter,
+                            "items": {"$elemMatch": {"v": value, "i": {"$lt": length}}},
+                        }
+                    },
+                    {
+                        "$project": {
+                            "_id": 0,
+                            "count": {
+                                "$size": {
+                                    "$filter": {
+                                        "input": "$items",
+                                        "cond": {
+                                            "$and": [
+                                                {
+                                                    "$eq": [
+                                                        "$$this.v",
+                                                        {"$literal": value},
+                                                    ]
+                                                },
+                                                {"$lt": ["$$this.i", length]},
+                                            ]
+                                        },
+                                    }
+                                }
+                            },
+                        }
+                    },
+                ]
+            )
+        )
+
+    def insert(self, i, x):
+        self._unsupported("insert")
+
+    def pop(self, i=-1):
+        self._unsupported("pop")
+
+    def remove(self, x):
+        self._unsupported("remove")
+
+    def reverse(self):
+        self._unsupported("reverse")
+
+    def sort(self, key=None, reverse=False):
+        self._unsupported("sort")
+
+    def __repr__(self):
+        return str(self.copy())
+
+    def __str__(self):
+        return str(self.copy())
+
+    def __add__(self, x):
+        return self.copy() + x
+
+    def __iadd__(self, x):
+        self.extend(x)
+        return self
+
+    def __mul__(self, x):
+        return self.copy() * x
+
+    def __iter__(self):
+        return self._values()
+
+    def __getitem__(self, x):
+        if isinstance(x, slice):
+            start, stop, step = x.indices(len(self))
+            positions = range(start, stop, step)
+            if len(positions) == 0:
+                return []
+            first = min(positions[0], positions[-1]) // self.chunk_size
+            last = max(positions[0], positions[-1]) // self.chunk_size
+            values = {item["i"]: item["v"] for item in self._items(first, last)}
+            return [values.get(i) for i in positions]
+
+        i = self._resolve_index(x)
+        if i < 0:
+            raise IndexError("list index out of range")
+        chunk = self._reader.find_one(
+            {**self.chunk_filter, "n": i // self.chunk_size},
+            projection={"_id": 0, "items": {"$elemMatch": {"i": i}}},
+        )
+        if chunk is None or len(chunk.get("items", [])) == 0:
+            if i < len(self):
+                # reserved by an append that has not written it (yet)
+                return None
+            raise IndexError("list index out of range")
+        return self._decode(chunk["items"][0]["v"])
+
+    def __setitem__(self, x, val):
+        if isinstance(x, slice):
+            self._unsupported("Slice assignment")
+        self._check_value(val)
+        i = self._resolve_index(x)
+        if i < 0 or (
+            self._collection.update_one(
+                {**self.chunk_filter, "n": i // self.chunk_size, "items.i": i},
+                {"$set": {"items.$.v": self._encode(val)}},
+            ).matched_count
+            == 0
+        ):
+            raise IndexError("list assignment index out of range")
+
+    def __len__(self):
+        header = self._reader.find_one(
+            self.db_filter, projection={"_id": 0, "length": 1}
+        )
+        if header is None:
+            raise ValueError(f"Entry {self.name} does not exist!")
+        return header["length"]
+
+    def __contains__(self, x):
+        match = {"v": self._encode(x), "i": {"$lt": len(self)}}
+        document = self._reader.find_one(
+            {**self.chunk_filter, "items": {"$elemMatch": match}},
+            projection={"_id": 1},
+        )
+        return document is not None
+
+    def __eq__(self, x):
+        return self.copy() == x
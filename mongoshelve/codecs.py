@@ -0,0 +1,138 @@
+import pickle
+import struct
+import zlib
+from typing import Any, List, Optional
+from bson.binary import Binary
+
+try:
+    import lz4.frame
+except ImportError:  # optional, only required for compression="lz4"
+    lz4 = None
+try:
+    import msgpack
+except ImportError:  # optional, only required for MsgpackCodec
+    msgpack = None
+try:
+    import numpy as np
+except ImportError:  # optional, arrays are only handled if numpy is installed
+    np = None
+
+# first user-defined subtype, marks values written by a BinaryCodec
+BINARY_SUBTYPE = 0x80
+_COMPRESSIONS = {None: b"\x00", "zlib": b"z", "lz4": b"4"}
+_NDARRAY_EXT = 1  # msgpack extension type of numpy arrays
+
+
+class Codec:
+    """Converts the values stored in a MongoDict/MongoList (dict values and list elements) to and from the form they are stored in MongoDB. Subclasses implement `encode` and `decode`.
+
+    Values stored by a codec are opaque to MongoDB, so nested values are not returned as MongoDict/MongoList objects, and MongoList.sort is done locally.
+    """
+
+    def encode(self, value: Any) -> Any:
+        """Converts a value into something BSON can store."""
+        raise NotImplementedError
+
+    def decode(self, value: Any) -> Any:
+        """Inverse of `encode`. Values that were not written by this codec (ie before it was used) must be returned unchanged."""
+        raise NotImplementedError
+
+
+class BinaryCodec(Codec):
+    """Base class for codecs that serialize values into BSON Binary, optionally compressed. Subclasses implement `dumps` and `loads`.
+
+    Args:
+        compression (Optional[str], optional): None, "zlib" or "lz4" (requires the lz4 package). Each value records how it was compressed, so this can be changed for existing data. Defaults to None.
+        level (Optional[int], optional): Compression level, or None for the default of the algorithm. Defaults to None.
+    """
+
+    def __init__(self, compression: Optional[str] = None, level: Optional[int] = None):
+        if compression not in _COMPRESSIONS:
+            raise ValueError(f"Unknown compression {compression}!")
+        if compression == "lz4" and lz4 is None:
+            raise ValueError("lz4 compression requires the lz4 package!")
+        self.compression = compression
+        self.level = level
+
+    def dumps(self, value: Any) -> bytes:
+        raise NotImplementedError
+
+    def loads(self, data: memoryview) -> Any:
+        raise NotImplementedError
+
+    def encode(self, value: Any) -> Binary:
+        data = self.dumps(value)
+        if self.compression == "zlib":
+            data = zlib.compress(data, -1 if self.level is None else self.level)
+        elif self.compression == "lz4":
+            data = lz4.frame.compress(data, compression_level=self.level or 0)
+        return Binary(_COMPRESSIONS[self.compression] + data, BINARY_SUBTYPE)
+
+    def decode(self, value: Any) -> Any:
+        if not isinstance(value, Binary) or value.subtype != BINARY_SUBTYPE:
+            return value
+        marker, data = value[:1], memoryview(value)[1:]
+        if marker == _COMPRESSIONS["zlib"]:
+            data = memoryview(zlib.decompress(data))
+        elif marker == _COMPRESSIONS["lz4"]:
+            if lz4 is None:
+                raise ValueError("Decoding this value requires the lz4 package!")
+            data = memoryview(lz4.frame.decompress(data))
+        return self.loads(data)
+
+
+class PickleCodec(BinaryCodec):
+    """Stores values with pickle, so any picklable value can be stored. Large buffers (ie numpy arrays) are stored out-of-band as raw bytes, and the decoded objects are backed by the bytes read from MongoDB without being copied. Arrays decoded this way are read-only.
+
+    Unpickling can run arbitrary code, so only use this with databases that are trusted.
+    """
+
+    def dumps(self, value: Any) -> bytes:
+        buffers: List[pickle.PickleBuffer] = []
+        data = pickle.dumps(value, protocol=5, buffer_callback=buffers.append)
+        raw = [buffer.raw() for buffer in buffers]
+        header = struct.pack(f"<{len(raw) + 2}Q", len(raw), len(data), *map(len, raw))
+        return b"".join([header, data, *raw])
+
+    def loads(self, data: memoryview) -> Any:
+        (count,) = struct.unpack_from("<Q", data)
+        lengths = struct.unpack_from(f"<{count + 1}Q", data, 8)
+        offset = 8 * (count + 2)
+        chunks = []
+        for length in lengths:
+            chunks.append(data[offset : offset + length])
+            offset += length
+        return pickle.loads(chunks[0], buffers=chunks[1:])
+
+
+class MsgpackCodec(BinaryCodec):
+    """Stores values with msgpack, which is faster and more compact than BSON for large numeric payloads, and is not tied to python. Numpy arrays are stored as their dtype, shape and raw buffer, and decoded with `numpy.frombuffer`. Requires the msgpack package."""
+
+    def __init__(self, compression: Optional[str] = None, level: Optional[int] = None):
+        if msgpack is None:
+            raise ValueError("MsgpackCodec requires the msgpack package!")
+        super().__init__(compression=compression, level=level)
+
+    @staticmethod
+    def _default(value: Any) -> Any:
+        if np is not None and isinstance(value, np.ndarray):
+            value = np.ascontiguousarray(value)
+            header = msgpack.packb([value.dtype.str, list(value.shape)])
+            return msgpack.ExtType(_NDARRAY_EXT, header + value.tobytes())
+        raise TypeError(f"Cannot serialize {type(value).__name__} with msgpack!")
+
+    @staticmethod
+    def _ext_hook(code: int, data: bytes) -> Any:
+        if code != _NDARRAY_EXT or np is None:
+            return msgpack.ExtType(code, data)
+        unpacker = msgpack.Unpacker()
+        unpacker.feed(data)
+        dtype, shape = unpacker.unpack()
+        buffer = memoryview(data)[unpacker.tell() :]
+        return np.frombuffer(buffer, dtype=dtype).reshape(shape)
+
+    def dumps(self, value: Any) -> bytes:
+        return msgpack.packb(value, default=self._default, use_bin_type=True)
+
+    def loads(self, data: memoryview) -> Any:
+        return msgpack.unpackb(data, ext_hook=self._ext_hook, raw=False)
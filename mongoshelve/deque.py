@@ -0,0 +1,196 @@
+import os
+from typing import Iterable, Optional, Union
+from pymongo.collection import Collection
+from pymongo.read_preferences import _ServerMode
+from .codecs import Codec
+from .list import MAX_ARRAY_LENGTH, MongoList
+from .mirror import ShelfMirror
+from .stats import recorded
+
+
+@recorded
+class MongoDeque(MongoList):
+    """List with an optional `maxlen`, like `collections.deque`, stored in a MongoDB document. Once the deque is full, adding elements to one end discards the same number of elements from the other end. Appends are sent as a single `$push` with `$slice`, so the array is trimmed by MongoDB in the same atomic update, and the stored size stays bounded however long it is appended to. This makes it suited to ring buffers such as "the last N readings".
+
+    All MongoList methods are available as well. `maxlen` is not stored in the database, so every process using the deque should pass the same value.
+    """
+
+    def __new__(cls, *args, **kwargs):
+        return object.__new__(cls)
+
+    def __init__(
+        self,
+        collection: Collection,
+        name: str,
+        default_value: Union[list, None] = None,
+        maxlen: Optional[int] = None,
+        cache: bool = False,
+        cache_ttl: Optional[float] = None,
+        write_behind: bool = False,
+        flush_interval: float = 0.2,
+        max_pending: int = 1000,
+        codec: Optional[Codec] = None,
+        page_size: int = 1000,
+        read_preference: Optional[_ServerMode] = None,
+        mirror: Union[str, os.PathLike, ShelfMirror, None] = None,
+        mirror_fallback: bool = False,
+        _projection: str = "contents",
+        _apply_default: bool = True,
+        _parent=None,
+        _filter: Optional[dict] = None,
+    ):
+        if maxlen is not None and maxlen < 0:
+            raise ValueError("maxlen must be non-negative")
+        self.maxlen = maxlen
+        super().__init__(
+            collection=collection,
+            name=name,
+            default_value=self._trimmed(list(default_value or [])),
+            cache=cache,
+            cache_ttl=cache_ttl,
+            write_behind=write_behind,
+            flush_interval=flush_interval,
+            max_pending=max_pending,
+            codec=codec,
+            page_size=page_size,
+            read_preference=read_preference,
+            mirror=mirror,
+            mirror_fallback=mirror_fallback,
+            _projection=_projection,
+            _apply_default=_apply_default,
+            _parent=_parent,
+            _filter=_filter,
+        )
+
+    def _trimmed(self, value: list, left: bool = False) -> list:
+        """Discards elements from the left end of `value` (or the right end if `left` is True) until it fits within `maxlen`. The list is modified in place and returned."""
+        if self.maxlen is not None and len(value) > self.maxlen:
+            if left:
+                del value[self.maxlen :]
+            else:
+                del value[: len(value) - self.maxlen]
+        return value
+
+    def _push(self, values: list, left: bool = False) -> dict:
+        """Builds a $push of `values` onto the right end of the deque (or the left end if `left` is True), which trims the other end to `maxlen` within the same update."""
+        push = {"$each": self._encode_all(values)}
+        if left:
+            push["$position"] = 0
+        if self.maxlen is not None:
+            push["$slice"] = self.maxlen if left else -self.maxlen
+        return {"$push": {self.db_projection: push}}
+
+    def _extend(self, values: list, left: bool = False):
+        for val in values:
+            self._check_value(val)
+        if len(values) == 0:
+            return
+
+        def apply(value):
+            normalized = [self._normalize(val) for val in values]
+            value[:] = normalized + value if left else value + normalized
+            self._trimmed(value, left=left)
+
+        self._write(self._push(values, left=left), apply=apply)
+
+    def append(self, x):
+        self._extend([x])
+
+    def appendleft(self, x):
+        self._extend([x], left=True)
+
+    def extend(self, x):
+        self._extend(list(x))
+
+    def extendleft(self, x: Iterable):
+        """Adds the elements of `x` to the left end one by one, so they end up in reverse order, like `collections.deque.extendleft`."""
+        self._extend(list(x)[::-1], left=True)
+
+    def insert(self, i, x):
+        """Inserts `x` before position `i`.
+
+        Raises:
+            IndexError: The deque is already at its maximum size.
+        """
+        self._check_value(x)
+        if self.maxlen == 0:
+            raise IndexError("deque already at its maximum size")
+        condition = None
+        if self.maxlen is not None:
+            # only matches while the deque has room for another element
+            condition = {f"{self.db_projection}.{self.maxlen - 1}": {"$exists": False}}
+        if not self._write(
+            {
+                "$push": {
+                    self.db_projection: {"$each": [self._encode(x)], "$position": i}
+                }
+            },
+            condition=condition,
+            apply=lambda value: value.insert(i, self._normalize(x)),
+        ):
+            raise IndexError("deque already at its maximum size")
+
+    def popleft(self):
+        try:
+            return self.pop(0)
+        except IndexError:
+            raise IndexError("pop from an empty deque") from None
+
+    def rotate(self, n: int = 1):
+        """Rotates the deque `n` steps to the right (or to the left if `n` is negative) with a single pipeline update."""
+        if n == 0:
+            return
+        size = {"$size": self._array}
+        # $mod keeps the sign of the dividend, unlike python's %
+        shift = {"$mod": [{"$add": [{"$mod": [n, "$$size"]}, "$$size"]}, "$$size"]}
+        cut = {"$subtract": ["$$size", shift]}
+        rotated = {
+            "$cond": [
+                {"$eq": ["$$size", 0]},
+                self._array,
+                {
+                    "$concatArrays": [
+                        {"$slice": [self._array, cut, MAX_ARRAY_LENGTH]},
+                        {"$slice": [self._array, 0, cut]},
+                    ]
+                },
+            ]
+        }
+
+        def apply(value):
+            if len(value) > 0:
+                k = n % len(value)
+                value[:] = value[len(value) - k :] + value[: len(value) - k]
+
+        self._write(
+            [
+                {
+                    "$set": {
+                        self.db_projection: {
+                            "$let": {"vars": {"size": size}, "in": rotated}
+                        }
+                    }
+                }
+            ],
+            apply=apply,
+        )
+
+    def __setitem__(self, x, val):
+        if isinstance(x, slice):
+            raise TypeError("sequence index must be integer, not 'slice'")
+        super().__setitem__(x, val)
+
+    def __imul__(self, x):
+        if x > 0 and self.maxlen != 0:
+            new = {"$concatArrays": [self._array] * x}
+            if self.maxlen is not None:
+                new = {"$slice": [new, -self.maxlen]}
+        else:
+            new = {"$literal": []}
+
+        def apply(value):
+            value *= x
+            self._trimmed(value)
+
+        self._write([{"$set": {self.db_projection: new}}], apply=apply)
+        return self
@@ -1,23 +1,82 @@
-from typing import Any, Union
+import collections.abc
+import copy
+import os
+from typing import Any, Callable, Iterator, Optional, Tuple, Union
 from pymongo.collection import Collection
+from pymongo.read_preferences import _ServerMode
+from .base import MongoShelf, bson_less
+from .codecs import Codec
+from .diff import diff_update
 from .list import MongoList
+from .mirror import ShelfMirror
+from .stats import recorded
+from .utils import (
+    VERSION_FIELD,
+    decode_keys,
+    encode_keys,
+    escape_key,
+    get_path,
+    unescape_key,
+    version_condition,
+)
 
 UUID4_PLACEHOLDER = "be8b61ee-48b1-4624-bf7a-2ca31f7c5ef4"
 
 
-class MongoDict:
-    """Class that emulates a dict, but stores the dict in the device database. Useful for working with Device attributes that are dict, so values persist across alabos sessions. This should be instantiated using `alab_management.device_view.device.BaseDevice.dict_in_database`"""
+@recorded
+class MongoDict(MongoShelf):
+    """Class that emulates a dict, but stores the dict in the device database. Useful for working with Device attributes that are dict, so values persist across alabos sessions. This should be instantiated using `alab_management.device_view.device.BaseDevice.dict_in_database`
+
+    With `layout="per_key"`, a `PerKeyMongoDict` is created instead, which stores each key in its own document.
+    """
+
+    def __new__(cls, *args, layout: str = "document", **kwargs):
+        if layout == "per_key":
+            from .perkey import PerKeyMongoDict
+
+            return PerKeyMongoDict(*args, **kwargs)
+        return super().__new__(cls)
 
     def __init__(
         self,
         collection: Collection,
         name: str,
         default_value: Union[dict, None] = None,
+        cache: bool = False,
+        cache_ttl: Optional[float] = None,
+        write_behind: bool = False,
+        flush_interval: float = 0.2,
+        max_pending: int = 1000,
+        codec: Optional[Codec] = None,
+        page_size: int = 1000,
+        read_preference: Optional[_ServerMode] = None,
+        mirror: Union[str, os.PathLike, ShelfMirror, None] = None,
+        mirror_fallback: bool = False,
         _projection: str = "contents",
+        _apply_default: bool = True,
+        _parent=None,
+        _filter: Optional[dict] = None,
+        layout: str = "document",
     ):
-        self._collection = collection
-        self._projection = _projection
-        self.name = name
+        if layout != "document":
+            raise ValueError(f"Unknown layout {layout} for MongoDict!")
+        super().__init__(
+            collection=collection,
+            name=name,
+            cache=cache,
+            cache_ttl=cache_ttl,
+            write_behind=write_behind,
+            flush_interval=flush_interval,
+            max_pending=max_pending,
+            codec=codec,
+            page_size=page_size,
+            read_preference=read_preference,
+            mirror=mirror,
+            mirror_fallback=mirror_fallback,
+            _projection=_projection,
+            _parent=_parent,
+            _filter=_filter,
+        )
         if default_value is None:
             self.default_value = {}
         else:
@@ -27,77 +86,67 @@ class MongoDict:
                 )
             self.default_value = default_value
 
-        self.apply_default_value(overwrite=False)
+        if _apply_default:
+            self.apply_default_value(overwrite=False)
 
-    def apply_default_value(self, overwrite: bool = False):
-        """This is called within `alab_management.scripts.setup_lab()` to ensure that all devices have the correct default values for their attributes. This should not be called manually.
-
-        Raises:
-            ValueError: Device is not found in the database. This should only occur if this function is called out of order (i.e. before the device is created in the db).
-        """
-        result = self._collection.find_one(self.db_filter)
-        if result is None:
-            self._collection.insert_one({"name": self.name, "contents": {}})
-        else:
-            if not overwrite:
-                return
-
-        self._collection.update_one(
-            self.db_filter, {"$set": {self.db_projection: self.default_value}}
-        )
-
-    @property
-    def db_projection(self):
-        return self._projection
-
-    @property
-    def db_filter(self):
-        return {"name": self.name}
+    @classmethod
+    def _raise_if_invalid_value(cls, val: Any):
+        # lists/tuples entered as dict values may be returned later as ListInDatabase objects. ListInDatabase does not support nested iterables! So we will raise an error if we detect values that ListInDatabase cannot handle.
+        if any([isinstance(val, t) for t in [tuple, list]]):
+            for _val in val:
+                MongoList._raise_if_invalid_value(_val)
 
-    @property
-    def _value(self):
-        value = self._collection.find_one(
-            {"name": self.name}, projection=[self.db_projection]
-        )
-        if value is None:
-            raise ValueError(
-                f"DictInDatabase {self.name} does not contain data at {self.db_projection}!"
+    def _key_path(self, key) -> str:
+        """Dotted path to `key` within the MongoDB document, ie `contents.<escaped key>`."""
+        return f"{self.db_projection}.{escape_key(key)}"
+
+    def _encode(self, value: Any) -> Any:
+        if self.codec is not None:
+            return self.codec.encode(value)
+        return encode_keys(value)
+
+    def _decode(self, value: Any) -> Any:
+        if self.codec is not None:
+            return self.codec.decode(value)
+        return decode_keys(value)
+
+    def _encode_all(self, value: dict) -> dict:
+        return {escape_key(key): self._encode(val) for key, val in value.items()}
+
+    def _decode_all(self, value: dict) -> dict:
+        return {unescape_key(key): self._decode(val) for key, val in value.items()}
+
+    def _wrap(self, key, val):
+        """Nested dicts and lists are returned as MongoDict/MongoList objects pointing to `key` so that modifying them modifies the database. The document already exists, so these are built without the round trip to apply their default value. Values stored by a codec are opaque to MongoDB, so they are returned as they are."""
+        if self.codec is not None:
+            return val
+        if isinstance(val, dict):
+            return MongoDict(
+                collection=self._collection,
+                name=self.name,
+                default_value=val,
+                _projection=self._key_path(key),
+                _apply_default=False,
+                **self._child_options(key),
             )
-        return_value = value
-        for key in self.db_projection.split("."):
-            return_value = return_value[key]
-
-        for key, val in return_value.items():
-            if isinstance(val, dict):
-                return_value[key] = MongoDict(
-                    collection=self._collection,
-                    name=self.name,
-                    default_value=val,
-                    _projection=f"{self.db_projection}.{key}",
-                )
-            elif isinstance(val, list):
-                return_value[key] = MongoList(
-                    collection=self._collection,
-                    name=self.name,
-                    default_value=val,
-                    _projection=f"{self.db_projection}.{key}",
-                )
-        return return_value
+        if isinstance(val, list):
+            return MongoList(
+                collection=self._collection,
+                name=self.name,
+                default_value=val,
+                _projection=self._key_path(key),
+                _apply_default=False,
+                **self._child_options(key),
+            )
+        return val
 
     def as_normal_dict(self) -> dict:
-        value = self._collection.find_one(
-            {"name": self.name}, projection=[self.db_projection]
-        )
-        if value is None:
-            raise ValueError(
-                f"Dict by name {self.name} does not contain data at {self.db_projection}!"
-            )
-        for key in self.db_projection.split("."):
-            value = value[key]
-        return value
+        return self._read()
 
     def clear(self):
-        self._collection.update_one(self.db_filter, {"$set": {self.db_projection: {}}})
+        self._write(
+            {"$set": {self.db_projection: {}}}, apply=lambda value: value.clear()
+        )
 
     def copy(self):
         return self.as_normal_dict()  # copied by virtue of reading from database
@@ -106,53 +155,359 @@ class MongoDict:
         raise NotImplementedError("fromkeys is not implemented for DictInDatabase")
 
     def get(self, key, default=None):
-        return self._value.get(key, default)
+        if not isinstance(key, str):
+            return default  # only string keys can be stored
+        try:
+            return self[key]
+        except KeyError:
+            return default
 
     def items(self):
-        return self._value.items()
+        return _ItemsView(self)
 
     def keys(self):
-        return self.as_normal_dict().keys()
+        return collections.abc.KeysView(self)
 
     def values(self):
-        return self.as_normal_dict().values()
+        return _ValuesView(self)
+
+    def _entries(self, values: bool = True) -> Iterator[Tuple[str, Any]]:
+        """Streams the (key, value) pairs of the dict. The entries are unwound on the server and fetched `page_size` at a time, so the whole dict is never held in memory. If `values` is False, only the keys are fetched (and the values are None)."""
+        cached = self._cached_value()
+        if cached is not None:
+            for key, val in list(cached.items()):
+                yield key, self._wrap(key, copy.deepcopy(val)) if values else None
+            return
+
+        projection = {"_id": 0, "k": "$entry.k"}
+        if values:
+            projection["v"] = "$entry.v"
+        for entry in self._reader.aggregate(
+            [
+                {"$match": self.db_filter},
+                {
+                    "$project": {
+                        "_id": 0,
+                        "entry": {"$objectToArray": f"${self.db_projection}"},
+                    }
+                },
+                {"$unwind": "$entry"},
+                {"$project": projection},
+            ],
+            batchSize=self.page_size,
+        ):
+            key = unescape_key(entry["k"])
+            yield key, self._wrap(key, self._decode(entry["v"])) if values else None
+
+    def find(self, predicate: Any) -> dict:
+        """Returns the entries whose value matches `predicate`. The entries are filtered by MongoDB, so only the matching ones are transferred.
+
+        Args:
+            predicate (Any): MongoDB query on the values. Either a plain value to compare to, query operators (ie `{"$gt": 5}`), or conditions on the fields of dict values (ie `{"status": "done", "retries": {"$lt": 3}}`). As in any MongoDB query, a list value matches if any of its elements does.
+
+        Returns:
+            dict: Matching keys and their values.
+        """
+        results = {}
+        for result in self._reader.aggregate(
+            [{"$match": self.db_filter}, *self._find_stages(predicate)]
+        ):
+            key = unescape_key(result["entry"]["k"])
+            results[key] = self._wrap(key, self._decode(result["entry"]["v"]))
+        return results
+
+    def _find_stages(self, predicate: Any) -> list:
+        """Aggregation stages for `find` (after matching the document), which return the matching `{entry: {k: <escaped key>, v: <stored value>}}`."""
+        return [
+            {
+                "$project": {
+                    "_id": 0,
+                    "entry": {"$objectToArray": f"${self.db_projection}"},
+                }
+            },
+            {"$unwind": "$entry"},
+            {"$match": self._value_query("entry.v", predicate)},
+        ]
+
+    def _value_query(self, path: str, predicate: Any) -> dict:
+        """Translates a `find` predicate into a query on the values stored at `path`."""
+        if not isinstance(predicate, dict):
+            return {path: self._encode(predicate)}
+        if all(key.startswith("$") for key in predicate):
+            return {path: predicate}
+        return {f"{path}.{field}": condition for field, condition in predicate.items()}
+
+    def select(self, keys) -> dict:
+        """Returns the entries for `keys`, reading only those keys. Keys that do not exist are left out."""
+        keys = list(keys)
+        cached = self._cached_value()
+        if cached is not None:
+            return {
+                key: self._wrap(key, copy.deepcopy(cached[key]))
+                for key in keys
+                if key in cached
+            }
+        if len(keys) == 0:
+            return {}
+
+        document = self._reader.find_one(
+            self.db_filter,
+            projection={
+                "_id": 0,
+                "name": 1,
+                **{self._key_path(key): 1 for key in keys},
+            },
+        )
+        if document is None:
+            raise ValueError(
+                f"Dict by name {self.name} does not contain data at {self.db_projection}!"
+            )
+        try:
+            values = get_path(document, self.db_projection)
+        except KeyError:
+            return {}
+        return {
+            key: self._wrap(key, self._decode(values[escape_key(key)]))
+            for key in keys
+            if escape_key(key) in values
+        }
 
     def pop(self, key, default=UUID4_PLACEHOLDER):
-        current = self.as_normal_dict()
-        result = current.pop(key, default)
-        if result == UUID4_PLACEHOLDER:  # only fires if default value was not provided
-            raise KeyError(f"{key} was not found in the dictionary!")
-
-        self._collection.update_one(
-            self.db_filter, {"$set": {self.db_projection: current}}
+        if not isinstance(key, str):
+            # only string keys can be stored
+            if default == UUID4_PLACEHOLDER:
+                raise KeyError(f"{key} was not found in the dictionary!")
+            return default
+        path = self._key_path(key)
+        before = self._write(
+            {"$unset": {path: ""}},
+            condition={path: {"$exists": True}},
+            fetch={path: 1},
+            apply=lambda value: value.pop(key),
         )
-        return result
+        if before is None:
+            # only fires if default value was not provided
+            if default == UUID4_PLACEHOLDER:
+                raise KeyError(f"{key} was not found in the dictionary!")
+            return default
+        return self._decode(get_path(before, path))
+
+    def _last_entry(self) -> Tuple[Optional[str], Optional[int]]:
+        """Returns the escaped name of the last field in the sub-document (or None if it is empty), and the document version that it was read at."""
+        with self._lock:
+            cached = self._cached_value()
+            if cached is not None:
+                if len(cached) == 0:
+                    return None, self._cached_version()
+                return escape_key(next(reversed(cached))), self._cached_version()
+        last = list(
+            self._collection.aggregate(
+                [
+                    {"$match": self.db_filter},
+                    {
+                        "$project": {
+                            "_id": 0,
+                            "field": {
+                                "$arrayElemAt": [
+                                    {"$objectToArray": f"${self.db_projection}"},
+                                    -1,
+                                ]
+                            },
+                            VERSION_FIELD: 1,
+                        }
+                    },
+                ]
+            )
+        )
+        if len(last) == 0:
+            return None, None
+        version = last[0].get(VERSION_FIELD, 0)
+        if "field" not in last[0]:
+            return None, version
+        return last[0]["field"]["k"], version
 
     def popitem(self):
-        current = self._value
-        result = current.popitem()
-        current_dict = self.as_normal_dict()
-        current_dict.pop(result[0])
-        self._collection.update_one(
-            self.db_filter, {"$set": {self.db_projection: current_dict}}
-        )
-        return result
+        """Removes and returns the most recently inserted (key, value) pair. MongoDB preserves the insertion order of fields, so the last field of the sub-document is the last key inserted. The removal is conditioned on the document version, so a key inserted concurrently is never skipped over.
+
+        Raises:
+            KeyError: The dict is empty.
+            VersionConflictError: The document kept being modified concurrently, see `MongoShelf.max_retries`.
+        """
+
+        def attempt():
+            field, version = self._last_entry()
+            if field is None:
+                raise KeyError("popitem(): dictionary is empty")
+            key = unescape_key(field)
+            path = f"{self.db_projection}.{field}"
+            before = self._write(
+                {"$unset": {path: ""}},
+                condition=version_condition(version),
+                fetch={path: 1},
+                apply=lambda value: value.pop(key),
+            )
+            if before is None:
+                return False, None
+            return True, (key, self._decode(get_path(before, path)))
+
+        return self._retry_on_conflict(attempt)
 
     def setdefault(self, key, default=None):
         raise NotImplementedError("setdefault is not implemented for DictInDatabase")
 
     def update(self, *args, **kwargs):
-        current = self._value
-        current.update(*args, **kwargs)
-        self._collection.update_one(
-            self.db_filter, {"$set": {self.db_projection: current}}
+        new = dict(*args, **kwargs)
+        for val in new.values():
+            self._check_value(val)
+        if len(new) == 0:
+            return
+        encoded = {escape_key(key): self._encode(val) for key, val in new.items()}
+
+        def apply(value):
+            value.update({key: self._normalize(val) for key, val in new.items()})
+
+        if not any(isinstance(val, (dict, list)) for val in encoded.values()):
+            self._write(
+                {
+                    "$set": {
+                        f"{self.db_projection}.{field}": val
+                        for field, val in encoded.items()
+                    }
+                },
+                apply=apply,
+            )
+            return
+
+        # nested values are diffed against the stored ones, so only the leaves that changed are written
+        self._compare_and_swap(
+            lambda current: (
+                diff_update(
+                    {
+                        escape_key(key): self._encode(val)
+                        for key, val in current.items()
+                    },
+                    encoded,
+                    self.db_projection,
+                ),
+                apply,
+                None,
+            ),
+            read=lambda: self._read_keys(list(new)),
+        )
+
+    def _read_keys(self, keys: list) -> Tuple[dict, Optional[int]]:
+        """Reads the entries for `keys` that exist, and the document version they were read at.
+
+        Raises:
+            ValueError: The document does not exist.
+        """
+        with self._lock:
+            cached = self._cached_value()
+            if cached is not None:
+                entries = {key: cached[key] for key in keys if key in cached}
+                return copy.deepcopy(entries), self._cached_version()
+        document = self._collection.find_one(
+            self.db_filter,
+            projection={
+                "_id": 0,
+                VERSION_FIELD: 1,
+                **{self._key_path(key): 1 for key in keys},
+            },
+        )
+        if document is None:
+            raise ValueError(
+                f"Entry {self.name} does not contain data at {self.db_projection}!"
+            )
+        try:
+            stored = get_path(document, self.db_projection)
+        except KeyError:
+            stored = {}
+        return self._decode_all(stored), document.get(VERSION_FIELD, 0)
+
+    def _update_field(
+        self,
+        operator: str,
+        key: str,
+        operand: Any,
+        combine: Callable[[Any, Any], Any],
+    ) -> Any:
+        """Applies a field update operator (ie `$inc`) to the value of `key` with a single atomic update, so concurrent updates are never lost. The new value is returned and cached as MongoDB computed it. `combine(current, operand)` computes the same result locally (`current` is UUID4_PLACEHOLDER if the key does not exist), which is only used in write-behind mode, where the local copy is authoritative.
+
+        Raises:
+            ValueError: The dict uses a codec (the stored values are opaque to MongoDB), or its document does not exist.
+        """
+        if self.codec is not None:
+            raise ValueError(
+                f"{operator} cannot be applied to values stored by a codec!"
+            )
+        self._check_value(operand)
+        path = self._key_path(key)
+
+        def apply(value, document=None):
+            if document is None:
+                value[key] = combine(value.get(key, UUID4_PLACEHOLDER), operand)
+            else:
+                value[key] = self._decode(get_path(document, path))
+
+        after = self._write(
+            {operator: {path: operand}}, fetch={path: 1}, apply=apply, after=True
+        )
+        if after is None:
+            raise ValueError(
+                f"Entry {self.name} does not contain data at {self.db_projection}!"
+            )
+        return self._decode(get_path(after, path))
+
+    def incr(self, key: str, n: Union[int, float] = 1) -> Union[int, float]:
+        """Atomically adds `n` to the value of `key` (which is created with value `n` if it does not exist), and returns the new value.
+
+        Args:
+            key (str): Key of a numeric value.
+            n (Union[int, float], optional): Amount to add, can be negative. Defaults to 1.
+        """
+        return self._update_field(
+            "$inc",
+            key,
+            n,
+            lambda current, n: n if current == UUID4_PLACEHOLDER else current + n,
+        )
+
+    def mul(self, key: str, factor: Union[int, float]) -> Union[int, float]:
+        """Atomically multiplies the value of `key` by `factor`, and returns the new value. Like MongoDB's `$mul`, a key that does not exist is created with value 0."""
+        return self._update_field(
+            "$mul",
+            key,
+            factor,
+            lambda current, f: f * 0 if current == UUID4_PLACEHOLDER else current * f,
+        )
+
+    def set_max(self, key: str, value: Any) -> Any:
+        """Atomically replaces the value of `key` with `value` if `value` is greater (or the key does not exist), and returns the resulting value. Useful for high-water marks. Like MongoDB's `$max`, values of different types are compared by type (ie `True` is greater than any number)."""
+        return self._update_field(
+            "$max",
+            key,
+            value,
+            lambda current, v: (
+                v if current == UUID4_PLACEHOLDER or bson_less(current, v) else current
+            ),
+        )
+
+    def set_min(self, key: str, value: Any) -> Any:
+        """Atomically replaces the value of `key` with `value` if `value` is smaller (or the key does not exist), and returns the resulting value."""
+        return self._update_field(
+            "$min",
+            key,
+            value,
+            lambda current, v: (
+                v if current == UUID4_PLACEHOLDER or bson_less(v, current) else current
+            ),
         )
 
     def __reversed__(self):
-        return reversed(self._value)
+        return reversed(self.as_normal_dict())
 
     def __iter__(self):
-        return iter(self._value)
+        return (key for key, _ in self._entries(values=False))
 
     def __repr__(self):
         return str(self.as_normal_dict())
@@ -161,32 +516,95 @@ class MongoDict:
         return str(self.as_normal_dict())
 
     def __getitem__(self, x):
-        return self._value[x]
+        if not isinstance(x, str):
+            raise KeyError(x)  # only string keys can be stored
+        cached = self._cached_value()
+        if cached is not None:
+            return self._wrap(x, copy.deepcopy(cached[x]))
+
+        path = self._key_path(x)
+        value = self._reader.find_one(self.db_filter, projection={"_id": 0, path: 1})
+        if value is None:
+            raise ValueError(
+                f"Dict by name {self.name} does not contain data at {self.db_projection}!"
+            )
+        try:
+            value = get_path(value, path)
+        except KeyError:
+            raise KeyError(x) from None
+        return self._wrap(x, self._decode(value))
 
     def __setitem__(self, x, val):
-        # lists/tuples entered as dict values may be returned later as ListInDatabase objects. ListInDatabase does not support nested iterables! So we will raise an error if we detect values that ListInDatabase cannot handle.
-        if any([isinstance(val, t) for t in [tuple, list]]):
-            for _val in val:
-                MongoList._raise_if_invalid_value(_val)
-
-        current = self.as_normal_dict()
-        current[x] = val
-        self._collection.update_one(
-            self.db_filter, {"$set": {self.db_projection: current}}
+        self._check_value(val)
+        self._write(
+            {"$set": {self._key_path(x): self._encode(val)}},
+            apply=lambda value: value.__setitem__(x, self._normalize(val)),
         )
 
     def __delitem__(self, x):
-        current = self.as_normal_dict()
-        del current[x]
-        self._collection.update_one(
-            self.db_filter, {"$set": {self.db_projection: current}}
-        )
+        if not isinstance(x, str):
+            raise KeyError(x)  # only string keys can be stored
+        path = self._key_path(x)
+        if not self._write(
+            {"$unset": {path: ""}},
+            condition={path: {"$exists": True}},
+            apply=lambda value: value.pop(x),
+        ):
+            raise KeyError(x)
 
     def __contains__(self, x):
-        return x in self.as_normal_dict()
+        if not isinstance(x, str):
+            return False  # only string keys can be stored
+        cached = self._cached_value()
+        if cached is not None:
+            return x in cached
+
+        path = self._key_path(x)
+        value = self._reader.find_one(
+            {**self.db_filter, path: {"$exists": True}}, projection={"_id": 1}
+        )
+        return value is not None
 
     def __len__(self):
-        return len(self.as_normal_dict())
+        cached = self._cached_value()
+        if cached is not None:
+            return len(cached)
+
+        result = list(
+            self._reader.aggregate(
+                [
+                    {"$match": self.db_filter},
+                    {
+                        "$project": {
+                            "_id": 0,
+                            "length": {
+                                "$size": {"$objectToArray": f"${self.db_projection}"}
+                            },
+                        }
+                    },
+                ]
+            )
+        )
+        if len(result) == 0:
+            raise ValueError(
+                f"Dict by name {self.name} does not contain data at {self.db_projection}!"
+            )
+        return result[0]["length"]
 
     def __eq__(self, other):
         return self.as_normal_dict() == other
+
+
+class _ValuesView(collections.abc.ValuesView):
+    """Streams the values of a MongoDict (or PerKeyMongoDict), rather than reading the whole dict or querying one key at a time."""
+
+    def __iter__(self):
+        for _, value in self._mapping._entries():
+            yield value
+
+
+class _ItemsView(collections.abc.ItemsView):
+    """Streams the items of a MongoDict (or PerKeyMongoDict), rather than reading the whole dict or querying one key at a time."""
+
+    def __iter__(self):
+        return self._mapping._entries()
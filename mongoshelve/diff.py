@@ -0,0 +1,90 @@
+from typing import Any
+
+_OPERATORS = ("$set", "$unset", "$push")
+
+
+def diff_update(old: Any, new: Any, path: str) -> dict:
+    """Builds the update that turns the value `old` stored at the dotted path `path` into `new`, by only writing the leaves that changed: `$set`/`$unset` for changed or removed dict entries, positional `$set`s for changed list elements, and a `$push` if a list was only appended to. Both values must be in the form they are stored in (ie with escaped keys). Untouched fields are left alone, so they stay free for concurrent writers, and only the delta is sent.
+
+    If `old` and `new` are both dicts, their entries are compared, but `path` itself is never replaced, so entries of `old` that are missing from `new` are unset rather than the whole dict being rewritten.
+
+    Args:
+        old (Any): Value currently stored at `path`.
+        new (Any): Value that should be stored at `path`.
+        path (str): Dotted path of the value within the document.
+
+    Returns:
+        dict: Update document, empty if `old` and `new` are equal.
+    """
+    operations = {operator: {} for operator in _OPERATORS}
+    if isinstance(old, dict) and isinstance(new, dict):
+        _diff_fields(old, new, path, operations)
+    else:
+        _diff(old, new, path, operations)
+    return {operator: fields for operator, fields in operations.items() if fields}
+
+
+def _same(a: Any, b: Any) -> bool:
+    """Equality of leaves as stored in BSON, where ie 1, 1.0 and True are different values."""
+    return type(a) is type(b) and a == b
+
+
+def _merge(operations: dict, nested: dict):
+    for operator, fields in nested.items():
+        operations[operator].update(fields)
+
+
+def _diff(old: Any, new: Any, path: str, operations: dict) -> bool:
+    """Adds the operations that turn `old` into `new` at `path`, and returns whether they were equal already (in which case nothing is added)."""
+    if isinstance(old, dict) and isinstance(new, dict):
+        nested = {operator: {} for operator in _OPERATORS}
+        unchanged = _diff_fields(old, new, path, nested)
+        if unchanged == len(old) == len(new):
+            return True
+        if unchanged == 0:
+            # nothing is kept, so rewriting the dict is smaller than listing every field
+            operations["$set"][path] = new
+        else:
+            _merge(operations, nested)
+        return False
+
+    if isinstance(old, list) and isinstance(new, list):
+        return _diff_list(old, new, path, operations)
+
+    if _same(old, new):
+        return True
+    operations["$set"][path] = new
+    return False
+
+
+def _diff_fields(old: dict, new: dict, path: str, operations: dict) -> int:
+    """Adds the operations for the entries of two dicts, and returns the number of entries that are unchanged."""
+    unchanged = 0
+    for key, val in new.items():
+        field = f"{path}.{key}"
+        if key not in old:
+            operations["$set"][field] = val
+        elif _diff(old[key], val, field, operations):
+            unchanged += 1
+    for key in old:
+        if key not in new:
+            operations["$unset"][f"{path}.{key}"] = ""
+    return unchanged
+
+
+def _diff_list(old: list, new: list, path: str, operations: dict) -> bool:
+    common = min(len(old), len(new))
+    nested = {operator: {} for operator in _OPERATORS}
+    unchanged = sum(_diff(old[i], new[i], f"{path}.{i}", nested) for i in range(common))
+    if unchanged == common:
+        if len(old) == len(new):
+            return True
+        if len(new) > len(old):
+            operations["$push"][path] = {"$each": new[common:]}
+            return False
+    elif len(old) == len(new) and unchanged > 0:
+        _merge(operations, nested)
+        return False
+    # elements were removed, or everything changed
+    operations["$set"][path] = new
+    return False
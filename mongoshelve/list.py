@@ -1,29 +1,80 @@
-from typing import Any, Union
+import copy
+import os
+from typing import Any, Optional, Union
 from pymongo.collection import Collection
+from pymongo.read_preferences import _ServerMode
+from .base import MongoShelf, bson_equal
+from .codecs import Codec
+from .mirror import ShelfMirror
+from .stats import recorded
+from .utils import get_path
 
 UUID4_PLACEHOLDER = "be8b61ee-48b1-4624-bf7a-2ca31f7c5ef4"
+MAX_ARRAY_LENGTH = 2**31 - 1  # upper bound for the `n` argument of $slice
 
 
-class MongoList:
-    """Class that emulates a list, but stores the list in the device database. Useful for working with Device attributes that are lists, so values persist across alabos sessions. This should be instantiated using `alab_management.device_view.device.BaseDevice.list_in_database`"""
+@recorded
+class MongoList(MongoShelf):
+    """Class that emulates a list, but stores the list in the device database. Useful for working with Device attributes that are lists, so values persist across alabos sessions. This should be instantiated using `alab_management.device_view.device.BaseDevice.list_in_database`
+
+    With `layout="chunked"`, a `ChunkedMongoList` is created instead, which splits the list over multiple documents.
+    """
+
+    def __new__(cls, *args, layout: str = "document", **kwargs):
+        if layout == "chunked":
+            from .chunked import ChunkedMongoList
+
+            return ChunkedMongoList(*args, **kwargs)
+        return super().__new__(cls)
 
     def __init__(
         self,
         collection: Collection,
         name: str,
         default_value: Union[list, None] = None,
+        cache: bool = False,
+        cache_ttl: Optional[float] = None,
+        write_behind: bool = False,
+        flush_interval: float = 0.2,
+        max_pending: int = 1000,
+        codec: Optional[Codec] = None,
+        page_size: int = 1000,
+        read_preference: Optional[_ServerMode] = None,
+        mirror: Union[str, os.PathLike, ShelfMirror, None] = None,
+        mirror_fallback: bool = False,
         _projection: str = "contents",
+        _apply_default: bool = True,
+        _parent=None,
+        _filter: Optional[dict] = None,
+        layout: str = "document",
     ):
-        self._collection = collection
-        self._projection = _projection
-        self.name = name
+        if layout != "document":
+            raise ValueError(f"Unknown layout {layout} for MongoList!")
+        super().__init__(
+            collection=collection,
+            name=name,
+            cache=cache,
+            cache_ttl=cache_ttl,
+            write_behind=write_behind,
+            flush_interval=flush_interval,
+            max_pending=max_pending,
+            codec=codec,
+            page_size=page_size,
+            read_preference=read_preference,
+            mirror=mirror,
+            mirror_fallback=mirror_fallback,
+            _projection=_projection,
+            _parent=_parent,
+            _filter=_filter,
+        )
         self.default_value = default_value or []
 
         if not any([isinstance(self.default_value, x) for x in [list, tuple]]):
             raise ValueError("ListInDatabase must be initialized with a list or tuple!")
         for val in self.default_value:
-            self._raise_if_invalid_value(val)
-        self.apply_default_value(overwrite=False)
+            self._check_value(val)
+        if _apply_default:
+            self.apply_default_value(overwrite=False)
 
     @classmethod
     def _raise_if_invalid_value(cls, val: Any):
@@ -40,107 +91,262 @@ class MongoList:
                 "Nested iterables are not supported for a ListInDatabase. Elements within a ListInDatabase must be single values (ie not a dict, list, or tuple). Note that this affects lists nested within DictInDatabase as well!"
             )
 
-    def apply_default_value(self, overwrite=False):
-        """This is called within `alab_management.scripts.setup_lab()` to ensure that all devices have the correct default values for their attributes. This should not be called manually.
-
-        Raises:
-            ValueError: Device is not found in the database. This should only occur if this function is called out of order (i.e. before the device is created in the db).
-        """
-        result = self._collection.find_one(self.db_filter)
-        if result is None:
-            self._collection.insert_one({"name": self.name, "contents": {}})
-        else:
-            if not overwrite:
-                return
+    def _encode_all(self, value: list) -> list:
+        return [self._encode(val) for val in value]
 
-        self._collection.update_one(
-            self.db_filter, {"$set": {self.db_projection: self.default_value}}
-        )
+    def _decode_all(self, value: list) -> list:
+        return [self._decode(val) for val in value]
 
     @property
-    def db_projection(self):
-        return self._projection
+    def _array(self) -> str:
+        """Aggregation field path to the list, for use in pipeline updates."""
+        return f"${self.db_projection}"
 
-    @property
-    def db_filter(self):
-        return {"name": self.name}
+    def _index_exists(self, i: int) -> dict:
+        """Filter that only matches if index `i` (which may be negative) is within the bounds of the list."""
+        position = i if i >= 0 else -i - 1
+        return {f"{self.db_projection}.{position}": {"$exists": True}}
+
+    def _splice(self, index: Any, delete_count: int, values: list) -> dict:
+        """Builds an aggregation expression equivalent to `list[index:index + delete_count] = values`, which lets a pipeline update edit the middle of the list in a single atomic round trip.
+
+        Args:
+            index (Any): Non-negative position or an aggregation expression resolving to one.
+            delete_count (int): Number of elements to remove, starting from `index`.
+            values (list): Elements to insert at `index`.
+        """
+        return {
+            "$concatArrays": [
+                {"$slice": [self._array, index]},
+                {"$literal": list(values)},
+                {
+                    "$slice": [
+                        self._array,
+                        {"$add": [index, delete_count]},
+                        MAX_ARRAY_LENGTH,
+                    ]
+                },
+            ]
+        }
+
+    def _resolve_index(self, i: int) -> Any:
+        """Converts a python index into a non-negative position, resolving negative indices against the length of the list on the server."""
+        if i >= 0:
+            return i
+        return {"$add": [{"$size": self._array}, i]}
+
+    @staticmethod
+    def _slice_projection(x: slice) -> Union[int, list, None]:
+        """Translates a python slice into the argument of a $slice projection.
+
+        Returns:
+            Union[int, list, None]: Argument for $slice, 0 if the slice is known to be empty, or None if the slice cannot be expressed without knowing the length of the list.
+        """
+        if x.step not in (None, 1):
+            return None
+        start = x.start or 0
+        if start < 0:
+            return start if x.stop is None else None
+        if x.stop is None:
+            return [start, MAX_ARRAY_LENGTH]
+        if x.stop < 0:
+            return None
+        if x.stop <= start:
+            return 0
+        return [start, x.stop - start]
 
     @property
     def _value(self):
-        value = self._collection.find_one(
-            {"name": self.name}, projection=[self.db_projection]
-        )
-        if value is None:
-            raise ValueError(
-                f"Entry {self.name} does not contain data at {self.db_projection}!"
-            )
-        return_value = value
-        for key in self.db_projection.split("."):
-            return_value = return_value[key]
-
-        return return_value
+        return self._read()
 
     def append(self, x):
-        self._raise_if_invalid_value(x)
-        self._collection.update_one(self.db_filter, {"$push": {self.db_projection: x}})
+        self._check_value(x)
+        self._write(
+            {"$push": {self.db_projection: self._encode(x)}},
+            apply=lambda value: value.append(self._normalize(x)),
+        )
 
     def extend(self, x):
-        for val in x:
-            self._raise_if_invalid_value(val)
-        current = self._value
-        current.extend(x)
-        self._collection.update_one(
-            self.db_filter, {"$set": {self.db_projection: current}}
+        values = list(x)
+        for val in values:
+            self._check_value(val)
+        if len(values) == 0:
+            return
+        self._write(
+            {"$push": {self.db_projection: {"$each": self._encode_all(values)}}},
+            apply=lambda value: value.extend(self._normalize(val) for val in values),
         )
 
     def clear(self):
-        self._collection.update_one(self.db_filter, {"$set": {self.db_projection: []}})
+        self._write(
+            {"$set": {self.db_projection: []}}, apply=lambda value: value.clear()
+        )
 
     def copy(self):
         return self._value  # copied by virtue of reading from database
 
-    def index(self, x, start=0, stop=-1):
-        return self._value.index(x, start, stop)
+    def index(self, x, start=0, stop=None):
+        """Returns the position of the first occurrence of `x` within `[start:stop]`. This is located with $indexOfArray, so only the position is transferred.
+
+        Raises:
+            ValueError: `x` is not in the list.
+        """
+        cached = self._cached_value()
+        if cached is not None:
+            for i in range(*slice(start, stop).indices(len(cached))):
+                if bson_equal(cached[i], x):
+                    return i
+            raise ValueError(f"{x} is not in list")
+
+        i = self._evaluate(self._index_expression(x, start, stop))
+        if i is None or i < 0:
+            raise ValueError(f"{x} is not in list")
+        return i
 
     def count(self, x):
-        return self._value.count(x)
+        """Returns the number of occurrences of `x`, counted by MongoDB."""
+        cached = self._cached_value()
+        if cached is not None:
+            return sum(1 for val in cached if bson_equal(val, x))
+        return self._evaluate(self._count_expression(x))
+
+    def _index_expression(self, x: Any, start: int = 0, stop: Optional[int] = None):
+        """Aggregation expression equivalent to `list.index(x, start, stop)`, that resolves to -1 if `x` is not found."""
+        arguments = [self._array, {"$literal": self._encode(x)}, self._position(start)]
+        if stop is not None:
+            arguments.append(self._position(stop))
+        return {"$indexOfArray": arguments}
+
+    def _count_expression(self, x: Any) -> dict:
+        """Aggregation expression equivalent to `list.count(x)`."""
+        return {
+            "$size": {
+                "$filter": {
+                    "input": self._array,
+                    "cond": {"$eq": ["$$this", {"$literal": self._encode(x)}]},
+                }
+            }
+        }
+
+    def _contains_filter(self, x: Any) -> dict:
+        """Filter that only matches if the list contains `x`. $elemMatch ensures that a list `x` is not compared to the whole array."""
+        return {self.db_projection: {"$elemMatch": {"$eq": self._encode(x)}}}
+
+    def _position(self, i: int) -> Any:
+        """Like `_resolve_index`, but clamps negative indices to the start of the list like slicing does."""
+        if i >= 0:
+            return i
+        return {"$max": [0, {"$add": [{"$size": self._array}, i]}]}
 
     def insert(self, i, x):
-        self._raise_if_invalid_value(x)
-        current = self._value
-        current.insert(i, x)
-        self._collection.update_one(
-            self.db_filter, {"$set": {self.db_projection: current}}
+        self._check_value(x)
+        # $position follows the same conventions as list.insert for negative and out of range indices
+        self._write(
+            {
+                "$push": {
+                    self.db_projection: {"$each": [self._encode(x)], "$position": i}
+                }
+            },
+            apply=lambda value: value.insert(i, self._normalize(x)),
         )
 
     def pop(self, i=-1):
-        current = self._value
-        result = current.pop(i)
-        self._collection.update_one(
-            self.db_filter, {"$set": {self.db_projection: current}}
+        if i == -1:
+            update = {"$pop": {self.db_projection: 1}}
+        elif i == 0:
+            update = {"$pop": {self.db_projection: -1}}
+        else:
+            update = [
+                {
+                    "$set": {
+                        self.db_projection: self._splice(self._resolve_index(i), 1, [])
+                    }
+                }
+            ]
+        before = self._write(
+            update,
+            condition=self._index_exists(i),
+            fetch={self.db_projection: {"$slice": [i, 1]}},
+            apply=lambda value: value.pop(i),
         )
-        return result
+        if before is None:
+            raise IndexError("pop index out of range")
+        return self._decode(get_path(before, self.db_projection)[0])
 
     def remove(self, x):
-        current = self._value
-        current.remove(x)
-        self._collection.update_one(
-            self.db_filter, {"$set": {self.db_projection: current}}
+        """Removes the first occurrence of `x`. $pull would remove every occurrence, so the first match is located with $indexOfArray and cut out within a pipeline update instead."""
+        encoded = self._encode(x)
+        matched = self._write(
+            [
+                {
+                    "$set": {
+                        self.db_projection: {
+                            "$let": {
+                                "vars": {
+                                    "i": {
+                                        "$indexOfArray": [
+                                            self._array,
+                                            {"$literal": encoded},
+                                        ]
+                                    }
+                                },
+                                "in": {
+                                    "$cond": [
+                                        {"$eq": ["$$i", -1]},
+                                        self._array,
+                                        self._splice("$$i", 1, []),
+                                    ]
+                                },
+                            }
+                        }
+                    }
+                }
+            ],
+            condition={self.db_projection: encoded},
+            apply=lambda value: value.pop(self._first_index(value, x)),
         )
+        if not matched:
+            raise ValueError("list.remove(x): x not in list")
+
+    @staticmethod
+    def _first_index(value: list, x: Any) -> int:
+        """Index of the first element of `value` that MongoDB considers equal to `x`."""
+        for i, val in enumerate(value):
+            if bson_equal(val, x):
+                return i
+        raise ValueError("list.remove(x): x not in list")
 
     def reverse(self):
-        current = self._value
-        current.reverse()
-        self._collection.update_one(
-            self.db_filter, {"$set": {self.db_projection: current}}
+        self._write(
+            [{"$set": {self.db_projection: {"$reverseArray": self._array}}}],
+            apply=lambda value: value.reverse(),
         )
 
     def sort(self, key=None, reverse=False):
-        current = self._value
-        current.sort(key, reverse)
-        self._collection.update_one(
-            self.db_filter, {"$set": {self.db_projection: current}}
-        )
+        if key is None and self.codec is None:
+            # MongoDB orders values of different types differently than python, so the cache is refreshed rather than sorted locally
+            self._write(
+                {
+                    "$push": {
+                        self.db_projection: {"$each": [], "$sort": -1 if reverse else 1}
+                    }
+                }
+            )
+            return
+
+        # arbitrary key functions (and values encoded by a codec) cannot be compared by MongoDB, so these are sorted locally
+        def modify(current):
+            current.sort(key=key, reverse=reverse)
+            return (
+                {"$set": {self.db_projection: self._encode_all(current)}},
+                lambda value: value.sort(key=key, reverse=reverse),
+                None,
+            )
+
+        self._compare_and_swap(modify)
+
+    def __reversed__(self):
+        return reversed(self._value)
 
     def __repr__(self):
         return str(self._value)
@@ -149,43 +355,132 @@ class MongoList:
         return str(self._value)
 
     def __add__(self, x):
-        self._raise_if_invalid_value(x)
+        for val in x:
+            self._check_value(val)
         return self._value + x
 
     def __iadd__(self, x):
-        self._raise_if_invalid_value(x)
-        new = self._value + x
-        self._collection.update_one(self.db_filter, {"$set": {self.db_projection: new}})
+        self.extend(x)
         return self
 
     def __mul__(self, x):
         return self._value * x
 
     def __imul__(self, x):
-        new = self._value * x
-        self._collection.update_one(self.db_filter, {"$set": {self.db_projection: new}})
+        if x > 0:
+            new = {"$concatArrays": [self._array] * x}
+        else:
+            new = {"$literal": []}
+        self._write(
+            [{"$set": {self.db_projection: new}}],
+            apply=lambda value: value.__imul__(x),
+        )
         return self
 
-    def __getitem__(self, x):
-        return self._value[x]
+    def __iter__(self):
+        """Streams the elements `page_size` at a time with $slice projections, rather than reading the whole list (or one element per query)."""
+        cached = self._cached_value()
+        if cached is not None:
+            for val in list(cached):
+                yield copy.deepcopy(val)
+            return
+
+        offset = 0
+        while True:
+            page = self[offset : offset + self.page_size]
+            yield from page
+            if len(page) < self.page_size:
+                return
+            offset += self.page_size
 
-    def __setitem__(self, x, val):
-        self._raise_if_invalid_value(val)
-        current = self._value
-        current[x] = val
-        if any(isinstance(val, t) for t in [dict, list, tuple]):
-            raise TypeError(
-                "Elements within a ListInDatabase cannot be iterable. Spefically, values of the ListInDatabase cannot be a dict, list, or tuple!"
+    def __getitem__(self, x):
+        cached = self._cached_value()
+        if cached is not None:
+            return copy.deepcopy(cached[x])
+
+        if isinstance(x, slice):
+            projection = self._slice_projection(x)
+            if projection is None:
+                return self._value[x]
+            if projection == 0:
+                return []
+            value = self._reader.find_one(
+                self.db_filter,
+                projection={
+                    "_id": 0,
+                    "name": 1,
+                    self.db_projection: {"$slice": projection},
+                },
             )
-        self._collection.update_one(
-            self.db_filter, {"$set": {self.db_projection: current}}
+            if value is None:
+                raise ValueError(
+                    f"Entry {self.name} does not contain data at {self.db_projection}!"
+                )
+            return self._decode_all(get_path(value, self.db_projection))
+
+        value = self._reader.find_one(
+            {**self.db_filter, **self._index_exists(x)},
+            projection={"_id": 0, "name": 1, self.db_projection: {"$slice": [x, 1]}},
         )
+        if value is None:
+            raise IndexError("list index out of range")
+        return self._decode(get_path(value, self.db_projection)[0])
+
+    def __setitem__(self, x, val):
+        if isinstance(x, slice):
+            val = list(val)
+            for _val in val:
+                self._check_value(_val)
+
+            def modify(current):
+                current[x] = val
+                return (
+                    {"$set": {self.db_projection: self._encode_all(current)}},
+                    lambda value: value.__setitem__(
+                        x, self._decode_all(self._encode_all(val))
+                    ),
+                    None,
+                )
+
+            self._compare_and_swap(modify)
+            return
+
+        self._check_value(val)
+        if x >= 0:
+            update = {"$set": {f"{self.db_projection}.{x}": self._encode(val)}}
+        else:
+            update = [
+                {
+                    "$set": {
+                        self.db_projection: self._splice(
+                            self._resolve_index(x), 1, [self._encode(val)]
+                        )
+                    }
+                }
+            ]
+        if not self._write(
+            update,
+            condition=self._index_exists(x),
+            apply=lambda value: value.__setitem__(x, self._normalize(val)),
+        ):
+            raise IndexError("list assignment index out of range")
 
     def __len__(self):
-        return len(self._value)
+        cached = self._cached_value()
+        if cached is not None:
+            return len(cached)
+
+        return self._evaluate({"$size": self._array})
 
     def __contains__(self, x):
-        return x in self._value
+        cached = self._cached_value()
+        if cached is not None:
+            return any(bson_equal(val, x) for val in cached)
+
+        document = self._reader.find_one(
+            {**self.db_filter, **self._contains_filter(x)}, projection={"_id": 1}
+        )
+        return document is not None
 
     def __eq__(self, x):
         return self._value == x
@@ -0,0 +1,92 @@
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import weakref
+from typing import Any, Dict, Optional, Tuple, Union
+import bson
+
+logger = logging.getLogger(__name__)
+
+_mirrors: Dict[str, "ShelfMirror"] = {}
+_mirrors_lock = threading.Lock()
+
+
+class ShelfMirror:
+    """Local SQLite file that keeps a copy of the contents of MongoDict/MongoList containers, stamped with the version of the document they were read at. A container opened with `mirror=<path>` starts out with its cache loaded from the file, so the first read only checks the version with a tiny query, and the contents are only downloaded if another process has changed them since. This should be opened using `open_mirror`, so that all containers mirrored to the same file share a connection.
+
+    Contents are saved in the form they are stored in MongoDB (as BSON) whenever they are downloaded, and when a container is closed or the interpreter exits, so that local writes are kept as well.
+    """
+
+    def __init__(self, path: Union[str, os.PathLike]):
+        self.path = os.fspath(path)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS shelves ("
+                "collection TEXT, name TEXT, projection TEXT, version INTEGER, value BLOB,"
+                " PRIMARY KEY (collection, name, projection))"
+            )
+        # by id, as containers are not hashable
+        self._shelves = weakref.WeakValueDictionary()
+        atexit.register(self.save_all)
+
+    def load(
+        self, collection: str, name: str, projection: str
+    ) -> Optional[Tuple[Any, int]]:
+        """Returns the stored form of a container's contents and the version they were saved at, or None if it has not been mirrored yet."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, version FROM shelves"
+                " WHERE collection = ? AND name = ? AND projection = ?",
+                (collection, name, projection),
+            ).fetchone()
+        if row is None:
+            return None
+        return bson.decode(row[0])["value"], row[1]
+
+    def save(
+        self, collection: str, name: str, projection: str, value: Any, version: int
+    ):
+        """Saves the stored form of a container's contents, unless a later version has already been saved (ie by another process sharing the file)."""
+        data = bson.encode({"value": value})
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO shelves VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT (collection, name, projection) DO UPDATE"
+                " SET version = excluded.version, value = excluded.value"
+                " WHERE excluded.version >= shelves.version",
+                (collection, name, projection, version, data),
+            )
+
+    def track(self, shelf):
+        """Saves the contents of `shelf` at interpreter exit, see `save_all`."""
+        self._shelves[id(shelf)] = shelf
+
+    def save_all(self):
+        """Saves the cached contents of every container that is mirrored to this file."""
+        for shelf in list(self._shelves.values()):
+            try:
+                shelf._save_mirror()
+            except Exception:
+                logger.exception(f"Failed to save the mirror of {shelf.name}.")
+
+    def close(self):
+        """Saves the mirrored containers and closes the file."""
+        self.save_all()
+        atexit.unregister(self.save_all)
+        with self._lock:
+            self._connection.close()
+
+
+def open_mirror(path: Union[str, os.PathLike, ShelfMirror]) -> ShelfMirror:
+    """Returns the mirror stored in the file at `path`, creating it if needed. Mirrors are shared by path within a process."""
+    if isinstance(path, ShelfMirror):
+        return path
+    key = os.path.abspath(os.fspath(path))
+    with _mirrors_lock:
+        if key not in _mirrors:
+            _mirrors[key] = ShelfMirror(key)
+        return _mirrors[key]
@@ -0,0 +1,368 @@
+import collections.abc
+from typing import Any, Iterator, Optional, Tuple, Union
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.collection import Collection
+from pymongo.read_preferences import _ServerMode
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from .base import (
+    MongoShelf,
+    _ensure_index_once,
+    _ensure_key_index,
+    _read_collection,
+)
+from .dict import MongoDict, UUID4_PLACEHOLDER, _ItemsView, _ValuesView
+from .list import MongoList
+from .codecs import Codec
+from .stats import recorded
+from .utils import VERSION_FIELD, decode_keys, encode_keys, escape_key
+
+LAYOUT = "per_key"
+
+
+@recorded
+class PerKeyMongoDict:
+    """Dict that stores each of its keys as a separate document `{shelf: <name>, key: <key>, value: <value>}`, instead of storing the whole dict within a single document like MongoDict. This lifts the 16 MB document size limit, and reading, writing, deleting or checking a key is a single indexed operation whose cost does not depend on the size of the dict. This should be created using `MongoDict(..., layout="per_key")`.
+
+    A small header document `{name: <name>, layout: "per_key"}` marks the name as taken. Keys are iterated in sorted order (rather than insertion order), which is the order of the index they are looked up by, so `popitem` removes the largest key. Caching, watching and write-behind are not supported in this layout.
+    """
+
+    def __init__(
+        self,
+        collection: Collection,
+        name: str,
+        default_value: Union[dict, None] = None,
+        codec: Optional[Codec] = None,
+        page_size: int = 1000,
+        read_preference: Optional[_ServerMode] = None,
+        layout: str = LAYOUT,
+    ):
+        if layout != LAYOUT:
+            raise ValueError(f"PerKeyMongoDict cannot use the {layout} layout!")
+        self._collection = collection
+        self.read_preference = read_preference
+        self._reader = _read_collection(collection, read_preference)
+        self.name = name
+        self.codec = codec
+        self.page_size = page_size  # keys fetched per round trip while iterating
+        if default_value is None:
+            self.default_value = {}
+        else:
+            if not isinstance(default_value, dict):
+                raise ValueError(
+                    "Default value for DictInDatabase must be a dictionary!"
+                )
+            self.default_value = default_value
+        for val in self.default_value.values():
+            self._check_value(val)
+        _ensure_index_once(collection, _ensure_key_index)
+        self.apply_default_value(overwrite=False)
+
+    @property
+    def db_filter(self) -> dict:
+        """Filter matching the documents of all keys."""
+        return {"shelf": self.name}
+
+    def _encode(self, value: Any) -> Any:
+        if self.codec is not None:
+            return self.codec.encode(value)
+        return encode_keys(value)
+
+    def _decode(self, value: Any) -> Any:
+        if self.codec is not None:
+            return self.codec.decode(value)
+        return decode_keys(value)
+
+    def _check_value(self, val: Any):
+        if self.codec is None:
+            MongoDict._raise_if_invalid_value(val)
+
+    def _key_filter(self, key: str) -> dict:
+        escape_key(key)  # only string keys are supported, like MongoDict
+        return {"shelf": self.name, "key": key}
+
+    def apply_default_value(self, overwrite: bool = False):
+        """Writes `default_value` to the database. If the dict does not exist yet it is created, otherwise the stored keys are only replaced if `overwrite` is True.
+
+        Args:
+            overwrite (bool, optional): Replace the stored keys if the dict already exists. Defaults to False.
+
+        Raises:
+            ValueError: `name` is already used by a container with a different layout.
+        """
+        try:
+            header = self._collection.find_one_and_update(
+                {"name": self.name},
+                {"$setOnInsert": {"layout": LAYOUT}},
+                projection={"_id": 0, "layout": 1},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE,
+            )
+        except DuplicateKeyError:
+            header = self._collection.find_one(
+                {"name": self.name}, projection={"_id": 0, "layout": 1}
+            )
+        if header is not None and header.get("layout") != LAYOUT:
+            raise ValueError(f"{self.name} is not stored with the {LAYOUT} layout!")
+        if header is not None and not overwrite:
+            return
+        if overwrite:
+            self._collection.delete_many(self.db_filter)
+        self._set_many(self.default_value, overwrite=overwrite)
+
+    def _set_many(self, values: dict, overwrite: bool = True):
+        """Writes several keys with a single unordered `bulk_write`. Keys that already exist are left unchanged if `overwrite` is False."""
+        if len(values) == 0:
+            return
+        operator = "$set" if overwrite else "$setOnInsert"
+        operations = [
+            UpdateOne(
+                self._key_filter(key),
+                {operator: {"value": self._encode(val)}, "$inc": {VERSION_FIELD: 1}},
+                upsert=True,
+            )
+            for key, val in values.items()
+        ]
+        try:
+            self._collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if len(errors) == 0 or any(error["code"] != 11000 for error in errors):
+                raise
+            # another process inserted the same keys concurrently (see __setitem__), so they exist now
+            self._collection.bulk_write(
+                [operations[error["index"]] for error in errors], ordered=False
+            )
+
+    def _wrap(self, key, val):
+        """Nested dicts and lists are returned as MongoDict/MongoList objects pointing to the `value` of the key's document, so that modifying them modifies the database. Values stored by a codec are returned as they are."""
+        if self.codec is not None:
+            return val
+        if isinstance(val, dict):
+            return MongoDict(
+                collection=self._collection,
+                name=self.name,
+                default_value=val,
+                read_preference=self.read_preference,
+                _projection="value",
+                _apply_default=False,
+                _filter=self._key_filter(key),
+            )
+        if isinstance(val, list):
+            return MongoList(
+                collection=self._collection,
+                name=self.name,
+                default_value=val,
+                read_preference=self.read_preference,
+                _projection="value",
+                _apply_default=False,
+                _filter=self._key_filter(key),
+            )
+        return val
+
+    def _documents(self, reverse: bool = False, **projection) -> Iterator[dict]:
+        """Streams the documents of all keys in key order."""
+        return self._reader.find(
+            self.db_filter,
+            projection={"_id": 0, "key": 1, **projection},
+            sort=[("key", -1 if reverse else 1)],
+            batch_size=self.page_size,
+        )
+
+    def _entries(self, values: bool = True) -> Iterator[Tuple[str, Any]]:
+        """Streams the (key, value) pairs in key order, `page_size` keys at a time. If `values` is False, only the keys are fetched (and the values are None)."""
+        for document in self._documents(**({"value": 1} if values else {})):
+            key = document["key"]
+            yield key, (
+                self._wrap(key, self._decode(document["value"])) if values else None
+            )
+
+    def as_normal_dict(self) -> dict:
+        return {
+            document["key"]: self._decode(document["value"])
+            for document in self._documents(value=1)
+        }
+
+    def clear(self):
+        self._collection.delete_many(self.db_filter)
+
+    def copy(self):
+        return self.as_normal_dict()
+
+    def fromkeys(self):
+        raise NotImplementedError("fromkeys is not implemented for DictInDatabase")
+
+    def get(self, key, default=None):
+        if not isinstance(key, str):
+            return default  # only string keys can be stored
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def items(self):
+        return _ItemsView(self)
+
+    def keys(self):
+        return collections.abc.KeysView(self)
+
+    def values(self):
+        return _ValuesView(self)
+
+    def find(self, predicate: Any) -> dict:
+        """Returns the entries whose value matches `predicate`, see `MongoDict.find`. This is a single query on the documents of the keys."""
+        query = MongoDict._value_query(self, "value", predicate)
+        return {
+            document["key"]: self._wrap(
+                document["key"], self._decode(document["value"])
+            )
+            for document in self._reader.find(
+                {**self.db_filter, **query},
+                projection={"_id": 0, "key": 1, "value": 1},
+                sort=[("key", 1)],
+            )
+        }
+
+    def select(self, keys) -> dict:
+        """Returns the entries for `keys`, reading only those keys. Keys that do not exist are left out."""
+        keys = [key for key in keys if isinstance(key, str)]
+        found = {
+            document["key"]: self._decode(document["value"])
+            for document in self._reader.find(
+                {**self.db_filter, "key": {"$in": keys}},
+                projection={"_id": 0, "key": 1, "value": 1},
+            )
+        }
+        return {key: self._wrap(key, found[key]) for key in keys if key in found}
+
+    def pop(self, key, default=UUID4_PLACEHOLDER):
+        if not isinstance(key, str):
+            # only string keys can be stored
+            if default == UUID4_PLACEHOLDER:
+                raise KeyError(f"{key} was not found in the dictionary!")
+            return default
+        document = self._collection.find_one_and_delete(
+            self._key_filter(key), projection={"_id": 0, "value": 1}
+        )
+        if document is None:
+            if default == UUID4_PLACEHOLDER:
+                raise KeyError(f"{key} was not found in the dictionary!")
+            return default
+        return self._decode(document["value"])
+
+    def popitem(self):
+        """Removes and returns the (key, value) pair with the largest key."""
+        document = self._collection.find_one_and_delete(
+            self.db_filter,
+            projection={"_id": 0, "key": 1, "value": 1},
+            sort=[("key", -1)],
+        )
+        if document is None:
+            raise KeyError("popitem(): dictionary is empty")
+        return document["key"], self._decode(document["value"])
+
+    def setdefault(self, key, default=None):
+        self._check_value(default)
+        document = self._collection.find_one_and_update(
+            self._key_filter(key),
+            {"$setOnInsert": {"value": self._encode(default), VERSION_FIELD: 1}},
+            projection={"_id": 0, "value": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return self._wrap(key, self._decode(document["value"]))
+
+    def update(self, *args, **kwargs):
+        new = dict(*args, **kwargs)
+        for key, val in new.items():
+            escape_key(key)
+            self._check_value(val)
+        self._set_many(new)
+
+    def _update_field(self, operator: str, key: str, operand: Any) -> Any:
+        """Applies a field update operator to the value of `key` with a single atomic upsert, see `MongoDict._update_field`."""
+        if self.codec is not None:
+            raise ValueError(
+                f"{operator} cannot be applied to values stored by a codec!"
+            )
+        self._check_value(operand)
+        update = MongoShelf._versioned({operator: {"value": operand}})
+        kwargs = dict(
+            projection={"_id": 0, "value": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        try:
+            document = self._collection.find_one_and_update(
+                self._key_filter(key), update, **kwargs
+            )
+        except DuplicateKeyError:
+            # see __setitem__
+            document = self._collection.find_one_and_update(
+                self._key_filter(key), update, **kwargs
+            )
+        return self._decode(document["value"])
+
+    def incr(self, key: str, n: Union[int, float] = 1) -> Union[int, float]:
+        """See `MongoDict.incr`."""
+        return self._update_field("$inc", key, n)
+
+    def mul(self, key: str, factor: Union[int, float]) -> Union[int, float]:
+        """See `MongoDict.mul`."""
+        return self._update_field("$mul", key, factor)
+
+    def set_max(self, key: str, value: Any) -> Any:
+        """See `MongoDict.set_max`."""
+        return self._update_field("$max", key, value)
+
+    def set_min(self, key: str, value: Any) -> Any:
+        """See `MongoDict.set_min`."""
+        return self._update_field("$min", key, value)
+
+    def __reversed__(self):
+        return (document["key"] for document in self._documents(reverse=True))
+
+    def __iter__(self):
+        return (key for key, _ in self._entries(values=False))
+
+    def __repr__(self):
+        return str(self.as_normal_dict())
+
+    def __str__(self):
+        return str(self.as_normal_dict())
+
+    def __getitem__(self, x):
+        if not isinstance(x, str):
+            raise KeyError(x)
+        document = self._reader.find_one(
+            self._key_filter(x), projection={"_id": 0, "value": 1}
+        )
+        if document is None:
+            raise KeyError(x)
+        return self._wrap(x, self._decode(document["value"]))
+
+    def __setitem__(self, x, val):
+        self._check_value(val)
+        update = {"$set": {"value": self._encode(val)}, "$inc": {VERSION_FIELD: 1}}
+        try:
+            self._collection.update_one(self._key_filter(x), update, upsert=True)
+        except DuplicateKeyError:
+            # another process inserted the same key concurrently, so it exists now
+            self._collection.update_one(self._key_filter(x), update, upsert=True)
+
+    def __delitem__(self, x):
+        if not isinstance(x, str):
+            raise KeyError(x)
+        if self._collection.delete_one(self._key_filter(x)).deleted_count == 0:
+            raise KeyError(x)
+
+    def __contains__(self, x):
+        if not isinstance(x, str):
+            return False
+        document = self._reader.find_one(self._key_filter(x), projection={"_id": 1})
+        return document is not None
+
+    def __len__(self):
+        return self._reader.count_documents(self.db_filter)
+
+    def __eq__(self, other):
+        return self.as_normal_dict() == other
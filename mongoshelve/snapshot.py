@@ -0,0 +1,47 @@
+import copy
+from typing import Any
+
+
+def _read_only(self, *args, **kwargs):
+    raise TypeError(f"{type(self).__name__} is a read-only snapshot")
+
+
+class FrozenDict(dict):
+    """Read-only dict returned by `snapshot()`. It is a plain in-memory dict (so it compares equal to dicts and can be serialized like one), but every method that would modify it raises a TypeError. Copies made with `dict(...)` or `copy.deepcopy` are ordinary, modifiable objects again."""
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return type(self), (dict(self),)
+
+    def __deepcopy__(self, memo):
+        return {key: copy.deepcopy(val, memo) for key, val in self.items()}
+
+    def __copy__(self):
+        return dict(self)
+
+
+class FrozenList(list):
+    """Read-only list returned by `snapshot()`, see `FrozenDict`."""
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = clear = extend = insert = pop = remove = reverse = sort = _read_only
+
+    def __reduce__(self):
+        return type(self), (list(self),)
+
+    def __deepcopy__(self, memo):
+        return [copy.deepcopy(val, memo) for val in self]
+
+    def __copy__(self):
+        return list(self)
+
+
+def freeze(value: Any) -> Any:
+    """Converts a value read from the database into a snapshot, by replacing its dicts and lists (at any depth) with FrozenDict/FrozenList objects. The value must not be used afterwards, as its nested values are reused."""
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(val)) for key, val in value.items())
+    if isinstance(value, list):
+        return FrozenList(freeze(val) for val in value)
+    return value
@@ -0,0 +1,292 @@
+import bisect
+import contextvars
+import functools
+import inspect
+import logging
+import threading
+import time
+import types
+from typing import Any, Callable, Dict, Optional, Tuple
+import bson
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# upper bounds (in seconds) of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+# private methods that are recorded, besides all public methods
+_RECORDED_PRIVATE = {
+    "__add__",
+    "__contains__",
+    "__delitem__",
+    "__eq__",
+    "__getitem__",
+    "__iadd__",
+    "__imul__",
+    "__iter__",
+    "__len__",
+    "__mul__",
+    "__repr__",
+    "__reversed__",
+    "__setitem__",
+    "__str__",
+    "_entries",  # iteration of the keys/values/items views of a dict
+}
+
+_enabled = False
+_registered = False
+_exporter: Optional[Callable[[dict], Any]] = None
+_lock = threading.Lock()
+_stats: Dict[Tuple[str, str], "_MethodStats"] = {}
+_in_flight: Dict[Tuple[Any, int], "_Operation"] = {}
+_current: contextvars.ContextVar[Optional["_Operation"]] = contextvars.ContextVar(
+    "mongoshelve_operation", default=None
+)
+
+
+class _MethodStats:
+    """Totals for one method of one shelf."""
+
+    __slots__ = (
+        "calls",
+        "errors",
+        "round_trips",
+        "bytes_sent",
+        "bytes_received",
+        "time",
+        "command_time",
+        "histogram",
+    )
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.round_trips = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.time = 0.0
+        self.command_time = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def as_dict(self) -> dict:
+        bounds = LATENCY_BUCKETS + (float("inf"),)
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "round_trips": self.round_trips,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "time": self.time,
+            "command_time": self.command_time,
+            "latency_histogram": dict(zip(bounds, self.histogram)),
+        }
+
+
+class _Operation:
+    """A call of a shelf method that is in progress. The commands sent while it is the current operation are attributed to it."""
+
+    __slots__ = ("key", "round_trips", "bytes_sent", "bytes_received")
+
+    def __init__(self, shelf: str, method: str):
+        self.key = (shelf, method)
+        self.round_trips = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def _totals(self) -> _MethodStats:
+        # must be called with _lock held
+        if self.key not in _stats:
+            _stats[self.key] = _MethodStats()
+        return _stats[self.key]
+
+    def finish(self, duration: float, error: bool):
+        with _lock:
+            totals = self._totals()
+            totals.calls += 1
+            totals.errors += error
+            totals.time += duration
+            totals.histogram[bisect.bisect_left(LATENCY_BUCKETS, duration)] += 1
+        if _exporter is not None:
+            try:
+                _exporter(
+                    {
+                        "shelf": self.key[0],
+                        "method": self.key[1],
+                        "duration": duration,
+                        "round_trips": self.round_trips,
+                        "bytes_sent": self.bytes_sent,
+                        "bytes_received": self.bytes_received,
+                        "error": error,
+                    }
+                )
+            except Exception:
+                logger.exception("Failed to export mongoshelve stats.")
+
+
+class _StatsListener(monitoring.CommandListener):
+    """Attributes the commands sent by pymongo to the shelf operation that is in progress on the calling thread (or task). Commands sent outside of a shelf operation are ignored."""
+
+    def started(self, event):
+        if not _enabled:
+            return
+        operation = _current.get()
+        if operation is None:
+            return
+        size = len(bson.encode(event.command))
+        with _lock:
+            key = (event.connection_id, event.request_id)
+            if key in _in_flight:
+                return  # the listener was registered twice
+            _in_flight[key] = operation
+            operation.round_trips += 1
+            operation.bytes_sent += size
+            totals = operation._totals()
+            totals.round_trips += 1
+            totals.bytes_sent += size
+
+    def _finished(self, event, reply: Optional[dict]):
+        with _lock:
+            operation = _in_flight.pop((event.connection_id, event.request_id), None)
+        if operation is None:
+            return
+        size = 0 if reply is None else len(bson.encode(reply))
+        with _lock:
+            operation.bytes_received += size
+            totals = operation._totals()
+            totals.bytes_received += size
+            totals.command_time += event.duration_micros / 1e6
+
+    def succeeded(self, event):
+        self._finished(event, event.reply)
+
+    def failed(self, event):
+        self._finished(event, None)
+
+
+STATS_LISTENER = _StatsListener()
+
+
+def enable_stats(exporter: Optional[Callable[[dict], Any]] = None):
+    """Starts recording, for every shelf and method, the number of calls, the database round trips and bytes they caused, and a latency histogram (see `stats`). Round trips are observed with pymongo command monitoring. `STATS_LISTENER` is registered for all MongoClients created after this is first called. Clients that already exist must be created with `event_listeners=[STATS_LISTENER]` to be observed. While disabled, recording costs a single flag check per call.
+
+    Args:
+        exporter (Optional[Callable[[dict], Any]], optional): Called after every recorded call with a dict of `shelf`, `method`, `duration` (seconds), `round_trips`, `bytes_sent`, `bytes_received` and `error`, ie to forward them to a metrics system. Exceptions it raises are logged and ignored. Defaults to None.
+    """
+    global _enabled, _registered, _exporter
+    if not _registered:
+        monitoring.register(STATS_LISTENER)
+        _registered = True
+    _exporter = exporter
+    _enabled = True
+
+
+def disable_stats():
+    """Stops recording. The numbers recorded so far are kept."""
+    global _enabled, _exporter
+    _enabled = False
+    _exporter = None
+
+
+def reset_stats():
+    """Discards the numbers recorded so far."""
+    with _lock:
+        _stats.clear()
+
+
+def stats() -> Dict[str, Dict[str, dict]]:
+    """Returns the numbers recorded since stats were enabled or last reset.
+
+    Returns:
+        Dict[str, Dict[str, dict]]: By shelf name and then method (ie `MongoDict.popitem`): `calls`, `errors`, `round_trips`, `bytes_sent`, `bytes_received`, `time` (total seconds spent in the method), `command_time` (total seconds reported by the server round trips) and `latency_histogram` (number of calls by the upper bound of their latency in seconds).
+    """
+    with _lock:
+        result = {}
+        for (shelf, method), totals in _stats.items():
+            result.setdefault(shelf, {})[method] = totals.as_dict()
+        return result
+
+
+class _RecordedIterator:
+    """Iterator returned by a recorded method, whose lazily sent commands are attributed to the method."""
+
+    def __init__(self, iterator, operation: _Operation):
+        self._iterator = iterator
+        self._operation = operation
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        token = _current.set(self._operation)
+        try:
+            return next(self._iterator)
+        finally:
+            _current.reset(token)
+
+
+async def _recorded_awaitable(awaitable, operation: _Operation, start: float):
+    token = _current.set(operation)
+    error = True
+    try:
+        result = await awaitable
+        error = False
+        return result
+    finally:
+        _current.reset(token)
+        operation.finish(time.perf_counter() - start, error)
+
+
+def _shelf_name(shelf) -> str:
+    return getattr(getattr(shelf, "_mapping", shelf), "name", "")
+
+
+def _record(function: Callable) -> Callable:
+    name = function.__name__
+
+    if inspect.iscoroutinefunction(function):
+
+        @functools.wraps(function)
+        async def recorded_coroutine(self, *args, **kwargs):
+            if not _enabled or _current.get() is not None:
+                return await function(self, *args, **kwargs)
+            operation = _Operation(_shelf_name(self), f"{type(self).__name__}.{name}")
+            return await _recorded_awaitable(
+                function(self, *args, **kwargs), operation, time.perf_counter()
+            )
+
+        return recorded_coroutine
+
+    @functools.wraps(function)
+    def recorded(self, *args, **kwargs):
+        if not _enabled or _current.get() is not None:
+            return function(self, *args, **kwargs)
+        operation = _Operation(_shelf_name(self), f"{type(self).__name__}.{name}")
+        start = time.perf_counter()
+        token = _current.set(operation)
+        try:
+            result = function(self, *args, **kwargs)
+        except BaseException:
+            operation.finish(time.perf_counter() - start, True)
+            raise
+        finally:
+            _current.reset(token)
+        if inspect.isawaitable(result):
+            # ie `await d[key]` on an async shelf, the commands are sent once awaited
+            return _recorded_awaitable(result, operation, start)
+        operation.finish(time.perf_counter() - start, False)
+        if isinstance(result, types.GeneratorType):
+            return _RecordedIterator(result, operation)
+        return result
+
+    return recorded
+
+
+def recorded(cls: type) -> type:
+    """Class decorator that records the public methods (and the dunder methods that access the database) defined by `cls` while stats are enabled, see `enable_stats`."""
+    for name, value in list(vars(cls).items()):
+        if not inspect.isfunction(value) or inspect.isasyncgenfunction(value):
+            continue
+        if name.startswith("_") and name not in _RECORDED_PRIVATE:
+            continue
+        setattr(cls, name, _record(value))
+    return cls
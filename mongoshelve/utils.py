@@ -0,0 +1,95 @@
+import random
+import re
+from typing import Any, Optional
+
+VERSION_FIELD = "version"  # incremented by every write to a document
+CONFLICT_BACKOFF = 0.005  # seconds, scaled by the attempt number
+
+_ESCAPES = {"%": "%25", ".": "%2E", "$": "%24"}
+_UNESCAPES = {escaped: char for char, escaped in _ESCAPES.items()}
+_ESCAPE_PATTERN = re.compile(r"[%.$]")
+_UNESCAPE_PATTERN = re.compile(r"%(?:25|2E|24)")
+# MongoDB rejects empty segments in dotted paths, and escaping never produces a lone "%00"
+_EMPTY_KEY = "%00"
+
+
+class VersionConflictError(Exception):
+    """Raised when a read-modify-write operation keeps losing to concurrent writers, ie its write is rejected because the document version changed since it was read, more than `max_retries` times in a row."""
+
+
+def version_condition(version: Optional[int]) -> dict:
+    """Filter that only matches a document that is still at `version`. Documents that have never been written by a version-aware writer have no version field, which counts as version 0."""
+    if not version:
+        return {VERSION_FIELD: {"$in": [0, None]}}
+    return {VERSION_FIELD: version}
+
+
+def conflict_backoff(attempt: int) -> float:
+    """Randomized delay before retrying after the `attempt`-th conflict, so that writers that collided do not collide again in lockstep."""
+    return random.uniform(0, CONFLICT_BACKOFF * attempt)
+
+
+def escape_key(key: str) -> str:
+    """MongoDB uses "." as the separator in field paths and reserves a leading "$" for operators, so dictionary keys cannot be used verbatim as field names in a dotted path like `contents.<key>`. This percent-encodes ".", "$" and "%" (the latter so that the encoding is reversible), and stores the empty key as "%00".
+
+    Args:
+        key (str): Dictionary key to convert into a MongoDB field name.
+
+    Raises:
+        TypeError: Only string keys can be stored in MongoDB documents.
+
+    Returns:
+        str: Field name that is safe to use as one segment of a dotted path.
+    """
+    if not isinstance(key, str):
+        raise TypeError(
+            f"Keys of a MongoDict must be strings, not {type(key).__name__}!"
+        )
+    if key == "":
+        return _EMPTY_KEY
+    return _ESCAPE_PATTERN.sub(lambda match: _ESCAPES[match.group()], key)
+
+
+def unescape_key(key: str) -> str:
+    """Inverse of `escape_key`."""
+    if key == _EMPTY_KEY:
+        return ""
+    return _UNESCAPE_PATTERN.sub(lambda match: _UNESCAPES[match.group()], key)
+
+
+def encode_keys(value: Any) -> Any:
+    """Recursively escapes the keys of all dictionaries within `value` so it can be written to MongoDB."""
+    if isinstance(value, dict):
+        return {escape_key(key): encode_keys(val) for key, val in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode_keys(val) for val in value]
+    return value
+
+
+def decode_keys(value: Any) -> Any:
+    """Recursively unescapes the keys of all dictionaries within a value read from MongoDB."""
+    if isinstance(value, dict):
+        return {unescape_key(key): decode_keys(val) for key, val in value.items()}
+    if isinstance(value, list):
+        return [decode_keys(val) for val in value]
+    return value
+
+
+def get_path(document: dict, path: str) -> Any:
+    """Walks a dotted field path through a document returned by MongoDB.
+
+    Raises:
+        KeyError: The document does not contain a value at `path`.
+    """
+    value = document
+    for key in path.split("."):
+        value = value[key]
+    return value
+
+
+def set_path(document: dict, path: str, value: Any):
+    """Sets `value` at a dotted field path within `document`, creating any intermediate documents."""
+    *parents, last = path.split(".")
+    for key in parents:
+        document = document.setdefault(key, {})
+    document[last] = value
@@ -0,0 +1,102 @@
+import copy
+import logging
+import threading
+from typing import Any, Callable, Optional
+from pymongo.errors import PyMongoError
+from .utils import VERSION_FIELD, get_path
+
+logger = logging.getLogger(__name__)
+
+
+class ShelfWatcher(threading.Thread):
+    """Background thread that keeps the cache of a MongoDict/MongoList up to date with changes made by other processes, so that reads never have to go to the database. This should be started using `MongoDict.watch` or `MongoList.watch`.
+
+    Changes are received through a change stream on the shelf's document. Change streams are only available on replica sets and sharded clusters, so if one cannot be opened (ie on a standalone mongod) the watcher falls back to polling the document version every `poll_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        shelf,
+        on_change: Optional[Callable[[Any], Any]] = None,
+        poll_interval: float = 1.0,
+    ):
+        super().__init__(name=f"mongoshelve-watch-{shelf.name}", daemon=True)
+        self._shelf = shelf
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.mode = None  # "change_stream" or "polling", set once the thread is running
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stop_event.is_set()
+
+    def run(self):
+        try:
+            self._watch_change_stream()
+        except (PyMongoError, NotImplementedError):
+            # change streams are not supported by this deployment (or driver)
+            pass
+        if not self.stopped:
+            self._poll()
+
+    def _watch_change_stream(self):
+        shelf = self._shelf
+        # the same document the shelf reads, ie including the key of a PerKeyMongoDict value
+        match = {f"fullDocument.{k}": v for k, v in shelf.db_filter.items()}
+        with shelf._collection.watch(
+            [{"$match": match}],
+            full_document="updateLookup",
+            max_await_time_ms=int(self.poll_interval * 1000),
+        ) as stream:
+            self.mode = "change_stream"
+            shelf._fetch()  # the stream is open, so no change after this read is missed
+            while not self.stopped and stream.alive:
+                change = stream.try_next()
+                if change is None or change.get("fullDocument") is None:
+                    continue
+                document = change["fullDocument"]
+                try:
+                    value = shelf._decode_all(get_path(document, shelf.db_projection))
+                except KeyError:
+                    continue
+                self._update(value, document.get(VERSION_FIELD, 0))
+
+    def _poll(self):
+        shelf = self._shelf
+        self.mode = "polling"
+        while not self.stopped:
+            try:
+                document = shelf._collection.find_one(
+                    shelf.db_filter, projection={"_id": 0, "name": 1, VERSION_FIELD: 1}
+                )
+                if (
+                    document is not None
+                    and document.get(VERSION_FIELD, 0) != shelf._cache_version
+                ):
+                    value = shelf._fetch()
+                    self._notify(value)
+            except PyMongoError:
+                logger.exception(f"Failed to poll {shelf.name} for changes.")
+            self._stop_event.wait(self.poll_interval)
+
+    def _update(self, value: Any, version: int):
+        shelf = self._shelf
+        with shelf._lock:
+            if shelf._cache_version is not None and version <= shelf._cache_version:
+                return  # already reflected in the cache, ie a local write
+            shelf._set_cache(value, version)
+        self._notify(value)
+
+    def _notify(self, value: Any):
+        if self.on_change is None:
+            return
+        try:
+            self.on_change(copy.deepcopy(value))
+        except Exception:
+            logger.exception(f"on_change callback of {self._shelf.name} failed.")
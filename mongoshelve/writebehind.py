@@ -0,0 +1,86 @@
+import logging
+import threading
+from typing import Optional, Union
+from pymongo.collection import Collection
+from .batch import ShelfBatch
+
+logger = logging.getLogger(__name__)
+
+# pending updates are flushed before they approach the 16 MB limit of a bulk write batch
+MAX_PENDING_BYTES = 8 * 1024 * 1024
+
+
+class WriteBehindQueue:
+    """Queue of writes that a background thread sends to the database every `flush_interval` seconds, or as soon as `max_pending` writes (counted before merging) or `MAX_PENDING_BYTES` of updates are waiting. Repeated writes to the same document are merged just like within a `ShelfBatch`, so a flush is usually a single update per document no matter how many writes it contains. Used by MongoDict/MongoList in write-behind mode.
+
+    A flush that fails does not raise in the background thread. Instead, the error is raised to the caller by the next write, `flush()` or `close()`. Any pending writes are flushed when the queue is closed, which the container that owns it does when it is closed, garbage collected, or at interpreter exit.
+    """
+
+    def __init__(
+        self,
+        collection: Collection,
+        flush_interval: float = 0.2,
+        max_pending: int = 1000,
+    ):
+        self.collection = collection
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.error: Optional[Exception] = None
+        self._pending = ShelfBatch(collection)
+        self._lock = threading.Lock()  # guards `_pending`
+        self._flush_lock = threading.Lock()  # keeps flushes in order
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="mongoshelve-write-behind", daemon=True
+        )
+        self._thread.start()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def record(self, db_filter: dict, update: Union[dict, list]):
+        with self._lock:
+            self._pending.record(db_filter, update)
+            full = (
+                self._pending.writes >= self.max_pending
+                or self._pending.size >= MAX_PENDING_BYTES
+            )
+        if full:
+            self._wakeup.set()
+
+    def raise_error(self):
+        """Raises the error of a failed background flush, if one has not been reported yet."""
+        error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def flush(self):
+        """Sends all pending writes to the database, raising any error of this or an earlier background flush."""
+        self._flush()
+        self.raise_error()
+
+    def _flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, ShelfBatch(self.collection)
+            try:
+                pending.flush()
+            except Exception as e:
+                logger.exception("Failed to flush write-behind queue.")
+                if self.error is None:
+                    self.error = e
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self._flush()
+
+    def close(self):
+        """Stops the background thread and flushes any pending writes."""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread.is_alive() and threading.current_thread() is not self._thread:
+            self._thread.join()
+        self.flush()
@@ -26,7 +26,7 @@ setup(
     download_url="https://github.com/rekumar/roboflo",
     license="MIT",
     install_requires=requirements,
-    extras_require={"dev": dev_requirements},
+    extras_require={"dev": dev_requirements, "codecs": ["msgpack", "lz4"]},
     packages=find_packages(),
     include_package_data=True,
     keywords=["research", "science", "machine", "automation"],
@@ -0,0 +1,151 @@
+from unittest import IsolatedAsyncioTestCase, skipIf
+from mongoshelve import AsyncMongoDict, AsyncMongoList, MongoDict
+from pymongo import MongoClient
+
+try:
+    from pymongo import AsyncMongoClient
+except ImportError:  # pymongo < 4.9
+    AsyncMongoClient = None
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+class InProcessCursor:
+    """Asyncio cursor over the results of a mongomock cursor."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    async def to_list(self, length=None):
+        return list(self._cursor)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self._cursor:
+            yield document
+
+
+class InProcessCollection:
+    """Asyncio collection with motor's API over a mongomock collection, so the async classes can be tested without a server."""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def aggregate(self, pipeline, **kwargs):
+        kwargs.pop("batchSize", None)
+        return InProcessCursor(self._collection.aggregate(pipeline, **kwargs))
+
+    def __getattr__(self, name):
+        method = getattr(self._collection, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+
+        return call
+
+
+@skipIf(AsyncMongoClient is None, "pymongo's async API is not available")
+class TestAsyncShelves(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.collection = AsyncMongoClient()["test_db"]["test_collection"]
+        pass
+
+    async def asyncTearDown(self):
+        await self.collection.drop()
+        pass
+
+    async def test_asyncDict(self):
+        d = await AsyncMongoDict(self.collection, name="testdict")
+        await d.set("a", 1)
+        await d.update({"b.c": [1, 2], "d": {"e": 3}})
+        self.assertEqual(await d["a"], 1, "Value not set correctly!")
+        self.assertEqual(await d.get("missing", 5), 5, "Default not returned!")
+        self.assertTrue(await d.contains("b.c"), "Key not found!")
+        self.assertEqual(await d.length(), 3, "Length not correct!")
+        self.assertEqual(list(await d.find({"e": 3})), ["d"], "Bad find!")
+        self.assertEqual(await d.select(["a", "x"]), {"a": 1}, "Bad select!")
+
+        nested = await d["d"]
+        await nested.set("f", 4)
+        self.assertEqual(
+            await (await d["d"]).copy(),
+            {"e": 3, "f": 4},
+            "Nested value not set correctly!",
+        )
+        await (await d["b.c"]).append(3)
+
+        self.assertEqual([key async for key in d], ["a", "b.c", "d"], "Bad iter!")
+        self.assertEqual(await d.popitem(), ("d", {"e": 3, "f": 4}), "Bad popitem!")
+        self.assertEqual(await d.pop("a"), 1, "Bad pop!")
+        with self.assertRaises(KeyError):
+            await d.delete("a")
+
+        # the documents are shared with the synchronous classes
+        self.assertEqual(
+            MongoDict(MongoClient()["test_db"]["test_collection"], name="testdict"),
+            {"b.c": [1, 2, 3]},
+            "Async writes not stored correctly!",
+        )
+
+    async def test_asyncList(self):
+        l = await AsyncMongoList(self.collection, name="testlist", default_value=[3])
+        await l.append(1)
+        await l.extend([2, 5])
+        await l.insert(0, 4)
+        self.assertEqual(await l.copy(), [4, 3, 1, 2, 5], "Values not set correctly!")
+        self.assertEqual(await l.pop(1), 3, "Bad pop!")
+        await l.remove(5)
+        await l.set(-1, 6)
+        self.assertEqual(await l[-1], 6, "Bad item assignment!")
+        self.assertEqual(await l[1:], [1, 6], "Bad slice!")
+        with self.assertRaises(IndexError):
+            await l.set(10, 1)
+        await l.sort()
+        self.assertEqual([x async for x in l], [1, 4, 6], "Bad sort!")
+        await l.reverse()
+        self.assertEqual(await l.copy(), [6, 4, 1], "Bad reverse!")
+        self.assertEqual(await l.length(), 3, "Bad length!")
+        self.assertEqual(await l.index(4), 1, "Bad index!")
+        self.assertEqual(await l.count(6), 1, "Bad count!")
+        self.assertTrue(await l.contains(1), "Value not found!")
+
+
+@skipIf(mongomock is None, "mongomock is not installed")
+class TestAsyncShelvesInProcess(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.collection = InProcessCollection(
+            mongomock.MongoClient()["test_db"]["test_collection"]
+        )
+        pass
+
+    async def asyncTearDown(self):
+        await self.collection.drop()
+        pass
+
+    async def test_asyncDict(self):
+        d = await AsyncMongoDict(
+            self.collection, name="testdict", default_value={"a": {"b": {"c": 1}}}
+        )
+        await d.set("x", 2)
+        self.assertEqual(await d["x"], 2, "Value not set correctly!")
+        self.assertEqual(await d.select(["x", "y"]), {"x": 2}, "Bad select!")
+        nested = await (await d["a"])["b"]
+        self.assertEqual(await nested.select(["c"]), {"c": 1}, "Bad nested select!")
+        self.assertEqual([key async for key in d], ["a", "x"], "Bad iter!")
+        self.assertEqual(await d.popitem(), ("x", 2), "Bad popitem!")
+        self.assertEqual(await d.length(), 1, "Bad length!")
+
+    async def test_asyncList(self):
+        l = await AsyncMongoList(self.collection, name="testlist", default_value=[3])
+        await l.append(1)
+        await l.extend([2, 5])
+        self.assertEqual(await l.copy(), [3, 1, 2, 5], "Values not set correctly!")
+        self.assertEqual(await l.pop(), 5, "Bad pop!")
+        self.assertEqual(await l[1:], [1, 2], "Bad slice!")
+        self.assertEqual([x async for x in l], [3, 1, 2], "Bad iter!")
+        self.assertEqual(await l.length(), 3, "Bad length!")
@@ -0,0 +1,97 @@
+from unittest import TestCase
+from unittest.mock import patch
+from mongoshelve import MongoDict, MongoList, ensure_indexes
+from pymongo import MongoClient
+
+
+class TestMongoShelf(TestCase):
+    def setUp(self):
+        self.collection = MongoClient()["test_db"]["test_collection"]
+        pass
+
+    def tearDown(self):
+        self.collection.drop()
+        pass
+
+    def test_initialization(self):
+        MongoDict(self.collection, name="testdict", default_value={"a": 1})
+        MongoList(self.collection, name="testlist", default_value=[1])
+        d = MongoDict(self.collection, name="testdict", default_value={"b": 2})
+        l = MongoList(self.collection, name="testlist", default_value=[2])
+        self.assertEqual(d, {"a": 1}, "Existing dict was overwritten!")
+        self.assertEqual(l, [1], "Existing list was overwritten!")
+        self.assertEqual(
+            self.collection.count_documents({}), 2, "Duplicate documents created!"
+        )
+
+        d.apply_default_value(overwrite=True)
+        l.apply_default_value(overwrite=True)
+        self.assertEqual(d, {"b": 2}, "Dict was not overwritten!")
+        self.assertEqual(l, [2], "List was not overwritten!")
+
+    def test_ensureIndexes(self):
+        ensure_indexes(self.collection)
+        ensure_indexes(self.collection)  # should be idempotent
+        index = [
+            index
+            for index in self.collection.index_information().values()
+            if index["key"] == [("name", 1)]
+        ]
+        self.assertEqual(len(index), 1, "Index on name was not created!")
+        self.assertTrue(index[0]["unique"], "Index on name is not unique!")
+
+        MongoDict(self.collection, name="testdict")
+        MongoDict(self.collection, name="testdict")
+        self.assertEqual(
+            self.collection.count_documents({}), 1, "Duplicate documents created!"
+        )
+
+    def test_openMany(self):
+        MongoDict(self.collection, name="d1", default_value={"a": 1})
+        MongoList(self.collection, name="l1", default_value=[1])
+        names = ["d1", "d2", "d3"]
+        with patch.object(
+            self.collection, "find", wraps=self.collection.find
+        ) as find, patch.object(
+            self.collection, "find_one", wraps=self.collection.find_one
+        ) as find_one, patch.object(
+            self.collection, "bulk_write", wraps=self.collection.bulk_write
+        ) as bulk_write:
+            dicts = MongoDict.open_many(
+                self.collection,
+                names,
+                defaults={"d1": {"b": 2}, "d2": {"c": 3}},
+                cache=True,
+            )
+        self.assertEqual(find.call_count, 1, "Existing shelves not read in one query!")
+        self.assertEqual(
+            bulk_write.call_count, 1, "Missing shelves not created in one write!"
+        )
+        self.assertEqual(find_one.call_count, 0, "Shelves opened one by one!")
+        self.assertEqual(list(dicts), names, "Shelves not returned by name!")
+        self.assertEqual(dicts["d1"]._cache, {"a": 1}, "Existing value not preloaded!")
+        self.assertEqual(dicts["d2"]._cache, {"c": 3}, "Default value not preloaded!")
+        self.assertEqual(dicts["d3"], {}, "Missing default not applied!")
+        dicts["d2"]["d"] = 4
+        self.assertEqual(
+            MongoDict(self.collection, name="d2"),
+            {"c": 3, "d": 4},
+            "Value not set correctly!",
+        )
+
+        with patch.object(self.collection, "find", wraps=self.collection.find) as find:
+            lists = MongoList.open_many(
+                self.collection, ["l1", "l2"], defaults={"l2": [5]}
+            )
+        self.assertNotIn(
+            "contents",
+            find.call_args.kwargs["projection"],
+            "Contents downloaded without a cache!",
+        )
+        self.assertEqual(lists["l1"], [1], "Existing list was overwritten!")
+        self.assertEqual(lists["l2"], [5], "Default value not applied!")
+        self.assertEqual(
+            MongoList.open_many(self.collection, []), {}, "Bad empty open!"
+        )
+        with self.assertRaises(ValueError):
+            MongoDict.open_many(self.collection, ["d4"], layout="per_key")
@@ -0,0 +1,102 @@
+from unittest import TestCase
+from unittest.mock import patch
+from mongoshelve import MongoDict, MongoList, shelf_batch
+from mongoshelve.batch import merge_updates
+from pymongo import MongoClient
+
+
+class TestShelfBatch(TestCase):
+    def setUp(self):
+        self.collection = MongoClient()["test_db"]["test_collection"]
+        pass
+
+    def tearDown(self):
+        self.collection.drop()
+        pass
+
+    def test_batchWrites(self):
+        d = MongoDict(self.collection, name="testdict")
+        l = MongoList(self.collection, name="testlist")
+        d["nested"] = {"a": []}
+        nested = d["nested"]["a"]
+        with patch.object(
+            self.collection, "bulk_write", wraps=self.collection.bulk_write
+        ) as bulk_write, patch.object(
+            self.collection, "update_one", wraps=self.collection.update_one
+        ) as update_one:
+            with shelf_batch(self.collection) as batch:
+                for i in range(100):
+                    d[str(i)] = i
+                    l.append(i)
+                d["0"] = "overwritten"
+                del d["1"]
+                nested.append(1)
+                self.assertEqual(len(batch), 4, "Writes were not merged!")
+                self.assertEqual(len(d), 1, "Writes were sent before exiting!")
+            self.assertEqual(bulk_write.call_count, 1, "Writes not sent in bulk!")
+            self.assertEqual(update_one.call_count, 0, "Writes not batched!")
+
+        expected = {str(i): i for i in range(2, 100)}
+        expected.update({"0": "overwritten", "nested": {"a": [1]}})
+        self.assertEqual(d, expected, "Batched dict writes not applied correctly!")
+        self.assertEqual(l, list(range(100)), "Batched list writes not applied!")
+
+    def test_batchFetchAndDiscard(self):
+        l = MongoList(self.collection, name="testlist", default_value=[1])
+        with l.batch():
+            l.append(2)
+            self.assertEqual(l.pop(), 2, "Batch not flushed before pop!")
+        self.assertEqual(l, [1], "Pop not applied correctly!")
+
+        with self.assertRaises(RuntimeError):
+            with l.batch():
+                l.append(3)
+                raise RuntimeError
+        self.assertEqual(l, [1], "Writes of a failed batch were applied!")
+
+    def test_batchCache(self):
+        d = MongoDict(self.collection, name="testdict", cache=True)
+        self.assertEqual(d, {}, "Value not read correctly!")
+        with self.assertRaises(RuntimeError):
+            with d.batch():
+                d["x"] = 1
+                self.assertEqual(d, {}, "Pending write visible before the flush!")
+                raise RuntimeError
+        self.assertEqual(d, {}, "Writes of a failed batch kept in the cache!")
+
+        with d.batch() as batch:
+            d["x"] = 1
+            batch.discard()
+        self.assertEqual(d, {}, "Discarded writes kept in the cache!")
+
+        l = MongoList(self.collection, name="testlist", cache=True)
+        self.assertEqual(l, [], "Value not read correctly!")
+        with l.batch():
+            l.append(1)
+            l[5] = 2  # out of range, so skipped when flushed
+        self.assertEqual(l, [1], "Skipped write kept in the cache!")
+        self.assertEqual(d, {}, "Value not read correctly!")
+
+    def test_mergeUpdates(self):
+        self.assertEqual(
+            merge_updates(
+                {"$set": {"contents.a": 1}, "$inc": {"version": 1}},
+                {"$unset": {"contents.a": ""}, "$inc": {"version": 1}},
+            ),
+            {"$inc": {"version": 2}, "$unset": {"contents.a": ""}},
+        )
+        self.assertEqual(
+            merge_updates(
+                {"$push": {"contents": 1}}, {"$push": {"contents": {"$each": [2, 3]}}}
+            ),
+            {"$push": {"contents": {"$each": [1, 2, 3]}}},
+        )
+        self.assertIsNone(
+            merge_updates({"$set": {"contents.a": {}}}, {"$set": {"contents.a.b": 1}})
+        )
+        self.assertIsNone(
+            merge_updates(
+                {"$push": {"contents": 1}},
+                {"$push": {"contents": {"$each": [2], "$position": 0}}},
+            )
+        )
@@ -0,0 +1,166 @@
+from unittest import TestCase
+from unittest.mock import patch
+from mongoshelve import ChunkedMongoList, MongoList
+from pymongo import MongoClient
+
+
+class TestChunkedMongoList(TestCase):
+    def setUp(self):
+        self.collection = MongoClient()["test_db"]["test_collection"]
+        pass
+
+    def tearDown(self):
+        self.collection.drop()
+        pass
+
+    def test_chunkedList(self):
+        l = MongoList(
+            self.collection,
+            name="testlist",
+            default_value=[0, 1],
+            layout="chunked",
+            chunk_size=3,
+        )
+        self.assertIsInstance(l, ChunkedMongoList, "Layout not selected!")
+        l.append(2)
+        l.extend(range(3, 10))
+        l += [10]
+        self.assertEqual(l, list(range(11)), "Values not stored correctly!")
+        self.assertEqual(
+            self.collection.count_documents({"list": "testlist"}),
+            4,
+            "Values not split into chunks!",
+        )
+        self.assertEqual(len(l), 11, "Length not correct!")
+        self.assertEqual(l[4], 4, "Bad index!")
+        self.assertEqual(l[-1], 10, "Bad negative index!")
+        self.assertEqual(l[2:8:2], [2, 4, 6], "Bad slice!")
+        self.assertEqual(l[::-4], [10, 6, 2], "Bad reversed slice!")
+        with self.assertRaises(IndexError):
+            l[11]
+
+        l[5] = "five"
+        l[-2] = "nine"
+        with self.assertRaises(IndexError):
+            l[11] = 11
+        self.assertEqual(l[5], "five", "Item not set correctly!")
+        self.assertEqual(l.index("nine"), 9, "Bad index()!")
+        self.assertIn("five", l, "Item not found!")
+        self.assertEqual(l.count(1), 1, "Bad count!")
+        with self.assertRaises(NotImplementedError):
+            l.insert(0, 1)
+
+        reopened = MongoList(
+            self.collection, name="testlist", default_value=[0], layout="chunked"
+        )
+        self.assertEqual(reopened.chunk_size, 3, "Chunk size not read from header!")
+        self.assertEqual(len(reopened), 11, "Default value reapplied!")
+        reopened.clear()
+        self.assertEqual(l, [], "List not cleared!")
+        l.append(1)
+        self.assertEqual(l, [1], "Append after clear failed!")
+
+    def test_reservedSlots(self):
+        l = MongoList(
+            self.collection,
+            name="testlist",
+            default_value=[0, 1],
+            layout="chunked",
+            chunk_size=3,
+        )
+        Collection = type(self.collection)
+        original = Collection.bulk_write
+        lengths = []
+
+        def bulk_write(collection, operations, **kwargs):
+            lengths.append(len(l))
+            return original(collection, operations, **kwargs)
+
+        with patch.object(
+            Collection, "bulk_write", autospec=True, side_effect=bulk_write
+        ):
+            l.append(2)
+        self.assertEqual(lengths, [2], "Length published before the chunk write!")
+        self.assertEqual(l[-1], 2, "Appended value not readable!")
+
+        # an append whose process died after reserving its positions
+        l._reserve(2)
+        self.assertEqual(len(l), 3, "Unwritten positions counted!")
+        l.append(5)
+        self.assertEqual(len(l), 6, "Length not correct!")
+        self.assertEqual(l[-1], 5, "Bad negative index!")
+        self.assertIsNone(l[3], "Reserved position not read as None!")
+        self.assertEqual(l[2:5], [2, None, None], "Bad slice!")
+        self.assertEqual(l, [0, 1, 2, None, None, 5], "Bad iteration!")
+        with self.assertRaises(IndexError):
+            l[6]
+        with self.assertRaises(IndexError):
+            l[4] = 4
+
+    def test_unpublishedItems(self):
+        l = MongoList(
+            self.collection,
+            name="testlist",
+            default_value=[0, 1],
+            layout="chunked",
+            chunk_size=3,
+        )
+        # an append whose process died after writing its chunks
+        with patch.object(ChunkedMongoList, "_publish", return_value=True):
+            l.append(7)
+        self.assertEqual(len(l), 2, "Unpublished element counted!")
+        self.assertNotIn(7, l, "Unpublished element found!")
+        self.assertEqual(l.count(7), 0, "Unpublished element counted by count()!")
+        with self.assertRaises(ValueError):
+            l.index(7)
+        l.append(7)
+        self.assertEqual(l, [0, 1, 7, 7], "Written element not published!")
+        self.assertEqual(l.count(7), 2, "Bad count!")
+        self.assertEqual(l.index(7), 2, "Bad index()!")
+
+    def test_clearDuringAppend(self):
+        l = MongoList(
+            self.collection,
+            name="testlist",
+            default_value=[0, 1],
+            layout="chunked",
+            chunk_size=3,
+        )
+        Collection = type(self.collection)
+        original = Collection.bulk_write
+        cleared = []
+
+        def bulk_write(collection, operations, **kwargs):
+            result = original(collection, operations, **kwargs)
+            if not cleared:
+                cleared.append(True)
+                l.clear()
+            return result
+
+        with patch.object(
+            Collection, "bulk_write", autospec=True, side_effect=bulk_write
+        ):
+            l.extend([2, 3])
+        self.assertEqual(l, [2, 3], "Append not retried on the cleared list!")
+        self.assertEqual(len(l), 2, "Length not correct!")
+        self.assertEqual(l.count(2), 1, "Stale element counted!")
+        items = [
+            item["v"]
+            for chunk in self.collection.find({"list": "testlist"})
+            for item in chunk["items"]
+        ]
+        self.assertEqual(items, [2, 3], "Stale elements not removed!")
+
+    def test_indexCreatedOnce(self):
+        collection = self.collection.database["test_index_once"]
+        Collection = type(collection)
+        with patch.object(
+            Collection,
+            "create_index",
+            autospec=True,
+            side_effect=Collection.create_index,
+        ) as create_index:
+            ChunkedMongoList(collection, name="a")
+            ChunkedMongoList(collection, name="b")
+        collection.drop()
+        self.assertEqual(create_index.call_count, 1, "Index created on every open!")
@@ -0,0 +1,73 @@
+from unittest import TestCase, skipIf
+from bson.binary import Binary
+from mongoshelve import MongoDict, MongoList, MsgpackCodec, PickleCodec
+from mongoshelve.codecs import lz4, msgpack, np
+from pymongo import MongoClient
+
+
+class TestCodecs(TestCase):
+    def setUp(self):
+        self.collection = MongoClient()["test_db"]["test_collection"]
+        pass
+
+    def tearDown(self):
+        self.collection.drop()
+        pass
+
+    def test_pickleCodec(self):
+        codec = PickleCodec(compression="zlib")
+        d = MongoDict(self.collection, name="testdict", codec=codec)
+        d["nested"] = {"a": [1, (2, 3)], "b": {4, 5}}
+        d["bytes"] = b"raw"
+        self.assertEqual(
+            d["nested"], {"a": [1, (2, 3)], "b": {4, 5}}, "Value not set correctly!"
+        )
+        stored = self.collection.find_one({"name": "testdict"})["contents"]
+        self.assertIsInstance(stored["nested"], Binary, "Value not encoded!")
+        self.assertEqual(d.pop("bytes"), b"raw", "Bad pop!")
+
+        l = MongoList(self.collection, name="testlist", codec=codec)
+        l.append([1, 2])
+        l.extend([{"a": 1}, (3,)])
+        l.insert(0, "first")
+        l[1] = [0]
+        self.assertEqual(l, ["first", [0], {"a": 1}, (3,)], "Values not set!")
+        self.assertEqual(l[2], {"a": 1}, "Bad index!")
+        self.assertEqual(l[1:3], [[0], {"a": 1}], "Bad slice!")
+        l.remove({"a": 1})
+        self.assertEqual(l.pop(), (3,), "Bad pop!")
+        l.append("a")
+        l.sort(key=str)
+        self.assertEqual(l, [[0], "a", "first"], "Bad sort!")
+
+    @skipIf(np is None, "numpy is not installed")
+    def test_numpyArrays(self):
+        codecs = [PickleCodec(), PickleCodec(compression="zlib")]
+        if msgpack is not None:
+            codecs.append(MsgpackCodec())
+        if lz4 is not None:
+            codecs.append(PickleCodec(compression="lz4"))
+        for codec in codecs:
+            with self.subTest(
+                codec=type(codec).__name__, compression=codec.compression
+            ):
+                array = np.arange(10000, dtype="float32").reshape(100, 100)
+                encoded = codec.encode({"spectrum": array})
+                self.assertLess(len(encoded), 1.1 * array.nbytes, "Array not packed!")
+                decoded = codec.decode(encoded)["spectrum"]
+                self.assertTrue(np.array_equal(decoded, array), "Array not decoded!")
+                self.assertEqual(decoded.dtype, array.dtype, "Wrong dtype!")
+
+        array = np.arange(10)
+        d = MongoDict(self.collection, name="testdict", codec=PickleCodec())
+        d["array"] = array
+        decoded = d["array"]
+        self.assertTrue(np.array_equal(decoded, array), "Array not stored!")
+        self.assertFalse(decoded.flags.owndata, "Array buffer was copied!")
+
+    @skipIf(msgpack is None, "msgpack is not installed")
+    def test_msgpackCodec(self):
+        l = MongoList(self.collection, name="testlist", codec=MsgpackCodec())
+        l.append({"a": [1, 2]})
+        l.append("b")
+        self.assertEqual(l, [{"a": [1, 2]}, "b"], "Values not set correctly!")
@@ -0,0 +1,79 @@
+from unittest import TestCase
+from mongoshelve import MongoDeque, MongoList
+from pymongo import MongoClient
+
+
+class TestMongoDeque(TestCase):
+    def setUp(self):
+        self.collection = MongoClient()["test_db"]["test_collection"]
+        pass
+
+    def tearDown(self):
+        self.collection.drop()
+        pass
+
+    def test_boundedAppends(self):
+        d = MongoDeque(
+            self.collection, name="testname", default_value=[1, 2, 3, 4], maxlen=3
+        )
+        self.assertEqual(d, [2, 3, 4], "Default value not trimmed!")
+        d.append(5)
+        self.assertEqual(d, [3, 4, 5], "Append did not discard from the left!")
+        d.appendleft(2)
+        self.assertEqual(d, [2, 3, 4], "Appendleft did not discard from the right!")
+        d.extend([6, 7])
+        self.assertEqual(d, [4, 6, 7], "Bad extend!")
+        d.extendleft([8, 9])
+        self.assertEqual(d, [9, 8, 4], "Bad extendleft!")
+        d.extend(range(10))
+        self.assertEqual(d, [7, 8, 9], "Long extend not trimmed!")
+        self.assertEqual(
+            MongoList(self.collection, name="testname"),
+            [7, 8, 9],
+            "Stored value not trimmed!",
+        )
+        self.assertEqual(d.popleft(), 7, "Bad popleft!")
+        self.assertEqual(d.pop(), 9, "Bad pop!")
+        d *= 3
+        self.assertEqual(d, [8, 8, 8], "Bad multiplication!")
+
+    def test_insertAndRotate(self):
+        d = MongoDeque(self.collection, name="testname", default_value=[1, 2], maxlen=3)
+        d.insert(1, 5)
+        self.assertEqual(d, [1, 5, 2], "Bad insert!")
+        with self.assertRaises(IndexError):
+            d.insert(0, 6)
+        d.rotate()
+        self.assertEqual(d, [2, 1, 5], "Bad rotation!")
+        d.rotate(-4)
+        self.assertEqual(d, [1, 5, 2], "Bad negative rotation!")
+        with self.assertRaises(TypeError):
+            d[0:1] = [1]
+        d.clear()
+        d.rotate(2)
+        self.assertEqual(d, [], "Bad rotation of empty deque!")
+        with self.assertRaises(IndexError):
+            d.popleft()
+        with self.assertRaises(ValueError):
+            MongoDeque(self.collection, name="other", maxlen=-1)
+        empty = MongoDeque(self.collection, name="empty", maxlen=0)
+        with self.assertRaises(IndexError):
+            empty.insert(0, 1)
+        self.assertEqual(empty, [], "Inserted into a deque of maxlen 0!")
+
+    def test_cache(self):
+        d = MongoDeque(self.collection, name="testname", maxlen=2, cache=True)
+        self.assertEqual(d, [], "Value not read correctly!")
+        d.extend([1, 2, 3])
+        d.appendleft(0)
+        d.rotate()
+        self.assertEqual(d._cache, [2, 0], "Local write not applied to cache!")
+        self.assertEqual(
+            MongoDeque(self.collection, name="testname"),
+            [2, 0],
+            "Cache does not match stored value!",
+        )
+
+        unbounded = MongoDeque(self.collection, name="unbounded", default_value=[1])
+        unbounded.extend(range(5))
+        self.assertEqual(len(unbounded), 6, "Unbounded deque was trimmed!")
@@ -1,7 +1,11 @@
+import copy
 from unittest import TestCase
+from unittest.mock import patch
 from uuid import UUID
-from mongoshelve import MongoDict, MongoList
-from pymongo import MongoClient
+from mongoshelve import FrozenDict, FrozenList, MongoDict, MongoList, PickleCodec
+from mongoshelve.utils import encode_keys
+from pymongo import MongoClient, ReadPreference
+
 
 class TestMongoDict(TestCase):
     def setUp(self):
@@ -110,3 +114,312 @@ class TestMongoDict(TestCase):
             d["test"] = [{1: 2}]
         with self.assertRaises(ValueError):
             d["test"] = [(1, 2)]
+
+    def test_specialKeys(self):
+        d = MongoDict(self.collection, name="testname")
+        d["a.b"] = 1
+        d["$c"] = {"d.e": 2}
+        d["100%"] = 3
+        self.assertEqual(
+            d, {"a.b": 1, "$c": {"d.e": 2}, "100%": 3}, "Keys not escaped correctly!"
+        )
+        self.assertEqual(d["$c"]["d.e"], 2, "Nested key not escaped correctly!")
+
+        del d["a.b"]
+        self.assertEqual(len(d), 2, "Length not set correctly after delete!")
+        with self.assertRaises(KeyError):
+            del d["a.b"]
+        with self.assertRaises(KeyError):
+            d.pop("a.b")
+        self.assertEqual(d.pop("a.b", "default"), "default", "Pop default failed!")
+        self.assertEqual(d.popitem(), ("100%", 3), "Popitem not set correctly!")
+        with self.assertRaises(TypeError):
+            d[1] = "value"
+        self.assertEqual(d.get(1, "default"), "default", "Get default failed!")
+        self.assertNotIn(1, d, "Non-string key found!")
+
+        # keys stored verbatim by older versions, encoded as described in the README
+        self.collection.insert_one(
+            {
+                "name": "legacy",
+                "contents": {"100%25": 1, "a": {"b%2E": 2}, "c.d": 3, "": 4},
+            }
+        )
+        for document in self.collection.find(
+            {"name": "legacy", "contents": {"$exists": True}}
+        ):
+            self.collection.update_one(
+                {"_id": document["_id"]},
+                {"$set": {"contents": encode_keys(document["contents"])}},
+            )
+        legacy = MongoDict(self.collection, name="legacy")
+        self.assertEqual(
+            legacy,
+            {"100%25": 1, "a": {"b%2E": 2}, "c.d": 3, "": 4},
+            "Legacy keys not migrated!",
+        )
+        self.assertEqual(legacy["c.d"], 3, "Legacy dotted key not readable!")
+        del legacy[""]
+        self.assertNotIn("", legacy, "Legacy empty key not deleted!")
+
+    def test_keyTypes(self):
+        for layout in ["document", "per_key"]:
+            with self.subTest(layout=layout):
+                d = MongoDict(self.collection, name=layout, layout=layout)
+                with self.assertRaises(TypeError):
+                    d[1] = "value"
+                with self.assertRaises(KeyError):
+                    d[1]
+                with self.assertRaises(KeyError):
+                    del d[1]
+                with self.assertRaises(KeyError):
+                    d.pop(1)
+                self.assertEqual(d.pop(1, "default"), "default", "Pop default failed!")
+                self.assertIsNone(d.get(1), "Get default failed!")
+                self.assertNotIn(1, d, "Non-string key found!")
+
+                d[""] = 1
+                d["a"] = {"": 2}
+                self.assertEqual(d[""], 1, "Empty key not read correctly!")
+                self.assertIn("", d, "Empty key not found!")
+                self.assertEqual(d, {"": 1, "a": {"": 2}}, "Empty key not stored!")
+                self.assertEqual(d["a"][""], 2, "Nested empty key not read!")
+                del d[""]
+                self.assertEqual(d, {"a": {"": 2}}, "Empty key not deleted!")
+
+    def test_pointReads(self):
+        d = MongoDict(
+            self.collection,
+            name="testname",
+            default_value={"a": 1, "b.c": {"d": [1, 2]}, "e": None},
+        )
+        self.assertEqual(d["a"], 1, "Value not read correctly!")
+        self.assertEqual(d["e"], None, "None value not read correctly!")
+        self.assertEqual(d["b.c"]["d"], [1, 2], "Nested value not read correctly!")
+        with self.assertRaises(KeyError):
+            d["missing"]
+        self.assertEqual(d.get("missing", 2), 2, "Get default not returned!")
+        self.assertTrue("e" in d, "Key with None value not found!")
+        self.assertFalse("missing" in d, "Missing key found!")
+        self.assertFalse(1 in d, "Non-string key found!")
+        self.assertEqual(len(d), 3, "Length not read correctly!")
+        self.assertEqual(len(d["b.c"]), 1, "Nested length not read correctly!")
+
+    def test_lazyNestedValues(self):
+        default = {str(i): {"x": i, "y": [i]} for i in range(50)}
+        d = MongoDict(self.collection, name="testname", default_value=default)
+        with patch.object(
+            self.collection, "find_one", wraps=self.collection.find_one
+        ) as find_one:
+            self.assertEqual(d["7"]["x"], 7, "Nested value not read correctly!")
+        self.assertEqual(
+            find_one.call_count, 2, "Nested access should take one query per level!"
+        )
+        d["7"]["y"].append(8)
+        self.assertEqual(d["7"]["y"], [7, 8], "Nested list not updated correctly!")
+
+    def test_streamingIteration(self):
+        default = {f"k.{i}": {"x": i} for i in range(10)}
+        d = MongoDict(
+            self.collection, name="testname", default_value=default, page_size=3
+        )
+        with patch.object(
+            self.collection, "find_one", wraps=self.collection.find_one
+        ) as find_one, patch.object(
+            self.collection, "aggregate", wraps=self.collection.aggregate
+        ) as aggregate:
+            self.assertEqual(list(d), list(default), "Keys not iterated correctly!")
+            self.assertEqual(
+                list(d.keys()), list(default), "Keys not iterated correctly!"
+            )
+            items = dict(d.items())
+            values = list(d.values())
+        self.assertEqual(items, default, "Items not iterated correctly!")
+        self.assertEqual(
+            values, list(default.values()), "Values not iterated correctly!"
+        )
+        self.assertEqual(find_one.call_count, 0, "Iteration should not read the dict!")
+        streamed = [c for c in aggregate.call_args_list if "batchSize" in c.kwargs]
+        self.assertEqual(len(streamed), 4, "Iteration should be one query!")
+        self.assertEqual(
+            aggregate.call_args.kwargs["batchSize"], 3, "page_size not used!"
+        )
+        items["k.1"]["x"] = 5
+        self.assertEqual(d["k.1"]["x"], 5, "Iterated values not writable!")
+        self.assertEqual(len(d.items()), 10, "Bad length of items view!")
+
+    def test_atomicUpdates(self):
+        d = MongoDict(
+            self.collection, name="testname", default_value={"n": 1, "c": {"x": 2}}
+        )
+        other = MongoDict(self.collection, name="testname", cache=True)
+        self.assertEqual(other["n"], 1, "Value not read correctly!")
+        self.assertEqual(d.incr("n"), 2, "Bad increment!")
+        self.assertEqual(d.incr("n", -5), -3, "Bad negative increment!")
+        self.assertEqual(d.incr("new", 2.5), 2.5, "Missing key not created!")
+        self.assertEqual(d.mul("n", 2), -6, "Bad multiplication!")
+        self.assertEqual(d.mul("zero", 3), 0, "Missing key not set to zero!")
+        self.assertEqual(d.set_max("n", 4), 4, "Bad maximum!")
+        self.assertEqual(d.set_max("n", 1), 4, "Smaller value set as maximum!")
+        self.assertEqual(d.set_min("n", 1), 1, "Bad minimum!")
+        self.assertEqual(d.set_min("n", 3), 1, "Greater value set as minimum!")
+        self.assertEqual(d["c"].incr("x", 3), 5, "Bad nested increment!")
+        self.assertEqual(
+            other.copy(),
+            {"n": 1, "c": {"x": 5}, "new": 2.5, "zero": 0},
+            "Value not set correctly!",
+        )
+        self.assertEqual(other.incr("n"), 2, "Bad increment!")
+        self.assertEqual(other._cache["n"], 2, "Increment not applied to cache!")
+        # MongoDB orders values of different types by type, and booleans after numbers
+        self.assertIs(other.set_max("n", True), True, "Bad mixed type maximum!")
+        self.assertIs(other._cache["n"], True, "Stored maximum not cached!")
+        self.assertIs(d["n"], True, "Bad mixed type maximum!")
+        self.assertEqual(other.set_min("n", "s"), "s", "Bad mixed type minimum!")
+        self.assertEqual(other._cache["n"], "s", "Stored minimum not cached!")
+        with self.assertRaises(ValueError):
+            MongoDict(self.collection, name="other", codec=PickleCodec()).incr("n")
+
+    def test_concurrentPopitem(self):
+        d = MongoDict(self.collection, name="testname", default_value={"a": 1})
+        other = MongoDict(self.collection, name="testname")
+        last_entry = d._last_entry
+
+        def interrupted():
+            entry = last_entry()
+            if "b" not in other:
+                other["b"] = 2  # inserted after the last key was read
+            return entry
+
+        with patch.object(d, "_last_entry", side_effect=interrupted):
+            self.assertEqual(d.popitem(), ("b", 2), "Concurrent insert was skipped!")
+        self.assertEqual(d, {"a": 1}, "Value not set correctly!")
+        self.assertEqual(d.popitem(), ("a", 1), "Bad popitem!")
+        with self.assertRaises(KeyError):
+            d.popitem()
+
+    def test_cache(self):
+        d = MongoDict(self.collection, name="testname", cache=True)
+        other = MongoDict(self.collection, name="testname")
+        self.assertEqual(d, {}, "Value not read correctly!")
+        d["a"] = 1
+        d.update({"b": (1, 2)})
+        self.assertEqual(
+            d._cache, {"a": 1, "b": [1, 2]}, "Local write not applied to cache!"
+        )
+        self.assertEqual(d, {"a": 1, "b": [1, 2]}, "Value not read correctly!")
+        other["c"] = {"x": 1}
+        self.assertEqual(d["c"]["x"], 1, "Cache not refreshed after external write!")
+        self.assertEqual(d.pop("a"), 1, "Pop not set correctly!")
+        self.assertEqual(d.popitem(), ("c", {"x": 1}), "Popitem not set correctly!")
+        self.assertEqual(d, other, "Database and cache out of sync!")
+
+        ttl = MongoDict(self.collection, name="testname", cache=True, cache_ttl=60)
+        self.assertEqual(len(ttl), 1, "Length not read correctly!")
+        other["d"] = 1
+        self.assertFalse("d" in ttl, "Cache should be served within its ttl!")
+        ttl["e"] = 1
+        self.assertTrue("d" in ttl, "Cache not refreshed after conflict!")
+
+    def test_nestedCache(self):
+        d = MongoDict(
+            self.collection,
+            name="testname",
+            default_value={"x": {"a": 1}, "l": [1]},
+            cache=True,
+            cache_ttl=60,
+        )
+        self.assertEqual(d.copy(), {"x": {"a": 1}, "l": [1]}, "Value not read!")
+        d["x"]["b"] = 2
+        d["l"].append(2)
+        expected = {"x": {"a": 1, "b": 2}, "l": [1, 2]}
+        self.assertEqual(d.copy(), expected, "Nested write not applied to cache!")
+        self.assertEqual(d["x"], {"a": 1, "b": 2}, "Nested write not applied to cache!")
+        self.assertEqual(
+            MongoDict(self.collection, name="testname"), expected, "Write not stored!"
+        )
+        with d.batch():
+            d["x"]["c"] = 3
+        self.assertEqual(d["x"]["c"], 3, "Cache not reloaded after nested batch write!")
+
+    def test_findAndSelect(self):
+        d = MongoDict(
+            self.collection,
+            name="testname",
+            default_value={
+                "a.1": 1,
+                "b": 5,
+                "c": {"status": "done", "retries": 1},
+                "d": {"status": "done", "retries": 4},
+                "e": "done",
+            },
+        )
+        self.assertEqual(d.find({"$gt": 2}), {"b": 5}, "Bad operator query!")
+        self.assertEqual(d.find("done"), {"e": "done"}, "Bad equality query!")
+        self.assertEqual(
+            d.find({"status": "done", "retries": {"$lt": 3}}),
+            {"c": {"status": "done", "retries": 1}},
+            "Bad field query!",
+        )
+        self.assertEqual(
+            d.select(["a.1", "c", "missing"]),
+            {"a.1": 1, "c": {"status": "done", "retries": 1}},
+            "Bad select!",
+        )
+        self.assertEqual(d.select([]), {}, "Bad empty select!")
+        self.assertIsInstance(d.find(1)["a.1"], int, "Bad find result!")
+        d.find({"retries": 4})["d"]["retries"] = 0
+        self.assertEqual(d["d"]["retries"], 0, "Nested find result not writable!")
+
+    def test_snapshot(self):
+        value = {"a": 1, "b": {"c": [1, 2], "d": {"e": 2}}}
+        d = MongoDict(self.collection, name="testname", default_value=value)
+        with patch.object(
+            self.collection, "find_one", wraps=self.collection.find_one
+        ) as find_one:
+            snapshot = d.snapshot()
+            self.assertEqual(snapshot, value, "Bad snapshot!")
+            self.assertIsInstance(snapshot["b"], FrozenDict, "Nested dict not frozen!")
+            self.assertIsInstance(snapshot["b"]["c"], FrozenList, "List not frozen!")
+        self.assertEqual(find_one.call_count, 1, "Snapshot should be one round trip!")
+
+        with self.assertRaises(TypeError):
+            snapshot["a"] = 2
+        with self.assertRaises(TypeError):
+            snapshot["b"]["c"].append(3)
+        with self.assertRaises(TypeError):
+            snapshot["b"]["d"].update(e=3)
+        d["a"] = 2
+        self.assertEqual(snapshot["a"], 1, "Snapshot changed with the dict!")
+        thawed = copy.deepcopy(snapshot)
+        thawed["b"]["c"].append(3)
+        self.assertEqual(thawed["b"]["c"], [1, 2, 3], "Copy not writable!")
+
+    def test_readPreference(self):
+        d = MongoDict(
+            self.collection,
+            name="testname",
+            default_value={"a": 1, "b": {"c": 2}},
+            read_preference=ReadPreference.SECONDARY_PREFERRED,
+        )
+        self.assertEqual(
+            d._reader.read_preference,
+            ReadPreference.SECONDARY_PREFERRED,
+            "Read preference not set!",
+        )
+        self.assertEqual(
+            d["b"].read_preference,
+            ReadPreference.SECONDARY_PREFERRED,
+            "Read preference not passed to nested containers!",
+        )
+        with patch.object(
+            d._reader, "find_one", wraps=d._reader.find_one
+        ) as secondary, patch.object(
+            self.collection, "find_one", wraps=self.collection.find_one
+        ) as primary:
+            self.assertEqual(d["a"], 1, "Value not read correctly!")
+            self.assertEqual(d.snapshot()["b"], {"c": 2}, "Bad snapshot!")
+            self.assertEqual(secondary.call_count, 2, "Reads not sent to secondaries!")
+            d.update({"b": {"c": 3}})
+            self.assertGreater(primary.call_count, 0, "Versioned read not on primary!")
+        self.assertEqual(d["b"], {"c": 3}, "Value not set correctly!")
@@ -0,0 +1,99 @@
+from unittest import TestCase
+from mongoshelve import MongoDict, MongoList
+from mongoshelve.diff import diff_update
+from pymongo import MongoClient
+
+
+class TestDiff(TestCase):
+    def setUp(self):
+        self.collection = MongoClient()["test_db"]["test_collection"]
+        pass
+
+    def tearDown(self):
+        self.collection.drop()
+        pass
+
+    def test_diffUpdate(self):
+        old = {"a": 1, "b": {"c": 2, "d": 3}, "e": [1, 2], "f": [1, 2, 3], "g": 4}
+        new = {"a": 1, "b": {"c": 5, "d": 3}, "e": [1, 2, 3], "f": [1, 7, 3], "h": 6}
+        self.assertEqual(
+            diff_update(old, new, "contents"),
+            {
+                "$set": {"contents.b.c": 5, "contents.f.1": 7, "contents.h": 6},
+                "$unset": {"contents.g": ""},
+                "$push": {"contents.e": {"$each": [3]}},
+            },
+            "Bad diff!",
+        )
+        self.assertEqual(diff_update(old, dict(old), "contents"), {}, "Bad empty diff!")
+        self.assertEqual(
+            diff_update({"a": {"b": 1}}, {"a": {"c": 2}}, "contents"),
+            {"$set": {"contents.a": {"c": 2}}},
+            "Fully changed dict not replaced!",
+        )
+        self.assertEqual(
+            diff_update([1, 2, 3], [1, 2], "contents"),
+            {"$set": {"contents": [1, 2]}},
+            "Shortened list not replaced!",
+        )
+        self.assertEqual(
+            diff_update({"a": 1}, {"a": True}, "contents"),
+            {"$set": {"contents.a": True}},
+            "Booleans compared as numbers!",
+        )
+
+    def test_deltaWrites(self):
+        default = {"config": {"rate": 1, "names": ["x", "y"]}, "other": 2}
+        d = MongoDict(self.collection, name="testname", default_value=default)
+        self.collection.update_one(
+            {"name": "testname"}, {"$set": {"contents.config.extra": 3}}
+        )
+        d.update({"config": {"rate": 2, "names": ["x", "y"], "extra": 3}})
+        self.assertEqual(
+            d["config"],
+            {"rate": 2, "names": ["x", "y"], "extra": 3},
+            "Value not set correctly!",
+        )
+
+        writes = []
+        find_one_and_update = self.collection.find_one_and_update
+
+        def record(filter, update, **kwargs):
+            writes.append(update)
+            return find_one_and_update(filter, update, **kwargs)
+
+        self.collection.find_one_and_update = record
+        try:
+            d.update({"config": {"rate": 2, "names": ["x", "y", "z"], "extra": 3}})
+            d.default_value = {"config": {"rate": 1, "names": ["x", "y", "z"]}}
+            d.apply_default_value(overwrite=True)
+        finally:
+            del self.collection.find_one_and_update
+        self.assertEqual(
+            writes[0]["$push"],
+            {"contents.config.names": {"$each": ["z"]}},
+            "Append not written as a $push!",
+        )
+        self.assertNotIn("$set", writes[0], "Unchanged fields were written!")
+        self.assertEqual(
+            writes[1]["$set"],
+            {"contents.config.rate": 1},
+            "Bad overwrite!",
+        )
+        self.assertEqual(
+            writes[1]["$unset"],
+            {"contents.config.extra": "", "contents.other": ""},
+            "Removed fields not unset!",
+        )
+        self.assertEqual(d, d.default_value, "Value not set correctly!")
+
+        l = MongoList(self.collection, name="testlist", default_value=[1, 2])
+        l.default_value = [1, 2, 3]
+        l.apply_default_value(overwrite=True)
+        self.assertEqual(l, [1, 2, 3], "List was not overwritten!")
+        MongoList(self.collection, name="new", default_value=[1]).apply_default_value(
+            overwrite=True
+        )
+        self.assertEqual(
+            MongoList(self.collection, name="new"), [1], "New list not written!"
+        )
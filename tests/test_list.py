@@ -1,6 +1,7 @@
 from unittest import TestCase
+from unittest.mock import patch
 from uuid import UUID
-from mongoshelve import MongoDict, MongoList
+from mongoshelve import FrozenList, MongoDict, MongoList, VersionConflictError
 from pymongo import MongoClient
 
 
@@ -67,3 +68,174 @@ class TestMongoList(TestCase):
             d.append([1, 2])
         with self.assertRaises(ValueError):
             d.append({"test": "value"})
+
+    def test_listMutations(self):
+        for cache in [False, True]:
+            with self.subTest(cache=cache):
+                self._test_listMutations(cache)
+                self.collection.drop()
+
+    def _test_listMutations(self, cache):
+        reference = [3, 1, 2, 1, 5]
+        d = MongoList(
+            self.collection, name="testname", default_value=reference, cache=cache
+        )
+
+        for mutate in [
+            lambda l: l.insert(-1, 7),
+            lambda l: l.insert(100, 8),
+            lambda l: l.pop(0),
+            lambda l: l.pop(2),
+            lambda l: l.pop(-2),
+            lambda l: l.remove(1),
+            lambda l: l.__setitem__(-1, 9),
+            lambda l: l.__setitem__(0, 4),
+            lambda l: l.sort(),
+            lambda l: l.sort(reverse=True),
+            lambda l: l.reverse(),
+            lambda l: l.extend([6, 6]),
+        ]:
+            self.assertEqual(mutate(d), mutate(reference), "Return value mismatch!")
+            self.assertEqual(d, reference, "Mutation not applied correctly!")
+
+        d += [0]
+        d *= 2
+        reference += [0]
+        reference *= 2
+        self.assertEqual(d, reference, "In-place operators not applied correctly!")
+
+        with self.assertRaises(IndexError):
+            d[100] = 1
+        with self.assertRaises(IndexError):
+            d.pop(-100)
+        with self.assertRaises(ValueError):
+            d.remove(1000)
+        self.assertEqual(d, reference, "Failed mutations changed the list!")
+        self.assertEqual(
+            MongoList(self.collection, name="testname"),
+            reference,
+            "Database and cache out of sync!",
+        )
+
+    def test_pointReads(self):
+        reference = list(range(10))
+        d = MongoList(self.collection, name="testname", default_value=reference)
+        for i in [0, 3, 9, -1, -10]:
+            self.assertEqual(d[i], reference[i], f"Index {i} not read correctly!")
+        for i in [10, -11]:
+            with self.assertRaises(IndexError):
+                d[i]
+        for x in [
+            slice(None),
+            slice(2, None),
+            slice(2, 5),
+            slice(5, 2),
+            slice(-3, None),
+            slice(-3, -1),
+            slice(1, -1),
+            slice(None, None, 2),
+            slice(20, None),
+        ]:
+            self.assertEqual(d[x], reference[x], f"Slice {x} not read correctly!")
+        self.assertEqual(len(d), 10, "Length not read correctly!")
+        self.assertEqual(list(reversed(d)), reference[::-1], "Not reversed correctly!")
+
+    def test_serverSideSearch(self):
+        reference = [1, 2, True, 2, "a", 1.5]
+        for cache in [False, True]:
+            with self.subTest(cache=cache):
+                d = MongoList(
+                    self.collection,
+                    name=f"testname{cache}",
+                    default_value=reference,
+                    cache=cache,
+                )
+                self.assertEqual(d.count(2), 2, "Bad count!")
+                self.assertEqual(d.count(True), 1, "Booleans counted as numbers!")
+                self.assertEqual(d.count(3), 0, "Bad count of missing value!")
+                self.assertEqual(d.index(2), 1, "Bad index!")
+                self.assertEqual(d.index(2, 2), 3, "Bad index with start!")
+                self.assertEqual(d.index(2, -3), 3, "Bad index with negative start!")
+                self.assertEqual(d.index(1.5), 5, "Last element not found!")
+                with self.assertRaises(ValueError):
+                    d.index(2, 0, 1)
+                with self.assertRaises(ValueError):
+                    d.index(7)
+                self.assertIn("a", d, "Value not found!")
+                self.assertNotIn("b", d, "Missing value found!")
+                self.assertNotIn(reference, d, "Whole list found as element!")
+
+    def test_streamingIteration(self):
+        d = MongoList(
+            self.collection, name="testname", default_value=list(range(10)), page_size=3
+        )
+        with patch.object(
+            self.collection, "find_one", wraps=self.collection.find_one
+        ) as find_one:
+            self.assertEqual(list(d), list(range(10)), "Values not iterated correctly!")
+        self.assertEqual(
+            find_one.call_count, 4, "Iteration should read one page per query!"
+        )
+        d.extend([10, 11])
+        self.assertEqual(list(d), list(range(12)), "Full last page not handled!")
+        self.assertEqual(
+            list(MongoList(self.collection, name="empty")), [], "Bad empty iteration!"
+        )
+
+    def test_concurrentReadModifyWrite(self):
+        d = MongoList(self.collection, name="testname", default_value=[3, 1, 2])
+        other = MongoList(self.collection, name="testname")
+        interrupted = []
+
+        def key(x):
+            if len(interrupted) == 0:
+                interrupted.append(x)
+                other.append(0)  # another writer gets in between the read and write
+            return x
+
+        d.sort(key=key)
+        self.assertEqual(d, [0, 1, 2, 3], "Concurrent write was lost!")
+        d[1:3] = [5]
+        self.assertEqual(d, [0, 5, 3], "Bad slice assignment!")
+
+        def always(x):
+            other[0] = x
+            return x
+
+        d.max_retries = 2
+        with self.assertRaises(VersionConflictError):
+            d.sort(key=always)
+
+    def test_cache(self):
+        d = MongoList(self.collection, name="testname", default_value=[1], cache=True)
+        other = MongoList(self.collection, name="testname")
+        self.assertEqual(d, [1], "Value not read correctly!")
+        d.append(2)
+        self.assertEqual(d._cache, [1, 2], "Local write not applied to cache!")
+        other.append(3)
+        self.assertEqual(d[-1], 3, "Cache not refreshed after external write!")
+
+        ttl = MongoList(self.collection, name="testname", cache=True, cache_ttl=60)
+        self.assertEqual(ttl, [1, 2, 3], "Value not read correctly!")
+        other.append(4)
+        self.assertEqual(ttl, [1, 2, 3], "Cache should be served within its ttl!")
+        ttl.append(5)
+        self.assertEqual(ttl, [1, 2, 3, 4, 5], "Cache not refreshed after conflict!")
+
+    def test_snapshot(self):
+        d = MongoList(self.collection, name="testname", default_value=[1, 2])
+        snapshot = d.snapshot()
+        self.assertEqual(snapshot, [1, 2], "Bad snapshot!")
+        self.assertIsInstance(snapshot, FrozenList, "Not frozen!")
+        with self.assertRaises(TypeError):
+            snapshot.append(3)
+        with self.assertRaises(TypeError):
+            snapshot += [3]
+        d.append(3)
+        self.assertEqual(snapshot, [1, 2], "Snapshot changed with the list!")
+
+        cached = MongoList(self.collection, name="testname", cache=True)
+        self.assertEqual(cached.snapshot(), [1, 2, 3], "Bad cached snapshot!")
+        with self.assertRaises(TypeError):
+            cached.snapshot().sort(reverse=True)
+        self.assertEqual(cached._cache, [1, 2, 3], "Cache was modified!")
@@ -0,0 +1,122 @@
+import os
+import tempfile
+from contextlib import ExitStack
+from unittest import TestCase
+from unittest.mock import patch
+from mongoshelve import MongoDict, MongoList, ShelfMirror
+from pymongo import MongoClient
+from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
+
+# every collection method that sends a command, so that nothing reaches the server
+UNREACHABLE_METHODS = (
+    "aggregate",
+    "bulk_write",
+    "find",
+    "find_one",
+    "find_one_and_delete",
+    "find_one_and_update",
+    "update_one",
+)
+
+
+class TestMirror(TestCase):
+    def setUp(self):
+        self.collection = MongoClient()["test_db"]["test_collection"]
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "mirror.db")
+        self.mirrors = []
+        pass
+
+    def tearDown(self):
+        for mirror in self.mirrors:
+            mirror.close()
+        self.directory.cleanup()
+        self.collection.drop()
+        pass
+
+    def restart(self) -> ShelfMirror:
+        """Opens the mirror file anew, as a restarted process would."""
+        mirror = ShelfMirror(self.path)
+        self.mirrors.append(mirror)
+        return mirror
+
+    def test_warmStart(self):
+        d = MongoDict(
+            self.collection,
+            name="testname",
+            default_value={"a": 1},
+            mirror=self.restart(),
+        )
+        self.assertEqual(d["a"], 1, "Value not read correctly!")
+        d["b"] = 2
+        d.close()
+
+        with patch.object(
+            self.collection, "find_one", wraps=self.collection.find_one
+        ) as find_one:
+            e = MongoDict(self.collection, name="testname", mirror=self.restart())
+            self.assertEqual(e._cache, {"a": 1, "b": 2}, "Mirror not loaded!")
+            self.assertEqual(e["b"], 2, "Value not read correctly!")
+        self.assertEqual(find_one.call_count, 1, "Unchanged value downloaded again!")
+        self.assertEqual(
+            find_one.call_args.kwargs["projection"],
+            {"_id": 0, "version": 1},
+            "Only the version should be checked!",
+        )
+
+        MongoDict(self.collection, name="testname")["a"] = 3
+        f = MongoDict(self.collection, name="testname", mirror=self.restart())
+        self.assertEqual(f["a"], 3, "Changed value not downloaded!")
+        g = MongoDict(self.collection, name="testname", mirror=self.restart())
+        self.assertEqual(g._cache, {"a": 3, "b": 2}, "Download not mirrored!")
+
+    def test_fallback(self):
+        l = MongoList(
+            self.collection,
+            name="testname",
+            default_value=[1, 2],
+            mirror=self.restart(),
+        )
+        self.assertEqual(l, [1, 2], "Value not read correctly!")
+        with ExitStack() as unreachable:
+            for method in UNREACHABLE_METHODS:
+                unreachable.enter_context(
+                    patch.object(
+                        self.collection,
+                        method,
+                        side_effect=ServerSelectionTimeoutError("unreachable"),
+                    )
+                )
+            with self.assertRaises(ConnectionFailure):
+                MongoList(self.collection, name="testname", mirror=self.restart())
+
+            m = MongoList(
+                self.collection,
+                name="testname",
+                mirror=self.restart(),
+                mirror_fallback=True,
+            )
+            self.assertEqual(m[1], 2, "Not served from the mirror!")
+            with self.assertRaises(ConnectionFailure):
+                m[0] = 3
+            with self.assertRaises(ConnectionFailure):
+                m.append(3)
+        self.assertEqual(l, [1, 2], "Value should not change!")
+
+    def test_openMany(self):
+        names = ["a", "b", "c"]
+        MongoDict.open_many(
+            self.collection,
+            names,
+            defaults={name: {"x": 1} for name in names},
+            mirror=self.restart(),
+        )
+        MongoDict(self.collection, name="b")["x"] = 2
+        with patch.object(self.collection, "find", wraps=self.collection.find) as find:
+            shelves = MongoDict.open_many(self.collection, names, mirror=self.restart())
+        self.assertEqual(find.call_count, 2, "Bad number of round trips!")
+        self.assertEqual(
+            find.call_args.args[0], {"name": {"$in": ["b"]}}, "Unchanged downloaded!"
+        )
+        self.assertEqual(shelves["a"]._cache, {"x": 1}, "Mirror not loaded!")
+        self.assertEqual(shelves["b"]._cache, {"x": 2}, "Download not cached!")
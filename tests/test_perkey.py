@@ -0,0 +1,127 @@
+from unittest import TestCase
+from unittest.mock import patch
+from mongoshelve import MongoDict, PerKeyMongoDict
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
+
+
+class TestPerKeyMongoDict(TestCase):
+    def setUp(self):
+        self.collection = MongoClient()["test_db"]["test_collection"]
+        pass
+
+    def tearDown(self):
+        self.collection.drop()
+        pass
+
+    def test_perKeyDict(self):
+        d = MongoDict(
+            self.collection, name="testdict", default_value={"a": 1}, layout="per_key"
+        )
+        self.assertIsInstance(d, PerKeyMongoDict, "Layout not selected!")
+        d["b.c"] = {"$d": [1, 2]}
+        d["e"] = "hello"
+        self.assertEqual(d["a"], 1, "Default value not set correctly!")
+        self.assertEqual(d["e"], "hello", "Value not set correctly!")
+        self.assertEqual(
+            self.collection.count_documents({"shelf": "testdict"}),
+            3,
+            "Keys not stored in separate documents!",
+        )
+        self.assertEqual(len(d), 3, "Length not correct!")
+        self.assertIn("b.c", d, "Key not found!")
+        self.assertNotIn("x", d, "Missing key found!")
+        self.assertEqual(list(d), ["a", "b.c", "e"], "Keys not iterated in order!")
+
+        d["b.c"]["$d"].append(3)
+        self.assertEqual(d["b.c"], {"$d": [1, 2, 3]}, "Nested value not modified!")
+
+        d.update({"f": 2, "a": 0})
+        self.assertEqual(
+            dict(d.items()),
+            {"a": 0, "b.c": {"$d": [1, 2, 3]}, "e": "hello", "f": 2},
+            "Update not applied correctly!",
+        )
+        self.assertEqual(d.find({"$gte": 2}), {"f": 2}, "Bad find!")
+        self.assertEqual(
+            d.select(["e", "f", "missing"]), {"e": "hello", "f": 2}, "Bad select!"
+        )
+        self.assertEqual(d.pop("e"), "hello", "Bad pop!")
+        self.assertEqual(d.popitem(), ("f", 2), "Bad popitem!")
+        del d["a"]
+        with self.assertRaises(KeyError):
+            del d["a"]
+        with self.assertRaises(KeyError):
+            d["a"]
+        self.assertEqual(d.setdefault("g", 5), 5, "Bad setdefault!")
+        self.assertEqual(d.setdefault("g", 6), 5, "setdefault overwrote value!")
+
+        reopened = MongoDict(
+            self.collection, name="testdict", default_value={"a": 1}, layout="per_key"
+        )
+        self.assertEqual(
+            reopened, {"b.c": {"$d": [1, 2, 3]}, "g": 5}, "Default value reapplied!"
+        )
+        reopened.clear()
+        self.assertEqual(len(d), 0, "Dict not cleared!")
+
+        MongoDict(self.collection, name="otherdict")
+        with self.assertRaises(ValueError):
+            MongoDict(self.collection, name="otherdict", layout="per_key")
+
+    def test_atomicUpdates(self):
+        d = MongoDict(
+            self.collection, name="testdict", default_value={"n": 1}, layout="per_key"
+        )
+        self.assertEqual(d.incr("n", 2), 3, "Bad increment!")
+        self.assertEqual(d.incr("new"), 1, "Missing key not created!")
+        self.assertEqual(d.mul("n", 2), 6, "Bad multiplication!")
+        self.assertEqual(d.set_max("n", 4), 6, "Smaller value set as maximum!")
+        self.assertEqual(d.set_min("n", 4), 4, "Bad minimum!")
+        self.assertEqual(d.copy(), {"n": 4, "new": 1}, "Value not set correctly!")
+
+    def test_indexCreatedOnce(self):
+        collection = self.collection.database["test_index_once"]
+        Collection = type(collection)
+        with patch.object(
+            Collection,
+            "create_index",
+            autospec=True,
+            side_effect=Collection.create_index,
+        ) as create_index:
+            PerKeyMongoDict(collection, name="a")
+            PerKeyMongoDict(collection, name="b")
+            MongoDict(collection, name="c", layout="per_key")
+        collection.drop()
+        self.assertEqual(create_index.call_count, 1, "Index created on every open!")
+
+    def test_setManyDuplicateKey(self):
+        d = PerKeyMongoDict(self.collection, name="testdict")
+        Collection = type(self.collection)
+        original = Collection.bulk_write
+        calls = []
+
+        def bulk_write(collection, operations, **kwargs):
+            calls.append(len(operations))
+            if len(calls) == 1:
+                # another process inserts "b" between the lookup and the upsert
+                original(collection, operations, **kwargs)
+                raise BulkWriteError(
+                    {"writeErrors": [{"index": 1, "code": 11000, "errmsg": "dup"}]}
+                )
+            return original(collection, operations, **kwargs)
+
+        with patch.object(
+            Collection, "bulk_write", autospec=True, side_effect=bulk_write
+        ):
+            d.update({"a": 1, "b": 2})
+        self.assertEqual(calls, [2, 1], "Colliding upserts not retried!")
+        self.assertEqual(d.copy(), {"a": 1, "b": 2}, "Value not set correctly!")
+        with patch.object(
+            Collection,
+            "bulk_write",
+            autospec=True,
+            side_effect=BulkWriteError({"writeErrors": [{"index": 0, "code": 2}]}),
+        ):
+            with self.assertRaises(BulkWriteError):
+                d.update({"a": 3})
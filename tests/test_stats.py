@@ -0,0 +1,81 @@
+from unittest import TestCase
+from mongoshelve import (
+    STATS_LISTENER,
+    MongoDict,
+    MongoList,
+    disable_stats,
+    enable_stats,
+    reset_stats,
+    stats,
+)
+from pymongo import MongoClient
+
+
+class TestStats(TestCase):
+    def setUp(self):
+        self.collection = MongoClient(event_listeners=[STATS_LISTENER])["test_db"][
+            "test_collection"
+        ]
+        pass
+
+    def tearDown(self):
+        disable_stats()
+        reset_stats()
+        self.collection.drop()
+        pass
+
+    def test_roundTrips(self):
+        d = MongoDict(self.collection, name="testdict", default_value={"a": 1, "b": 2})
+        l = MongoList(self.collection, name="testlist", default_value=[1, 2, 3])
+        exported = []
+        d["a"]  # not recorded while disabled
+        enable_stats(exporter=exported.append)
+        self.assertEqual(d["a"], 1, "Value not read correctly!")
+        self.assertEqual(d.get("b"), 2, "Value not read correctly!")
+        self.assertEqual(d.popitem(), ("b", 2), "Bad popitem!")
+        self.assertEqual(list(l), [1, 2, 3], "Values not iterated correctly!")
+
+        recorded = stats()
+        self.assertEqual(
+            recorded["testdict"]["MongoDict.__getitem__"]["calls"], 1, "Bad calls!"
+        )
+        self.assertEqual(
+            recorded["testdict"]["MongoDict.__getitem__"]["round_trips"],
+            1,
+            "Bad round trips!",
+        )
+        self.assertEqual(
+            recorded["testdict"]["MongoDict.get"]["round_trips"],
+            1,
+            "Nested calls should be attributed to the outer method!",
+        )
+        self.assertEqual(
+            recorded["testdict"]["MongoDict.popitem"]["round_trips"],
+            2,
+            "Bad round trips!",
+        )
+        self.assertEqual(
+            recorded["testlist"]["MongoList.__iter__"]["round_trips"],
+            1,
+            "Lazy iteration not attributed!",
+        )
+        popitem = recorded["testdict"]["MongoDict.popitem"]
+        self.assertGreater(popitem["bytes_sent"], 0, "Bytes sent not recorded!")
+        self.assertGreater(popitem["bytes_received"], 0, "Bytes received not recorded!")
+        self.assertEqual(
+            sum(popitem["latency_histogram"].values()), 1, "Bad latency histogram!"
+        )
+        self.assertEqual(
+            exported[0]["method"], "MongoDict.__getitem__", "Call not exported!"
+        )
+        self.assertEqual(exported[0]["round_trips"], 1, "Call not exported!")
+
+        with self.assertRaises(KeyError):
+            d["missing"]
+        self.assertEqual(
+            stats()["testdict"]["MongoDict.__getitem__"]["errors"],
+            1,
+            "Error not recorded!",
+        )
+        reset_stats()
+        self.assertEqual(stats(), {}, "Stats not reset!")
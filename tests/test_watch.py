@@ -0,0 +1,103 @@
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+from mongoshelve import MongoDict, MongoList
+from pymongo import MongoClient
+
+
+class TestShelfWatcher(TestCase):
+    def setUp(self):
+        self.collection = MongoClient()["test_db"]["test_collection"]
+        pass
+
+    def tearDown(self):
+        self.collection.drop()
+        pass
+
+    def test_watchDict(self):
+        changes = []
+        changed = threading.Event()
+
+        def on_change(value):
+            changes.append(value)
+            changed.set()
+
+        d = MongoDict(self.collection, name="testname", default_value={"a": 1})
+        d.watch(on_change=on_change, poll_interval=0.05)
+        self.assertTrue(d.watching, "Watcher not started!")
+
+        other = MongoDict(self.collection, name="testname")
+        other["b"] = 2
+        self.assertTrue(changed.wait(5), "Change was not picked up by the watcher!")
+        self.assertEqual(changes[-1], {"a": 1, "b": 2}, "Wrong value passed to hook!")
+
+        with patch.object(
+            self.collection, "find_one", wraps=self.collection.find_one
+        ) as find_one:
+            self.assertEqual(d, {"a": 1, "b": 2}, "Mirror not updated!")
+            self.assertEqual(d["b"], 2, "Mirror not updated!")
+        # the watcher thread may poll in the meantime, but reads should not query
+        self.assertLessEqual(find_one.call_count, 1, "Reads went to the database!")
+
+        d["c"] = 3
+        self.assertEqual(other, d, "Local write not applied to mirror!")
+        d.close()
+        self.assertFalse(d.watching, "Watcher not stopped!")
+
+    def test_watchNested(self):
+        d = MongoDict(
+            self.collection, name="testname", default_value={"x": {"a": 1}, "l": [1]}
+        )
+        d.watch(poll_interval=60)
+        d["x"]["b"] = 2
+        d["l"].append(2)
+        self.assertEqual(
+            d.copy(),
+            {"x": {"a": 1, "b": 2}, "l": [1, 2]},
+            "Nested write not applied to mirror!",
+        )
+        self.assertEqual(d["x"]["b"], 2, "Nested write not applied to mirror!")
+        d.close()
+
+    def test_watchFilter(self):
+        d = MongoDict(
+            self.collection, name="testname", default_value={"l": [1]}, layout="per_key"
+        )
+        pipelines = []
+        opened = threading.Event()
+
+        def watch(collection, pipeline, **kwargs):
+            pipelines.append(pipeline)
+            opened.set()
+            raise NotImplementedError
+
+        with patch.object(
+            type(self.collection), "watch", autospec=True, side_effect=watch
+        ):
+            l = d["l"]
+            l.watch(poll_interval=60)
+            self.assertTrue(opened.wait(5), "Change stream not opened!")
+        self.assertEqual(
+            pipelines,
+            [
+                [
+                    {
+                        "$match": {
+                            "fullDocument.shelf": "testname",
+                            "fullDocument.key": "l",
+                        }
+                    }
+                ]
+            ],
+            "Change stream not filtered on the shelf's document!",
+        )
+        l.close()
+
+    def test_watchList(self):
+        changed = threading.Event()
+        l = MongoList(self.collection, name="testname", default_value=[1])
+        l.watch(on_change=lambda value: changed.set(), poll_interval=0.05)
+        MongoList(self.collection, name="testname").append(2)
+        self.assertTrue(changed.wait(5), "Change was not picked up by the watcher!")
+        self.assertEqual(l, [1, 2], "Mirror not updated!")
+        l.stop_watching()
@@ -0,0 +1,148 @@
+import gc
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import patch
+from mongoshelve import MongoDict, MongoList
+from mongoshelve import writebehind
+from pymongo import MongoClient
+
+
+class TestWriteBehind(TestCase):
+    def setUp(self):
+        self.collection = MongoClient()["test_db"]["test_collection"]
+        pass
+
+    def tearDown(self):
+        self.collection.drop()
+        pass
+
+    def test_writeBehindDict(self):
+        d = MongoDict(
+            self.collection, name="testdict", write_behind=True, flush_interval=60
+        )
+        reader = MongoDict(self.collection, name="testdict")
+        with patch.object(
+            self.collection, "bulk_write", wraps=self.collection.bulk_write
+        ) as bulk_write:
+            for i in range(100):
+                d[str(i)] = i
+            d["nested"] = {"a": [1]}
+            d["nested"]["a"].append(2)
+            del d["0"]
+            self.assertEqual(d.pop("1"), 1, "Pop not served locally!")
+            self.assertEqual(len(d), 99, "Local copy not updated!")
+            self.assertEqual(d["nested"]["a"], [1, 2], "Nested write not applied!")
+            self.assertEqual(len(reader), 0, "Writes were sent before flushing!")
+            with self.assertRaises(KeyError):
+                del d["0"]
+            d.flush()
+            self.assertEqual(bulk_write.call_count, 1, "Writes not sent in bulk!")
+
+        expected = {str(i): i for i in range(2, 100)}
+        expected["nested"] = {"a": [1, 2]}
+        self.assertEqual(reader, expected, "Flushed writes not applied correctly!")
+        d.close()
+
+    def test_writeBehindList(self):
+        l = MongoList(
+            self.collection,
+            name="testlist",
+            default_value=[3, 1],
+            write_behind=True,
+            flush_interval=60,
+        )
+        reader = MongoList(self.collection, name="testlist")
+        l.extend([2, 5])
+        l.insert(0, 4)
+        self.assertEqual(l.pop(1), 3, "Pop not served locally!")
+        l.remove(5)
+        l[0] = 0
+        with self.assertRaises(IndexError):
+            l[10] = 1
+        self.assertEqual(l, [0, 1, 2], "Local copy not updated!")
+        self.assertEqual(reader, [3, 1], "Writes were sent before flushing!")
+        l.close()
+        self.assertEqual(reader, [0, 1, 2], "Writes not flushed on close!")
+
+    def test_backgroundFlush(self):
+        l = MongoList(
+            self.collection, name="testlist", write_behind=True, max_pending=1
+        )
+        reader = MongoList(self.collection, name="testlist")
+        l.append(1)
+        deadline = time.time() + 5
+        while len(reader) == 0 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(reader, [1], "Writes not flushed in the background!")
+        with self.assertRaises(ValueError):
+            l.watch()
+        l.close()
+
+    def test_pendingLimits(self):
+        l = MongoList(
+            self.collection,
+            name="testlist",
+            write_behind=True,
+            flush_interval=60,
+            max_pending=10,
+        )
+        reader = MongoList(self.collection, name="testlist")
+        for i in range(25):
+            l.append(i)
+        deadline = time.time() + 5
+        while len(reader) < 10 and time.time() < deadline:
+            time.sleep(0.01)
+        flushed = reader.copy()
+        self.assertGreaterEqual(len(flushed), 10, "Merged appends not flushed!")
+        self.assertEqual(flushed, list(range(len(flushed))), "Bad flushed values!")
+        l.close()
+
+        l = MongoList(
+            self.collection, name="biglist", write_behind=True, flush_interval=60
+        )
+        reader = MongoList(self.collection, name="biglist")
+        with patch.object(writebehind, "MAX_PENDING_BYTES", 1000):
+            for i in range(3):
+                l.append("x" * 600)
+            deadline = time.time() + 5
+            while len(reader) < 2 and time.time() < deadline:
+                time.sleep(0.01)
+        self.assertGreaterEqual(len(reader), 2, "Large updates not flushed!")
+        l.close()
+        self.assertEqual(len(reader), 3, "Writes not flushed on close!")
+
+    def test_collectedQueue(self):
+        d = MongoDict(
+            self.collection, name="testdict", write_behind=True, flush_interval=60
+        )
+        d["a"] = 1
+        thread = d._queue._thread
+        del d
+        gc.collect()
+        thread.join(5)
+        self.assertFalse(thread.is_alive(), "Thread of collected dict not stopped!")
+        reader = MongoDict(self.collection, name="testdict")
+        self.assertEqual(reader, {"a": 1}, "Writes of collected dict not flushed!")
+
+        threads = threading.active_count()
+        with self.assertRaises(ValueError):
+            MongoDict(
+                self.collection, name="testdict", write_behind=True, mirror=":memory:"
+            )
+        self.assertEqual(threading.active_count(), threads, "Thread started!")
+
+    def test_writeBehindSetMax(self):
+        d = MongoDict(
+            self.collection,
+            name="testdict",
+            default_value={"n": 5},
+            write_behind=True,
+            flush_interval=60,
+        )
+        self.assertIs(d.set_max("n", True), True, "Not compared in BSON order!")
+        self.assertEqual(d.set_min("n", 1), 1, "Not compared in BSON order!")
+        d.close()
+        self.assertEqual(
+            MongoDict(self.collection, name="testdict"), {"n": 1}, "Bad flushed value!"
+        )